@@ -0,0 +1,176 @@
+import os
+import csv
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import cli
+import journal
+import jpegtopdf
+import imagecache
+
+# Keys of a job that are passed to jpegtopdf.create_pdf() as they are
+JOB_OPTIONS = {'quality', 'passthrough', 'writer', 'in_memory', 'max_dim', 'dpi', 'page_size', 'target_bytes',
+               'near_threshold', 'append', 'memory_budget', 'gray_tolerance', 'bitonal'}
+
+
+def read_manifest(manifest_path):
+    """Read a JSONL or CSV manifest and return its jobs as a list of dictionaries.
+
+    Every JSONL line is an object with the keys output and images, and optionally dir
+    and any key in JOB_OPTIONS. CSV files have a header row with the same column names,
+    images are separated by semicolons. A line or row that can't be read is returned
+    as a job with an error key, which run_job() reports as failed, so it doesn't stop
+    the other jobs.
+
+    Positional arguments:
+    manifest_path -- path of the manifest, CSV if it ends with .csv, JSONL otherwise
+    """
+    with open(manifest_path, 'r', newline='') as file:
+        if manifest_path.lower().endswith('.csv'):
+            jobs = []
+            reader = csv.DictReader(file)
+            for row in reader:
+                job = {key: value for key, value in row.items() if value not in (None, '')}
+                job['images'] = [image.strip() for image in job.get('images', '').split(';') if image.strip()]
+                try:
+                    for key in ('quality', 'max_dim', 'dpi', 'near_threshold', 'gray_tolerance'):
+                        if key in job:
+                            job[key] = int(job[key])
+                except ValueError as e:
+                    job = {'output': job.get('output'), 'error': f'Line {reader.line_num}: Invalid {key}: {e}'}
+                    jobs.append(job)
+                    continue
+                for key in ('passthrough', 'in_memory', 'append', 'bitonal'):
+                    if key in job:
+                        job[key] = job[key].lower() in ('1', 'true', 'yes')
+                jobs.append(job)
+            return jobs
+
+        jobs = []
+        for line_number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError as e:
+                job = {'error': f'Line {line_number}: Invalid JSON: {e}'}
+            if not isinstance(job, dict):
+                job = {'error': f'Line {line_number}: Jobs must be JSON objects'}
+            jobs.append(job)
+        return jobs
+
+
+def run_job(job, executor, log_func, cache=None):
+    """Create the pdf file of a job and return its status as a dictionary.
+
+    Exceptions are caught and reported in the status, so one failing job
+    doesn't stop the others. Every job uses its own temp directory which
+    is removed when the job is done, see journal.RunDirectory.
+
+    Positional arguments:
+    job -- dictionary read by read_manifest()
+    executor -- concurrent.futures.Executor used to compress images
+    log_func -- log function
+
+    Keyword arguments:
+    cache -- imagecache.CompressionCache object, None to always compress
+    """
+    status = {'output': job.get('output'), 'pages': len(job.get('images', [])), 'ok': False}
+    if 'error' in job:
+        status.update(error=job['error'], seconds=0.0)
+        return status
+
+    start = time.perf_counter()
+    run_dir = journal.RunDirectory()
+    try:
+        unknown = set(job) - JOB_OPTIONS - {'output', 'images', 'dir'}
+        if unknown:
+            raise ValueError(f'Unknown job keys: {", ".join(sorted(unknown))}')
+        if not job.get('output') or not job.get('images'):
+            raise ValueError('Jobs need an output and at least one image')
+
+        options = {key: value for key, value in job.items() if key in JOB_OPTIONS}
+        for key in ('target_bytes', 'memory_budget'):
+            if isinstance(options.get(key), str):
+                options[key] = cli.parse_size(options[key])
+        jpegtopdf.create_pdf(os.path.join(os.getcwd(), job['output']), job['images'],
+                             im_dir=job.get('dir', os.getcwd()), log_func=log_func,
+                             cache=cache, temp_dir=run_dir.path, executor=executor, **options)
+        status['ok'] = True
+    except Exception as e:
+        status['error'] = f'{type(e).__name__}: {e}'
+    finally:
+        run_dir.release()
+
+    status['seconds'] = round(time.perf_counter() - start, 3)
+    return status
+
+
+def run_batch(jobs, log_func, workers=None, concurrent_jobs=4, cache=None):
+    """Run every job with one shared pool of worker processes and return their statuses in order.
+
+    Up to concurrent_jobs jobs are assembled at the same time, while the images
+    of all of them are compressed by the same workers, so the workers stay busy
+    between jobs and the startup cost of the pool is paid once.
+
+    Positional arguments:
+    jobs -- list of dictionaries read by read_manifest()
+    log_func -- log function
+
+    Keyword arguments:
+    workers -- number of worker processes, None means one per CPU
+    concurrent_jobs -- number of jobs assembled at the same time
+    cache -- imagecache.CompressionCache object, None to always compress
+    """
+    statuses = []
+    with ProcessPoolExecutor(max_workers=workers) as executor, \
+            ThreadPoolExecutor(max_workers=concurrent_jobs) as job_executor:
+        futures = [job_executor.submit(run_job, job, executor, log_func, cache) for job in jobs]
+        for i, future in enumerate(futures):
+            status = future.result()
+            statuses.append(status)
+            if status['ok']:
+                log_func(f'JOB {i} DONE {status["output"]} ({status["pages"]} PAGES, {status["seconds"]}s)')
+            else:
+                log_func(f'JOB {i} FAILED {status["output"]}: {status["error"]}')
+
+    return statuses
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('manifest')
+    parser.add_argument('-w', '--workers', action='store', type=int, default=None)
+    parser.add_argument('-j', '--jobs', action='store', type=int, default=4)
+    parser.add_argument('-r', '--report', action='store', default=None)
+    parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    parser.add_argument('-c', '--cache', action='store_true', default=False)
+    parser.add_argument('--cache-dir', action='store', default=None)
+    parser.add_argument('--cache-mb', action='store', type=int, default=512)
+
+    args = parser.parse_args()
+    jpegtopdf.verbose = args.verbose
+    journal.cleanup_orphans(jpegtopdf.log)
+
+    compression_cache = None
+    if args.cache or args.cache_dir is not None:
+        compression_cache = imagecache.CompressionCache(args.cache_dir, args.cache_mb * 1024 * 1024)
+
+    start = time.perf_counter()
+    results = run_batch(read_manifest(args.manifest), jpegtopdf.log, workers=args.workers,
+                        concurrent_jobs=args.jobs, cache=compression_cache)
+    failed = [status for status in results if not status['ok']]
+
+    for status in results:
+        print(f'{"OK" if status["ok"] else "FAILED":6} {status["seconds"]:8.2f}s  {status["output"]}'
+              + (f'  {status["error"]}' if not status['ok'] else ''))
+    print(f'{len(results) - len(failed)}/{len(results)} jobs done in {time.perf_counter() - start:.2f}s')
+
+    if args.report:
+        with open(args.report, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,305 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import PIL
+from PIL import Image, ImageDraw
+import jpegtopdf
+import pdfparse
+import imagecache
+import instrument
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory is reported as None there
+    resource = None
+
+# Sizes, EXIF orientations, modes and encodings the synthetic images cycle through
+CORPUS_SIZES = [(640, 480), (1600, 1200), (3000, 2000), (4000, 3000), (1200, 1700)]
+CORPUS_ORIENTATIONS = [1, 3, 6, 8]
+CORPUS_MODES = ['RGB', 'RGB', 'L']
+CORPUS_QUALITIES = [75, 85, 95]
+
+# create_pdf() keyword arguments of every benchmarked mode
+MODES = {
+    'sequential': {'workers': 1},
+    'parallel': {'workers': None},
+    'passthrough': {'workers': None, 'passthrough': True},
+    'stream': {'workers': None, 'writer': 'stream'},
+    'compact': {'workers': None, 'writer': 'compact'},
+    'linear': {'workers': None, 'writer': 'linear'},
+    'in_memory': {'workers': None, 'writer': 'stream', 'in_memory': True},
+    'cache_warm': {'workers': None, 'cache': True},
+    'downsample': {'workers': None, 'max_dim': 1600},
+}
+
+
+def generate_corpus(directory, count=24, seed=0):
+    """Write count synthetic JPEG images to directory and return their names.
+
+    The images only depend on count and seed, so every run benchmarks the same input.
+    They cycle through CORPUS_SIZES, CORPUS_ORIENTATIONS, CORPUS_MODES and
+    CORPUS_QUALITIES, every other image is progressive.
+
+    Positional arguments:
+    directory -- directory the images are written to
+
+    Keyword arguments:
+    count -- number of images
+    seed -- seed of the random shapes drawn on the images
+    """
+    os.makedirs(directory, exist_ok=True)
+    names = []
+    for i in range(count):
+        rng = random.Random(seed * 100003 + i)
+        size = CORPUS_SIZES[i % len(CORPUS_SIZES)]
+        mode = CORPUS_MODES[i % len(CORPUS_MODES)]
+
+        # A gradient background with shapes and thin lines gives the encoder both smooth and detailed areas
+        picture = Image.linear_gradient('L').resize(size).convert(mode)
+        draw = ImageDraw.Draw(picture)
+        for _ in range(40):
+            x, y = rng.randrange(size[0]), rng.randrange(size[1])
+            w, h = rng.randrange(10, size[0] // 3), rng.randrange(10, size[1] // 3)
+            color = rng.randrange(256) if mode == 'L' else tuple(rng.randrange(256) for _ in range(3))
+            if rng.random() < 0.5:
+                draw.rectangle([x, y, x + w, y + h], fill=color)
+            else:
+                draw.ellipse([x, y, x + w, y + h], fill=color)
+        for _ in range(200):
+            x, y = rng.randrange(size[0]), rng.randrange(size[1])
+            draw.line([x, y, x + rng.randrange(-80, 80), y + rng.randrange(-80, 80)],
+                      fill=0 if mode == 'L' else (0, 0, 0), width=1)
+
+        exif = Image.Exif()
+        exif[0x0112] = CORPUS_ORIENTATIONS[i % len(CORPUS_ORIENTATIONS)]
+
+        name = f'bench_{i:03d}.jpg'
+        picture.save(os.path.join(directory, name), 'JPEG', quality=CORPUS_QUALITIES[i % len(CORPUS_QUALITIES)],
+                     progressive=i % 2 == 1, exif=exif.tobytes())
+        names.append(name)
+
+    return names
+
+
+def summarize(values):
+    """Return count, mean and percentiles of a list of durations in milliseconds.
+
+    Positional arguments:
+    values -- list of durations in seconds
+    """
+    milliseconds = [value * 1000 for value in values]
+    return {'count': len(milliseconds),
+            'mean_ms': round(sum(milliseconds) / len(milliseconds), 3),
+            'p50_ms': round(instrument.percentile(milliseconds, 50), 3),
+            'p90_ms': round(instrument.percentile(milliseconds, 90), 3),
+            'p99_ms': round(instrument.percentile(milliseconds, 99), 3)}
+
+
+def peak_rss_kb():
+    """Return the peak resident memory of this process plus its largest finished child in kilobytes"""
+    if resource is None:
+        return None
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def first_page(pdf_path):
+    """Return (seconds, bytes) it takes to get to the first page of a pdf file.
+
+    The seconds are the time to open the file and read its first page with pdfparse, which
+    grows with the cross-reference sections and page tree that have to be read first. The bytes
+    are how much of the file has to be downloaded before the first page can be shown: up to
+    the end of the first page section of a linearized file, the whole file otherwise.
+
+    Positional arguments:
+    pdf_path -- path of the pdf file
+    """
+    start = time.perf_counter()
+    with pdfparse.PDFReader(pdf_path) as reader:
+        reader.page_size()
+        seconds = time.perf_counter() - start
+        linearization = reader.linearization()
+    return seconds, linearization['E'] if linearization else os.path.getsize(pdf_path)
+
+
+def benchmark_stages(corpus_dir, names, quality=85):
+    """Time every stage of compressing each image once and return their summaries.
+
+    Stages are: header (open and read EXIF), decode_rotate (open_with_correct_rotation
+    and decoding the pixels) and encode (saving as JPEG in the given quality).
+
+    Positional arguments:
+    corpus_dir -- directory of the images
+    names -- names of the images
+
+    Keyword arguments:
+    quality -- JPEG quality used for encoding
+    """
+    stages = {'header': [], 'decode_rotate': [], 'encode': []}
+    for name in names:
+        start = time.perf_counter()
+        with Image.open(os.path.join(corpus_dir, name)) as picture:
+            jpegtopdf.get_orientation(picture)
+        stages['header'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        picture = jpegtopdf.open_with_correct_rotation(corpus_dir, name)
+        picture.load()
+        stages['decode_rotate'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        picture.save(io.BytesIO(), 'JPEG', optimize=True, quality=quality)
+        stages['encode'].append(time.perf_counter() - start)
+
+    return {stage: summarize(values) for stage, values in stages.items()}
+
+
+def _run_mode(corpus_dir, names, options, repeat, quality):
+    """Run create_pdf() with options repeat times and return the results of the mode.
+
+    This is run in a fresh process for every mode, so the peak memory
+    of one mode isn't hidden by the peak memory of another.
+
+    Positional arguments:
+    corpus_dir -- directory of the images
+    names -- names of the images
+    options -- create_pdf() keyword arguments, 'cache': True means a new cache that is warmed up first
+    repeat -- number of timed runs
+    quality -- JPEG quality
+    """
+    work_dir = tempfile.mkdtemp(prefix='jpegtopdf_bench_')
+    try:
+        options = dict(options)
+        if options.get('cache'):
+            options['cache'] = imagecache.CompressionCache(os.path.join(work_dir, 'cache'))
+            temps = jpegtopdf.create_pdf(os.path.join(work_dir, 'warmup.pdf'), names, quality=quality,
+                                         im_dir=corpus_dir, log_func=lambda msg: None,
+                                         temp_dir=work_dir, **options)
+            jpegtopdf.temp_cleanup(temps, lambda msg: None)
+
+        times = []
+        first_page_times = []
+        output_bytes = first_page_bytes = 0
+        for i in range(repeat):
+            pdf_path = os.path.join(work_dir, f'run{i}.pdf')
+            start = time.perf_counter()
+            temps = jpegtopdf.create_pdf(pdf_path, names, quality=quality, im_dir=corpus_dir,
+                                         log_func=lambda msg: None, temp_dir=work_dir, **options)
+            times.append(time.perf_counter() - start)
+            jpegtopdf.temp_cleanup(temps, lambda msg: None)
+            output_bytes = os.path.getsize(pdf_path)
+            first_page_seconds, first_page_bytes = first_page(pdf_path)
+            first_page_times.append(first_page_seconds)
+            os.remove(pdf_path)
+
+        seconds = instrument.percentile(times, 50)
+        return {'seconds': round(seconds, 4),
+                'pages_per_sec': round(len(names) / seconds, 3),
+                'runs': [round(value, 4) for value in times],
+                'output_bytes': output_bytes,
+                'first_page_ms': round(instrument.percentile(first_page_times, 50) * 1000, 3),
+                'first_page_bytes': first_page_bytes,
+                'peak_rss_kb': peak_rss_kb()}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run_benchmarks(corpus_dir, names, modes, repeat=3, quality=85):
+    """Benchmark every mode in a fresh process and return the results.
+
+    Positional arguments:
+    corpus_dir -- directory of the images
+    names -- names of the images
+    modes -- list of keys of MODES
+
+    Keyword arguments:
+    repeat -- number of timed runs of every mode
+    quality -- JPEG quality
+    """
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for mode in modes:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results[mode] = executor.submit(_run_mode, corpus_dir, names, MODES[mode], repeat, quality).result()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions of results against a baseline.
+
+    A mode regresses when its pages per second drop or its peak memory, output size
+    or the bytes before its first page grow by more than tolerance.
+
+    Positional arguments:
+    results -- results of this run
+    baseline -- results of an earlier run
+    tolerance -- allowed relative change, e.g. 0.1 for 10%
+    """
+    regressions = []
+    for mode, result in results['modes'].items():
+        old = baseline.get('modes', {}).get(mode)
+        if not old:
+            continue
+        if result['pages_per_sec'] < old['pages_per_sec'] * (1 - tolerance):
+            regressions.append(f'{mode}: {result["pages_per_sec"]} pages/sec, was {old["pages_per_sec"]}')
+        for key in ('peak_rss_kb', 'output_bytes', 'first_page_bytes'):
+            if result[key] and old.get(key) and result[key] > old[key] * (1 + tolerance):
+                regressions.append(f'{mode}: {key} {result[key]}, was {old[key]}')
+    return regressions
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output', action='store', default='benchmark.json')
+    parser.add_argument('-n', '--images', action='store', type=int, default=24)
+    parser.add_argument('-s', '--seed', action='store', type=int, default=0)
+    parser.add_argument('-r', '--repeat', action='store', type=int, default=3)
+    parser.add_argument('-q', '--quality', action='store', type=int, default=85)
+    parser.add_argument('-m', '--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    parser.add_argument('--corpus-dir', action='store', default=None)
+    parser.add_argument('--compare', action='store', default=None)
+    parser.add_argument('--tolerance', action='store', type=float, default=0.1)
+
+    args = parser.parse_args()
+
+    corpus_dir = args.corpus_dir or tempfile.mkdtemp(prefix='jpegtopdf_corpus_')
+    try:
+        corpus = generate_corpus(corpus_dir, args.images, args.seed)
+        report = {'meta': {'python': platform.python_version(), 'pillow': PIL.__version__,
+                           'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+                           'images': args.images, 'seed': args.seed, 'repeat': args.repeat,
+                           'quality': args.quality},
+                  'stages': benchmark_stages(corpus_dir, corpus, args.quality),
+                  'modes': run_benchmarks(corpus_dir, corpus, args.modes, args.repeat, args.quality)}
+    finally:
+        if args.corpus_dir is None:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+
+    print(f'{"mode":<12} {"pages/sec":>10} {"seconds":>9} {"peak RSS MB":>12} {"output MB":>10} '
+          f'{"1st page ms":>12} {"1st page MB":>12}')
+    for mode, result in report['modes'].items():
+        rss = f'{result["peak_rss_kb"] / 1024:.1f}' if result['peak_rss_kb'] else '-'
+        print(f'{mode:<12} {result["pages_per_sec"]:>10} {result["seconds"]:>9} {rss:>12} '
+              f'{result["output_bytes"] / 1024 / 1024:>10.2f} {result["first_page_ms"]:>12} '
+              f'{result["first_page_bytes"] / 1024 / 1024:>12.2f}')
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        sys.exit(1 if regressions else 0)
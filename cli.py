@@ -0,0 +1,308 @@
+import os
+import sys
+import json
+import socket
+import argparse
+import datetime
+import platform
+import tempfile
+
+# Page sizes in inches, used to turn a DPI into a pixel size
+PAGE_SIZES = {'A3': (11.69, 16.54), 'A4': (8.27, 11.69), 'A5': (5.83, 8.27),
+              'Letter': (8.5, 11.0), 'Legal': (8.5, 14.0)}
+
+# Kinds of pdf writers, see pdfwriter.open_writer()
+WRITERS = ('fpdf', 'stream', 'compact', 'linear')
+
+# Arguments holding paths, they are relative to the directory of the client
+PATH_ARGUMENTS = ('pdf_file_name', 'images_dir_path', 'cache_dir', 'trace_jsonl', 'profile', 'watch', 'done_dir')
+
+# Arguments that change the pdf file, a conversion is only resumed if they are the same
+JOURNAL_SETTINGS = ('image_list', 'images_dir_path', 'quality', 'passthrough', 'writer', 'max_dim', 'dpi',
+                    'page_size', 'target_size', 'near_duplicates', 'append', 'memory_budget', 'gray_tolerance',
+                    'bitonal')
+
+
+def parse_size(text):
+    """Return a size such as 10MB, 500K or 2000000 in bytes.
+
+    Positional arguments:
+    text -- number of bytes with an optional K, KB, M, MB, G or GB suffix, powers of 1024
+    """
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def default_socket_path():
+    """Return the path of the socket the daemon of this user listens on"""
+    user = os.getuid() if hasattr(os, 'getuid') else os.environ.get('USERNAME', 'user')
+    return os.path.join(tempfile.gettempdir(), f'jpegtopdf-{user}.sock')
+
+
+def build_parser():
+    """Return the argument parser of jpegtopdf.py.
+
+    This module doesn't import PIL or FPDF, so a client can parse
+    its arguments and hand them to the daemon without importing them.
+    -l is required unless --watch is given, see main().
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pdf_file_name')
+    parser.add_argument('-d', '--images_dir_path')
+    parser.add_argument('-l', '--image_list', nargs='+')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    parser.add_argument('-q', '--quality', action='store',
+                        type=int, default=85)
+    parser.add_argument('-w', '--workers', action='store',
+                        type=int, default=None)
+    parser.add_argument('-p', '--passthrough', action='store_true', default=False)
+    parser.add_argument('--writer', choices=list(WRITERS), default='fpdf')
+    parser.add_argument('-m', '--in-memory', action='store_true', default=False)
+    parser.add_argument('--spill-mb', action='store', type=int, default=None)
+    parser.add_argument('-c', '--cache', action='store_true', default=False)
+    parser.add_argument('--cache-dir', action='store', default=None)
+    parser.add_argument('--cache-mb', action='store', type=int, default=512)
+    parser.add_argument('--max-dim', action='store', type=int, default=None)
+    parser.add_argument('--dpi', action='store', type=int, default=None)
+    parser.add_argument('--page-size', choices=list(PAGE_SIZES), default='A4')
+    parser.add_argument('-t', '--target-size', action='store', type=parse_size, default=None)
+    parser.add_argument('--near-duplicates', action='store', type=int, default=None)
+    parser.add_argument('-a', '--append', action='store_true', default=False)
+    parser.add_argument('--memory-budget', action='store', type=parse_size, default=None)
+    parser.add_argument('--gray-tolerance', action='store', type=int, default=None)
+    parser.add_argument('--bitonal', action='store_true', default=False)
+    parser.add_argument('--resume', action='store_true', default=False)
+    parser.add_argument('--watch', action='store', default=None)
+    parser.add_argument('--quiet', action='store', type=float, default=10.0)
+    parser.add_argument('--batch-size', action='store', type=int, default=None)
+    parser.add_argument('--done-dir', action='store', default=None)
+    parser.add_argument('--poll', action='store', type=float, default=None)
+    parser.add_argument('--trace-jsonl', action='store', default=None)
+    parser.add_argument('--trace-summary', action='store_true', default=False)
+    parser.add_argument('--profile', action='store', default=None)
+    parser.add_argument('--trace-memory', action='store_true', default=False)
+    return parser
+
+
+def conversion_options(args):
+    """Return the jpegtopdf.create_pdf() keyword arguments that parsed arguments set as a dictionary.
+
+    Positional arguments:
+    args -- argparse.Namespace returned by the parser of build_parser()
+    """
+    return {'quality': args.quality, 'passthrough': args.passthrough, 'writer': args.writer,
+            'in_memory': args.in_memory,
+            'spill_bytes': args.spill_mb * 1024 * 1024 if args.spill_mb is not None else None,
+            'max_dim': args.max_dim, 'dpi': args.dpi, 'page_size': args.page_size,
+            'target_bytes': args.target_size, 'near_threshold': args.near_duplicates, 'append': args.append,
+            'memory_budget': args.memory_budget, 'gray_tolerance': args.gray_tolerance, 'bitonal': args.bitonal}
+
+
+def resolve_paths(args, cwd):
+    """Make the relative paths in parsed arguments relative to cwd.
+
+    Positional arguments:
+    args -- argparse.Namespace returned by the parser of build_parser()
+    cwd -- directory relative paths are relative to
+    """
+    for name in PATH_ARGUMENTS:
+        if getattr(args, name, None) is not None:
+            setattr(args, name, os.path.join(cwd, getattr(args, name)))
+    if args.images_dir_path is None:
+        args.images_dir_path = cwd
+
+
+def run(args, cwd=None, log_func=None, print_func=print, executor=None, progress_func=None, cancel_event=None):
+    """Create the pdf file of parsed arguments in this process, clean up its temp files and return its path.
+
+    Temp files left by conversions that died are removed first, see journal.cleanup_orphans().
+    The progress is recorded in {pdf file}.journal. If the conversion fails, the journal,
+    the compressed images and the partial file are kept, so running it again with
+    --resume skips the work that was done, otherwise everything is removed.
+
+    Positional arguments:
+    args -- argparse.Namespace returned by the parser of build_parser()
+
+    Keyword arguments:
+    cwd -- directory relative paths in args are relative to, the current directory if None
+    log_func -- log function, jpegtopdf.log if None
+    print_func -- function called with every line of the summary of --trace-summary
+    executor -- concurrent.futures.Executor that compresses the images, see jpegtopdf.create_pdf()
+    progress_func -- function called with (pages added, number of pages) after every page
+    cancel_event -- threading.Event object that cancels the conversion when it is set
+    """
+    import jpegtopdf
+    import journal
+    import imagecache
+    import instrument
+
+    resolve_paths(args, cwd or os.getcwd())
+
+    if log_func is None:
+        jpegtopdf.verbose = args.verbose
+        log_func = jpegtopdf.log
+
+    compression_cache = None
+    if args.cache or args.cache_dir is not None:
+        compression_cache = imagecache.CompressionCache(args.cache_dir, args.cache_mb * 1024 * 1024)
+
+    tracer = None
+    if args.trace_jsonl or args.trace_summary or args.profile or args.trace_memory:
+        sinks = []
+        if args.trace_jsonl:
+            sinks.append(instrument.JSONLinesSink(args.trace_jsonl))
+        if args.trace_summary or args.trace_memory:
+            sinks.append(instrument.SummarySink(print_func))
+        log_func = tracer = instrument.Tracer(log_func, sinks, profile_path=args.profile,
+                                              trace_memory=args.trace_memory)
+
+    journal.cleanup_orphans(log_func)
+    pdf_path = args.pdf_file_name if args.pdf_file_name.endswith('.pdf') else args.pdf_file_name + '.pdf'
+    progress = journal.Journal(pdf_path + '.journal')
+    settings = {name: getattr(args, name) for name in JOURNAL_SETTINGS}
+    resumed = args.resume and progress.load(settings)
+    if args.resume and not resumed:
+        log_func(f'NO INTERRUPTED CONVERSION OF {pdf_path} TO RESUME, STARTING OVER')
+    run_dir = journal.RunDirectory(progress.temp_dir if resumed else None, progress.path)
+    progress.begin(settings, run_dir.path)
+
+    temps = set()
+    interrupted = False
+    try:
+        temps = jpegtopdf.create_pdf(args.pdf_file_name, args.image_list, im_dir=args.images_dir_path,
+                                     log_func=log_func, workers=args.workers, cache=compression_cache,
+                                     executor=executor, progress_func=progress_func, cancel_event=cancel_event,
+                                     temp_dir=run_dir.path, journal=progress, **conversion_options(args))
+    except jpegtopdf.ConversionCancelled as e:
+        temps = e.temp_files
+        raise
+    except BaseException:
+        interrupted = True
+        raise
+    finally:
+        if interrupted:
+            progress.close()
+            run_dir.close()
+            log_func(f'KEEPING {run_dir.path}, RUN AGAIN WITH --resume TO CONTINUE')
+        else:
+            # If called by command-line, cleanup here. If using UI, cleanup is done in closeEvent()
+            jpegtopdf.temp_cleanup(temps, log_func)
+            progress.finish()
+            run_dir.release()
+        if tracer is not None:
+            tracer.close()
+
+    return pdf_path
+
+
+def request(args, socket_path, log_func, print_func=print, progress_func=None):
+    """Send parsed arguments to the daemon, relay what it reports and return the path of the pdf file.
+
+    Raises OSError if no daemon listens on socket_path, before anything is sent.
+    Raises RuntimeError with the error the daemon reported if the conversion failed.
+
+    Positional arguments:
+    args -- argparse.Namespace returned by the parser of build_parser()
+    socket_path -- path of the socket of the daemon
+    log_func -- function called with every log message
+
+    Keyword arguments:
+    print_func -- function called with every line of the summary of --trace-summary
+    progress_func -- function called with (pages added, number of pages) after every page
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        raise OSError('Unix domain sockets are not available')
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except OSError:
+        client.close()
+        raise
+
+    try:
+        with client.makefile('rwb') as stream:
+            stream.write(json.dumps({'args': vars(args), 'cwd': os.getcwd()}).encode('utf-8') + b'\n')
+            stream.flush()
+            for line in stream:
+                message = json.loads(line)
+                if message['type'] == 'log':
+                    log_func(message['msg'])
+                elif message['type'] == 'print':
+                    print_func(message['line'])
+                elif message['type'] == 'progress' and progress_func is not None:
+                    progress_func(message['done'], message['total'])
+                elif message['type'] == 'done':
+                    return message['path']
+                elif message['type'] == 'error':
+                    raise RuntimeError(message['error'])
+        raise RuntimeError('The daemon closed the connection')
+    except OSError as e:
+        raise RuntimeError(f'Lost the connection to the daemon: {e}')
+    finally:
+        client.close()
+
+
+def print_progress(done, total):
+    """Show the number of pages added on the terminal"""
+    if sys.stderr.isatty():
+        sys.stderr.write(f'\r{done}/{total} PAGES' + ('\n' if done == total else ''))
+        sys.stderr.flush()
+
+
+def main(argv=None, use_daemon=True):
+    """Run the command line and return its exit code.
+
+    If use_daemon is True and a daemon listens on the socket, the conversion runs
+    in the daemon and its messages and progress are shown here, otherwise it runs
+    in this process. With --watch, images dropped into a directory are converted
+    in this process until it is interrupted, see watch.run().
+
+    Keyword arguments:
+    argv -- list of arguments, sys.argv[1:] if None
+    use_daemon -- try the daemon before converting in this process
+    """
+    parser = build_parser()
+    if use_daemon:
+        parser.add_argument('--no-daemon', action='store_true', default=False)
+        parser.add_argument('--socket', action='store', default=default_socket_path())
+    args = parser.parse_args(argv)
+    if args.watch is None and not args.image_list:
+        parser.error('the following arguments are required: -l/--image_list')
+
+    def log_func(msg):
+        if args.verbose:
+            print(f'[{str(datetime.datetime.now()).split(".")[0]}]: {msg}')
+
+    if args.watch is not None:
+        import watch
+        watch.run(args, log_func)
+        return 0
+
+    pdf_path = None
+    if use_daemon and not args.no_daemon:
+        try:
+            pdf_path = request(args, args.socket, log_func, progress_func=print_progress)
+        except OSError:
+            # No daemon, fall back to converting in this process
+            pass
+        except RuntimeError as e:
+            print(f'ERROR: {e}', file=sys.stderr)
+            return 1
+
+    if pdf_path is None:
+        pdf_path = run(args, progress_func=print_progress)
+
+    if platform.system() == "Windows":
+        import jpegtopdf
+        print('Do you want to see the exported file in the explorer? (y/n) ', end='')
+        if input() == 'y':
+            jpegtopdf.show_file_in_explorer(pdf_path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+import os
+import json
+import socket
+import argparse
+import threading
+import socketserver
+from concurrent.futures import ProcessPoolExecutor
+import cli
+# Imported once here, so conversions don't pay for importing PIL and FPDF
+import jpegtopdf
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """A class to run the conversion a client sends and stream its messages back
+
+    A client sends one JSON line {"args": arguments, "cwd": directory} and reads JSON lines
+    of the types log, print, progress and finally done or error. If the client
+    disconnects, the conversion is cancelled.
+    """
+
+    def send(self, message):
+        """Send a message to the client as a JSON line, cancel the conversion if the client is gone"""
+        if self.cancel_event.is_set():
+            return
+        try:
+            self.wfile.write(json.dumps(message).encode('utf-8') + b'\n')
+            self.wfile.flush()
+        except OSError:
+            self.cancel_event.set()
+
+    def handle(self):
+        """Run the conversion of one client"""
+        self.cancel_event = threading.Event()
+        try:
+            job = json.loads(self.rfile.readline())
+            args = argparse.Namespace(**job['args'])
+        except (ValueError, KeyError, TypeError) as e:
+            self.send({'type': 'error', 'error': f'Invalid request: {e}'})
+            return
+
+        try:
+            path = cli.run(args, cwd=job.get('cwd'),
+                           log_func=lambda msg: self.send({'type': 'log', 'msg': str(msg)}),
+                           print_func=lambda line: self.send({'type': 'print', 'line': line}),
+                           executor=self.server.executor,
+                           progress_func=lambda done, total: self.send({'type': 'progress',
+                                                                        'done': done, 'total': total}),
+                           cancel_event=self.cancel_event)
+        except jpegtopdf.ConversionCancelled:
+            return
+        except Exception as e:
+            self.send({'type': 'error', 'error': f'{type(e).__name__}: {e}'})
+            return
+
+        self.send({'type': 'done', 'path': path})
+
+
+class JobServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """A class to serve conversions on a Unix domain socket
+
+    Every client is served by its own thread, the images of all of them
+    are compressed by one pool of worker processes that stays alive
+    between conversions.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, workers=None):
+        """Initiate method for JobServer
+
+        Positional arguments:
+        socket_path -- path of the socket
+
+        Keyword arguments:
+        workers -- number of worker processes, None means one per CPU
+        """
+        remove_stale_socket(socket_path)
+        super().__init__(socket_path, JobHandler)
+        os.chmod(socket_path, 0o600)
+        self.socket_path = socket_path
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+
+    def server_close(self):
+        """Stop listening, remove the socket and stop the worker processes"""
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.executor.shutdown()
+
+
+def remove_stale_socket(socket_path):
+    """Remove the socket file of a daemon that isn't running anymore.
+
+    Raises RuntimeError if another daemon is listening on it.
+
+    Positional arguments:
+    socket_path -- path of the socket
+    """
+    if not os.path.exists(socket_path):
+        return
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except OSError:
+        os.remove(socket_path)
+        return
+    finally:
+        probe.close()
+    raise RuntimeError(f'A daemon is already listening on {socket_path}')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--socket', action='store', default=cli.default_socket_path())
+    parser.add_argument('-w', '--workers', action='store', type=int, default=None)
+
+    args = parser.parse_args()
+
+    server = JobServer(args.socket, args.workers)
+    print(f'LISTENING ON {args.socket}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
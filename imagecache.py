@@ -0,0 +1,154 @@
+import os
+import json
+import hashlib
+import platform
+import tempfile
+
+
+def default_cache_dir():
+    """Return the directory the compression cache is kept in when no other directory is given"""
+    if platform.system() == "Windows":
+        base = os.environ.get('LOCALAPPDATA', tempfile.gettempdir())
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'jpegtopdf')
+
+
+class CompressionCache:
+    """A class for a persistent cache of compressed images
+
+    Compressed images are stored as files named after a hash of the source image
+    and the settings they were compressed with, so the same image compressed the
+    same way is never encoded twice, even across runs. The modification time of
+    a file is updated whenever it is used and evict() removes the least recently
+    used files until the cache fits in max_bytes.
+
+    Only the directory and the size limit are stored in the object, so it can be
+    passed to worker processes.
+
+    Methods:
+    key(source_path, settings) -- return the cache key of an image compressed with settings
+    get(key) -- return the path of a cached image or None
+    put(key, data) -- store a compressed image and return its path
+    get_sizes(key) -- return the trial sizes of an image or None
+    put_sizes(key, sizes) -- store the trial sizes of an image
+    evict() -- remove least recently used images until the cache fits in max_bytes
+    """
+
+    def __init__(self, directory=None, max_bytes=512 * 1024 * 1024):
+        """Initiate method for CompressionCache
+
+        Keyword arguments:
+        directory -- directory of the cache, default_cache_dir() if None
+        max_bytes -- size limit of the cache in bytes
+        """
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(source_path, settings):
+        """Return the cache key of an image compressed with the given settings.
+
+        The key is a hash of the contents of the image, not its name,
+        so the EXIF orientation of the image is part of it as well.
+
+        Positional arguments:
+        source_path -- path of the original image
+        settings -- dictionary of every setting that changes the compressed image
+        """
+        digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8'))
+        with open(source_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _path(self, key, extension='.jpg'):
+        """Return the path of the file of key"""
+        return os.path.join(self.directory, key[:2], f'{key}{extension}')
+
+    def _write(self, path, data):
+        """Write data to path under a temporary name and rename it,
+        so other processes never read a partially written file"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, path)
+
+    def get(self, key):
+        """Return the path of the cached image of key and mark it as used, None if it isn't cached.
+
+        Positional arguments:
+        key -- key returned by CompressionCache.key()
+        """
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def put(self, key, data):
+        """Store a compressed image and return its path.
+
+        The file is written under a temporary name and renamed,
+        so other processes never read a partially written image.
+
+        Positional arguments:
+        key -- key returned by CompressionCache.key()
+        data -- compressed image as bytes
+        """
+        path = self._path(key)
+        self._write(path, data)
+        return path
+
+    def get_sizes(self, key):
+        """Return the sizes of an image compressed with every trial quality as {quality: bytes}.
+
+        Returns None if they aren't cached.
+
+        Positional arguments:
+        key -- key returned by CompressionCache.key()
+        """
+        path = self._path(key, '.json')
+        try:
+            with open(path, 'r') as file:
+                sizes = json.load(file)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return {int(quality): size for quality, size in sizes.items()}
+
+    def put_sizes(self, key, sizes):
+        """Store the sizes of an image compressed with every trial quality.
+
+        Positional arguments:
+        key -- key returned by CompressionCache.key()
+        sizes -- dictionary of {quality: bytes}
+        """
+        self._write(self._path(key, '.json'), json.dumps(sizes).encode('utf-8'))
+
+    def evict(self):
+        """Remove least recently used images until the cache fits in max_bytes and return the number of bytes freed"""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        freed = 0
+        for _, size, path in sorted(entries):
+            if total - freed <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            freed += size
+
+        return freed
@@ -0,0 +1,260 @@
+import json
+import time
+import cProfile
+import datetime
+import contextlib
+import tracemalloc
+
+# Returned by span() when nothing is recorded, so disabled instrumentation costs one getattr
+NULL_SPAN = contextlib.nullcontext()
+
+
+def span(log_func, name):
+    """Return a context manager that times a stage named name if log_func records spans.
+
+    Every function that takes a log function can be instrumented this way,
+    plain log functions like jpegtopdf.log get a context manager that does nothing.
+
+    Positional arguments:
+    log_func -- log function, a Recorder object records the span
+    name -- name of the stage, e.g. 'decode' or 'encode'
+    """
+    record_span = getattr(log_func, 'span', None)
+    return record_span(name) if record_span else NULL_SPAN
+
+
+def count(log_func, name, n=1):
+    """Add n to the counter named name if log_func records counters.
+
+    Positional arguments:
+    log_func -- log function, a Recorder object counts
+    name -- name of the counter, e.g. 'bytes_in' or 'cache_hits'
+
+    Keyword arguments:
+    n -- amount to add
+    """
+    add = getattr(log_func, 'count', None)
+    if add:
+        add(name, n)
+
+
+def merge(log_func, recorder):
+    """Add the spans and counters of a Recorder object to log_func if it records them.
+
+    Positional arguments:
+    log_func -- log function
+    recorder -- Recorder object returned by a worker process, or None
+    """
+    add = getattr(log_func, 'merge', None)
+    if add and recorder is not None:
+        add(recorder)
+
+
+def is_recording(log_func):
+    """Return True if log_func records spans and counters"""
+    return isinstance(log_func, Recorder)
+
+
+class Recorder:
+    """A class to collect spans and counters
+
+    A Recorder object can be used as a log function that ignores messages.
+    It only holds lists and dictionaries, so worker processes can return it
+    to the parent process, which merges it into its Tracer.
+
+    Methods:
+    span(name) -- return a context manager that records the duration of a stage
+    record(name, seconds) -- record the duration of a stage
+    count(name, n=1) -- add n to a counter
+    merge(recorder) -- add the spans and counters of another Recorder object
+    """
+
+    def __init__(self):
+        """Initiate method for Recorder"""
+        self.spans = []
+        self.counters = {}
+
+    def __call__(self, msg):
+        """Ignore a log message"""
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """Record the duration of the with block as a stage named name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        """Record the duration of a stage.
+
+        Positional arguments:
+        name -- name of the stage
+        seconds -- duration of the stage
+        """
+        self.spans.append((name, seconds))
+
+    def count(self, name, n=1):
+        """Add n to the counter named name"""
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, recorder):
+        """Add the spans and counters of another Recorder object"""
+        for name, seconds in recorder.spans:
+            self.record(name, seconds)
+        for name, n in recorder.counters.items():
+            self.count(name, n)
+
+
+class Tracer(Recorder):
+    """A class to instrument a run through the log_func parameter
+
+    A Tracer object wraps a log function, so it can be passed anywhere a log function is.
+    Messages are forwarded to the wrapped log function and spans, counters and messages
+    are sent to every sink. Optionally the run is profiled with cProfile and its memory
+    is traced with tracemalloc until close() is called.
+
+    Methods:
+    close() -- stop profiling, send the summary to the sinks and close them
+    """
+
+    def __init__(self, log_func=None, sinks=(), profile_path=None, trace_memory=False):
+        """Initiate method for Tracer
+
+        Keyword arguments:
+        log_func -- log function messages are forwarded to
+        sinks -- list of sink objects, see JSONLinesSink and SummarySink
+        profile_path -- path to write cProfile statistics to, None to not profile
+        trace_memory -- trace the peak memory allocated by Python with tracemalloc
+        """
+        super().__init__()
+        self.log_func = log_func
+        self.sinks = list(sinks)
+        self.profile_path = profile_path
+        self.trace_memory = trace_memory
+
+        self.profiler = None
+        if profile_path:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        if trace_memory:
+            tracemalloc.start()
+
+    def __call__(self, msg):
+        """Forward a log message to the wrapped log function and the sinks"""
+        if self.log_func:
+            self.log_func(msg)
+        for sink in self.sinks:
+            sink.message(msg)
+
+    def record(self, name, seconds):
+        """Record the duration of a stage and send it to the sinks"""
+        super().record(name, seconds)
+        for sink in self.sinks:
+            sink.span(name, seconds)
+
+    def close(self):
+        """Stop profiling and memory tracing, send the summary to the sinks and close them"""
+        if self.profiler:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_path)
+            self.profiler = None
+        if self.trace_memory and tracemalloc.is_tracing():
+            self.counters['python_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        for sink in self.sinks:
+            sink.close(self)
+
+
+def percentile(values, q):
+    """Return the q-th percentile of values using linear interpolation, None if there are none.
+
+    benchmark.py reports its percentiles with this function as well.
+
+    Positional arguments:
+    values -- list of numbers
+    q -- percentile between 0 and 100
+    """
+    values = sorted(values)
+    if not values:
+        return None
+
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summary_lines(recorder):
+    """Return a table of every stage and counter of a Recorder object as a list of lines"""
+    stages = {}
+    for name, seconds in recorder.spans:
+        stages.setdefault(name, []).append(seconds * 1000)
+
+    lines = [f'{"stage":<18}{"count":>7}{"total ms":>11}{"mean ms":>10}{"p50 ms":>10}{"p95 ms":>10}{"max ms":>10}']
+    for name, values in stages.items():
+        values.sort()
+        lines.append(f'{name:<18}{len(values):>7}{sum(values):>11.1f}{sum(values) / len(values):>10.2f}'
+                     f'{percentile(values, 50):>10.2f}{percentile(values, 95):>10.2f}{values[-1]:>10.2f}')
+    for name, n in sorted(recorder.counters.items()):
+        lines.append(f'{name:<18}{n:>7}')
+    return lines
+
+
+class JSONLinesSink:
+    """A sink that writes every span and message to a file as JSON lines
+
+    Every line has a type (span, message or counters), a timestamp and its data.
+    Counters are written once, when the Tracer object is closed.
+    """
+
+    def __init__(self, path):
+        """Initiate method for JSONLinesSink
+
+        Positional arguments:
+        path -- path of the JSON lines file
+        """
+        self.file = open(path, 'a')
+
+    def _write(self, event):
+        """Write one event as a line"""
+        event['time'] = datetime.datetime.now().isoformat()
+        self.file.write(json.dumps(event) + '\n')
+
+    def span(self, name, seconds):
+        """Write a span"""
+        self._write({'type': 'span', 'name': name, 'ms': round(seconds * 1000, 3)})
+
+    def message(self, msg):
+        """Write a log message"""
+        self._write({'type': 'message', 'msg': str(msg)})
+
+    def close(self, recorder):
+        """Write the counters of recorder and close the file"""
+        self._write({'type': 'counters', 'counters': recorder.counters})
+        self.file.close()
+
+
+class SummarySink:
+    """A sink that sends a table of every stage and counter to a function when the Tracer object is closed"""
+
+    def __init__(self, print_func=print):
+        """Initiate method for SummarySink
+
+        Keyword arguments:
+        print_func -- function called with every line of the table
+        """
+        self.print_func = print_func
+
+    def span(self, name, seconds):
+        """Ignore a span, they are summarized when the Tracer object is closed"""
+
+    def message(self, msg):
+        """Ignore a log message"""
+
+    def close(self, recorder):
+        """Send the table of recorder to print_func line by line"""
+        for line in summary_lines(recorder):
+            self.print_func(line)
@@ -0,0 +1,326 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no fcntl, its files are locked with msvcrt instead
+    fcntl = None
+    import msvcrt
+
+# Prefix of the temp directories of conversions, see RunDirectory
+RUN_PREFIX = 'jpegtopdf-run-'
+
+# Files in a run directory, the lock held by its conversion and the path of its journal
+LOCK_NAME = 'owner.lock'
+JOURNAL_LINK_NAME = 'journal.path'
+
+# Seconds a new run directory is left alone, its conversion may not have locked it yet
+ORPHAN_GRACE = 60
+
+# Seconds after which compressed images left directly in the temp directory by older versions are removed
+ORPHAN_AGE = 24 * 60 * 60
+
+
+def _try_lock(file):
+    """Lock an open file for this process and return True, False if another process holds the lock.
+
+    The operating system releases the lock when the file is closed or the process dies, however it ends.
+    """
+    try:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+class RunDirectory:
+    """A class for the temp directory of one conversion
+
+    The directory holds a lock file that stays locked as long as its conversion runs,
+    so cleanup_orphans() can tell the directories of dead conversions from those of running ones.
+    The directory of an interrupted conversion is kept while its journal exists, so it can be resumed.
+
+    Methods:
+    close() -- unlock the directory and keep it, for a conversion that can be resumed
+    release() -- unlock and remove the directory
+    """
+
+    def __init__(self, path=None, journal_path=None, root=None):
+        """Initiate method for RunDirectory
+
+        Raises RuntimeError if another process is using the directory.
+
+        Keyword arguments:
+        path -- directory of an interrupted conversion to take over, a new directory is created if None
+        journal_path -- path of the journal of the conversion, see Journal
+        root -- directory the new directory is created in, the temp directory of the user if None
+        """
+        if path is None:
+            path = tempfile.mkdtemp(prefix=RUN_PREFIX, dir=root)
+        else:
+            os.makedirs(path, exist_ok=True)
+        self.path = path
+
+        self.lock_file = open(os.path.join(path, LOCK_NAME), 'a+')
+        if not _try_lock(self.lock_file):
+            self.lock_file.close()
+            raise RuntimeError(f'{path} is used by another conversion')
+
+        with open(os.path.join(path, JOURNAL_LINK_NAME), 'w') as file:
+            file.write(os.path.abspath(journal_path) if journal_path else '')
+
+    def close(self):
+        """Unlock the directory and keep it with its files"""
+        self.lock_file.close()
+
+    def release(self):
+        """Unlock the directory and remove it with its files"""
+        self.lock_file.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def _resumable(run_dir):
+    """Return True if the journal a dead run directory belongs to still exists and names it"""
+    try:
+        with open(os.path.join(run_dir, JOURNAL_LINK_NAME)) as file:
+            journal_path = file.read()
+    except OSError:
+        return False
+    if not journal_path:
+        return False
+
+    start = Journal(journal_path).first_record()
+    return start is not None and os.path.abspath(start.get('temp_dir', '')) == os.path.abspath(run_dir)
+
+
+def cleanup_orphans(log_func, root=None):
+    """Remove the temp files of conversions that died without cleaning up and return how many were removed.
+
+    Run directories that aren't locked anymore are removed, unless their conversion can be resumed.
+    Compressed images left directly in root, which only older versions did, are removed once they
+    are ORPHAN_AGE seconds old.
+
+    Positional arguments:
+    log_func -- log function
+
+    Keyword arguments:
+    root -- directory to look in, the temp directory of the user if None
+    """
+    root = root or tempfile.gettempdir()
+    now = time.time()
+    removed = 0
+    try:
+        entries = list(os.scandir(root))
+    except OSError:
+        return 0
+
+    for entry in entries:
+        try:
+            age = now - entry.stat().st_mtime
+            if entry.name.startswith(RUN_PREFIX) and entry.is_dir():
+                if age < ORPHAN_GRACE:
+                    continue
+                with open(os.path.join(entry.path, LOCK_NAME), 'a+') as lock_file:
+                    if not _try_lock(lock_file) or _resumable(entry.path):
+                        continue
+                shutil.rmtree(entry.path, ignore_errors=True)
+            elif entry.name.startswith('CMP_') and entry.is_file() and age > ORPHAN_AGE:
+                os.remove(entry.path)
+            else:
+                continue
+        except OSError:
+            continue
+
+        removed += 1
+        log_func(f'REMOVED ORPHANED {entry.path}')
+
+    return removed
+
+
+class Journal:
+    """A class to record the progress of a conversion in a JSON lines file, so an interrupted one can be resumed
+
+    The first line holds the settings of the conversion and its temp directory. Every later line
+    is one step: the duplicates and qualities that were chosen, an image that was compressed to a
+    file or a page that was written to the pdf file. Lines are flushed as soon as they are written,
+    a line cut off by a crash is ignored when the journal is read.
+
+    Methods:
+    first_record() -- return the first line of the journal, None if there is none
+    load(settings) -- read the journal of an interrupted conversion with the same settings
+    begin(settings, temp_dir) -- start recording, after the records read by load()
+    record_plan(aliases, qualities) -- record the duplicates and qualities of the conversion
+    record_append(size) -- record the size of the pdf file pages are appended to
+    record_compressed(name, path, source_path) -- record an image compressed to a file
+    is_current(name, path, source_path) -- return True if a compressed file is recorded and its image is unchanged
+    record_page(index, state) -- record a page written to the pdf file and the state of the writer
+    restart_pages() -- record that the pdf file is written again from its first page
+    close() -- stop recording and keep the journal
+    finish() -- stop recording and remove the journal
+    """
+
+    def __init__(self, path):
+        """Initiate method for Journal
+
+        Positional arguments:
+        path -- path of the journal file
+        """
+        self.path = path
+        self.file = None
+        self.resumed = False
+        self.temp_dir = None
+        self.plan = None
+        self.append_size = None
+        # Name of the image -> (path of the compressed file, modification time, size of the image)
+        self.compressed = {}
+        # States of the writer recorded after every page, see pdfwriter.StreamingPDFWriter.checkpoint()
+        self.writer_states = []
+
+    def _records(self):
+        """Return every complete record of the journal file"""
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                lines = file.read().split('\n')
+        except OSError:
+            return []
+
+        records = []
+        # The last line is empty, or was cut off by a crash
+        for line in lines[:-1]:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+        return records
+
+    def first_record(self):
+        """Return the first record of the journal, None if there is none"""
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                return json.loads(file.readline())
+        except (OSError, ValueError):
+            return None
+
+    def load(self, settings):
+        """Read the journal of an interrupted conversion and return True if it had the same settings.
+
+        Positional arguments:
+        settings -- dictionary of every setting that changes the pdf file, as it is passed to begin()
+        """
+        records = self._records()
+        if not records or records[0].get('type') != 'start' or \
+                records[0].get('settings') != json.loads(json.dumps(settings)):
+            return False
+
+        self.resumed = True
+        self.temp_dir = records[0]['temp_dir']
+        for record in records[1:]:
+            if record['type'] == 'plan':
+                self.plan = record
+            elif record['type'] == 'append':
+                self.append_size = record['size']
+            elif record['type'] == 'compressed':
+                self.compressed[record['name']] = (record['path'], record['mtime_ns'], record['size'])
+            elif record['type'] == 'page':
+                self.writer_states.append(record['writer'])
+            elif record['type'] == 'restart':
+                self.writer_states = []
+        return True
+
+    def begin(self, settings, temp_dir):
+        """Start recording, a journal that wasn't resumed by load() is replaced.
+
+        Positional arguments:
+        settings -- dictionary of every setting that changes the pdf file
+        temp_dir -- directory of the compressed files of the conversion
+        """
+        if self.resumed:
+            self.file = open(self.path, 'a', encoding='utf-8')
+            return
+
+        self.temp_dir = temp_dir
+        self.file = open(self.path, 'w', encoding='utf-8')
+        self._write({'type': 'start', 'settings': settings, 'temp_dir': os.path.abspath(temp_dir)})
+
+    def _write(self, record):
+        """Write a record as a line and flush it"""
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def record_plan(self, aliases, qualities):
+        """Record the duplicates and qualities of the conversion.
+
+        Positional arguments:
+        aliases -- dictionary of {name: name of the image shown instead} returned by jpegtopdf.find_duplicates()
+        qualities -- dictionary of {name: quality} returned by jpegtopdf.search_qualities(), or None
+        """
+        self.plan = {'type': 'plan', 'aliases': aliases, 'qualities': qualities}
+        self._write(self.plan)
+
+    def record_append(self, size):
+        """Record the size of the pdf file before pages are appended to it"""
+        self.append_size = size
+        self._write({'type': 'append', 'size': size})
+
+    def record_compressed(self, name, path, source_path):
+        """Record an image compressed to a file, unless it is already recorded.
+
+        Positional arguments:
+        name -- name of the image file
+        path -- path of the compressed file
+        source_path -- path of the image file
+        """
+        if self.compressed.get(name, (None,))[0] == path:
+            return
+        stat = os.stat(source_path)
+        self.compressed[name] = (path, stat.st_mtime_ns, stat.st_size)
+        self._write({'type': 'compressed', 'name': name, 'path': path,
+                     'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size})
+
+    def is_current(self, name, path, source_path):
+        """Return True if a compressed file is recorded for an image and the image hasn't changed since.
+
+        Positional arguments:
+        name -- name of the image file
+        path -- path of the compressed file
+        source_path -- path of the image file
+        """
+        if name not in self.compressed:
+            return False
+        recorded_path, mtime_ns, size = self.compressed[name]
+        stat = os.stat(source_path)
+        return recorded_path == path and stat.st_mtime_ns == mtime_ns and stat.st_size == size
+
+    def record_page(self, index, state):
+        """Record a page written to the pdf file.
+
+        Positional arguments:
+        index -- index of the page
+        state -- state of the writer returned by its checkpoint() method
+        """
+        self.writer_states.append(state)
+        self._write({'type': 'page', 'index': index, 'writer': state})
+
+    def restart_pages(self):
+        """Record that the pdf file is written again from its first page, the pages recorded so far are forgotten"""
+        self.writer_states = []
+        self._write({'type': 'restart'})
+
+    def close(self):
+        """Stop recording and keep the journal, so the conversion can be resumed"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def finish(self):
+        """Stop recording and remove the journal"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
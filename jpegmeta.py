@@ -0,0 +1,186 @@
+import os
+import struct
+import collections
+
+# SOF markers of every JPEG coding process, DHT (C4), JPG (C8) and DAC (CC) share the range
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+PROGRESSIVE_MARKERS = {0xC2, 0xC6, 0xCA, 0xCE}
+
+# Markers without a length, RST0-RST7 and TEM
+STANDALONE_MARKERS = set(range(0xD0, 0xD8)) | {0x01}
+
+APP1 = 0xE1
+DQT = 0xDB
+ORIENTATION_TAG = 0x0112
+
+# Files the shared index remembers, the least recently used ones are forgotten first
+INDEX_SIZE = 4096
+
+JPEGInfo = collections.namedtuple('JPEGInfo', ['width', 'height', 'components', 'bits', 'progressive',
+                                               'orientation', 'luminance_table'])
+
+
+def exif_orientation(segment):
+    """Return the orientation stored in the EXIF data of an APP1 segment, 1 if it has none.
+
+    Positional arguments:
+    segment -- contents of the APP1 segment after its length
+    """
+    if not segment.startswith(b'Exif\x00\x00'):
+        return 1
+    tiff = segment[6:]
+    if tiff[:2] == b'II':
+        order = '<'
+    elif tiff[:2] == b'MM':
+        order = '>'
+    else:
+        return 1
+
+    try:
+        ifd_offset, = struct.unpack_from(order + 'I', tiff, 4)
+        count, = struct.unpack_from(order + 'H', tiff, ifd_offset)
+        for i in range(count):
+            tag, _, _, value = struct.unpack_from(order + 'HHI2s', tiff, ifd_offset + 2 + 12 * i)
+            if tag == ORIENTATION_TAG:
+                return struct.unpack(order + 'H', value)[0]
+    except struct.error:
+        pass
+    return 1
+
+
+def quantization_tables(segment):
+    """Return the quantization tables of a DQT segment as {table id: tuple of 64 values}.
+
+    Positional arguments:
+    segment -- contents of the DQT segment after its length
+    """
+    tables = {}
+    pos = 0
+    while pos < len(segment):
+        precision, table_id = segment[pos] >> 4, segment[pos] & 0x0F
+        pos += 1
+        if precision:
+            tables[table_id] = struct.unpack_from('>64H', segment, pos)
+            pos += 128
+        else:
+            tables[table_id] = tuple(segment[pos:pos + 64])
+            pos += 64
+    return tables
+
+
+def _read(fp, size):
+    """Read exactly size bytes from fp, raise ValueError if the file ends before"""
+    data = fp.read(size)
+    if len(data) < size:
+        raise ValueError('Corrupt JPEG file')
+    return data
+
+
+def read_info(fp):
+    """Read the markers of a JPEG file up to its frame header and return a JPEGInfo object.
+
+    Only the APP1, DQT and SOF segments are read, every other segment is skipped
+    and no pixel data is read. The orientation is taken from the first EXIF APP1
+    segment, other APP1 segments such as XMP are skipped. The position of fp is restored afterwards.
+    Raises ValueError if fp isn't a JPEG file or ends before its frame header.
+
+    Positional arguments:
+    fp -- binary file object of the JPEG image
+    """
+    start = fp.tell()
+    orientation = None
+    tables = {}
+    try:
+        if fp.read(2) != b'\xff\xd8':
+            raise ValueError('Not a JPEG file')
+
+        while True:
+            marker = _read(fp, 2)
+            if marker[0] != 0xFF:
+                raise ValueError('Corrupt JPEG file')
+
+            # Padding bytes before a marker
+            while marker[1] == 0xFF:
+                marker = marker[1:] + _read(fp, 1)
+            if marker[1] in STANDALONE_MARKERS:
+                continue
+
+            length, = struct.unpack('>H', _read(fp, 2))
+            if length < 2:
+                raise ValueError('Corrupt JPEG file')
+            if marker[1] in SOF_MARKERS:
+                bits, height, width, components = struct.unpack('>BHHB', _read(fp, 6))
+                # The luminance table has the lowest id
+                return JPEGInfo(width, height, components, bits, marker[1] in PROGRESSIVE_MARKERS,
+                                orientation or 1, tables[min(tables)] if tables else None)
+
+            if marker[1] == APP1 and orientation is None:
+                segment = _read(fp, length - 2)
+                if segment.startswith(b'Exif\x00\x00'):
+                    orientation = exif_orientation(segment)
+            elif marker[1] == DQT:
+                tables.update(quantization_tables(_read(fp, length - 2)))
+            else:
+                fp.seek(length - 2, 1)
+    except struct.error:
+        raise ValueError('Corrupt JPEG file')
+    finally:
+        fp.seek(start)
+
+
+class MetadataIndex:
+    """A class to keep the JPEGInfo of every file that was read
+
+    An entry is found by the path of the file and is read again when the
+    modification time or the size of the file changes, so page sizing,
+    orientation handling and embedding read the header of a file once.
+    Files that aren't JPEG files are remembered as well. The least recently
+    used entries are evicted when there are more than max_entries, so long
+    running processes don't keep every file they ever saw.
+
+    Methods:
+    get(path) -- return the JPEGInfo of a file, None if it isn't a JPEG file
+    """
+
+    def __init__(self, max_entries=INDEX_SIZE):
+        """Initiate method for MetadataIndex
+
+        Keyword arguments:
+        max_entries -- number of files remembered
+        """
+        self.max_entries = max_entries
+        # Absolute path -> (modification time, size, JPEGInfo or None), least recently used first
+        self.entries = collections.OrderedDict()
+
+    def get(self, path):
+        """Return the JPEGInfo of a file, None if it isn't a JPEG file.
+
+        Positional arguments:
+        path -- path of the file
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            self.entries.move_to_end(path)
+            return entry[2]
+
+        with open(path, 'rb') as fp:
+            try:
+                info = read_info(fp)
+            except ValueError:
+                info = None
+        self.entries[path] = (stat.st_mtime_ns, stat.st_size, info)
+        self.entries.move_to_end(path)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return info
+
+
+# Index shared by every caller in this process
+index = MetadataIndex()
+
+
+def lookup(path):
+    """Return the JPEGInfo of a file from the shared index, None if it isn't a JPEG file"""
+    return index.get(path)
@@ -1,188 +1,1521 @@
-import os
-import sys
-import argparse
-import datetime
-import tempfile
-import platform
-import subprocess
-from fpdf import FPDF
-from PIL import Image, ExifTags
-
-action_index = 0
-verbose = False
-
-
-def show_file_in_explorer(file_path):
-    """Open the file explorer and highlight the given file in it.
-
-    This function is Windows-specific for now due to my lack of machines with different operating systems
-
-    Positional arguments:
-    file_path -- path of the file to be shown
-    """
-    if platform.system() == "Windows":
-        file_path = file_path.replace('/', '\\')
-        subprocess.Popen(f'explorer /select,{file_path}')
-
-
-def log(msg):
-    """Log a message to console using format [{action_index}][{date}]: {msg}.
-
-    Positional arguments:
-    msg -- message to be logged
-    """
-    global action_index
-    global verbose
-    if verbose:
-        date = str(datetime.datetime.now()).split('.')[0]
-        print(f'[{"{:05d}".format(action_index)}][{date}]: {msg}')
-    action_index += 1
-
-
-def compressed_image_name(old_name, quality):
-    """Format a file name as CMP_{quality}_{filename}.
-
-    Positional arguments:
-    old_name -- name of the original image file
-    quality -- desired JPEG quality of the output file
-    """
-    return os.path.join(tempfile.gettempdir(), f"CMP_{str(quality)}_{os.path.basename(old_name)}")
-
-
-def open_with_correct_rotation(im_dir, file_name):
-    """Return a PIL.Image object with correct rotation.
-
-    This function was added due to PIL's way of opening JPEG images.
-    JPEG images have an exif tag that tells the orientation of the image,
-    check this link for further information: (https://magnushoff.com/articles/jpeg-orientation/)
-    Opened image is rotated according to its orientation tag and returned to the caller.
-
-    Positional arguments:
-    im_dir -- directory path of the image to be opened
-    file_name -- name of the image file to be opened
-    """
-    picture = Image.open(os.path.join(im_dir, file_name))
-    exif = picture._getexif()
-    if exif:
-        for orientation in ExifTags.TAGS.keys():
-            if ExifTags.TAGS[orientation] == 'Orientation':
-                break
-
-        if exif[orientation] == 3:
-            picture = picture.transpose(Image.ROTATE_180)
-        elif exif[orientation] == 6:
-            picture = picture.transpose(Image.ROTATE_270)
-        elif exif[orientation] == 8:
-            picture = picture.transpose(Image.ROTATE_90)
-
-    return picture
-
-
-def compress(im_dir, file_name, log_func, quality=85):
-    """Save PIL.Image object as a compressed JPEG image in the given quality.
-
-    Positional arguments:
-    im_dir -- directory path of the image to be compressed
-    file_name -- name of the image file to be compressed
-    log_func -- log function
-
-    Keyword arguments:
-    quality -- desired quality of the output file
-    """
-    picture = open_with_correct_rotation(im_dir, file_name)
-    picture.save(compressed_image_name(file_name, quality),
-                 'JPEG', optimize=True, quality=quality)
-    log_func(f'COMPRESSED {os.path.join(im_dir, file_name)}')
-
-
-def temp_cleanup(temp_list, log_func):
-    """Clean up the temp directory of the user.
-
-    Positional arguments:
-    temp_list -- list of names of the every temp file created
-    log_func -- log function
-    """
-    for file in temp_list:
-        os.remove(file)
-        log_func(f'REMOVING {file}')
-
-
-def create_pdf(pdf_file_path, list_images, quality=85, im_dir='', log_func=log):
-    """Create pdf file and return any temp files created.
-
-    This is the main function called to create a pdf file.
-    If this function is called by this file, images are compressed here.
-    If this function is called by ui.py, images are already compressed before the call.
-    log_func parameter is added because this function can be called either from this file or ui.py,
-    in the ui version log function is different so it passes its own log function.
-
-    Positional arguments:
-    pdf_file_path -- path of the pdf file to be created
-    list_images -- list of every compressed images that are going to be used in the pdf.
-
-    Keyword arguments:
-    quality -- desired quality of the output file
-    im_dir -- directory path of the image to be compressed
-    log_func -- log function
-    """
-
-    temp_files = set()
-    if not pdf_file_path.endswith('.pdf'):
-        pdf_file_path += '.pdf'
-
-    cover_path = compressed_image_name(str(list_images[0]), quality)
-
-    if not os.path.isfile(cover_path):
-        compress(im_dir, list_images[0], log_func, quality=quality)
-        temp_files.add(cover_path)
-
-    with Image.open(cover_path) as cover:
-        width, height = cover.size
-
-    pdf = FPDF(unit='pt', format=[width, height])
-
-    for page in list_images:
-        pdf.add_page()
-
-        try:
-            pdf.image(compressed_image_name(str(page), quality), 0, 0)
-        except RuntimeError:
-            compress(im_dir, page, log_func, quality=quality)
-            temp_files.add(compressed_image_name(page, quality))
-
-            pdf.image(compressed_image_name(str(page), quality), 0, 0)
-
-        log_func(f'ADDING {compressed_image_name(str(page), quality)}')
-
-    pdf.output(pdf_file_path, 'F')
-    log_func(f'EXPORTED TO {pdf_file_path}')
-    return temp_files
-
-
-if __name__ == '__main__':
-
-    parser = argparse.ArgumentParser()
-    parser.add_argument('pdf_file_name')
-    parser.add_argument('-d', '--images_dir_path')
-    parser.add_argument('-l', '--image_list', nargs='+', required=True)
-    parser.add_argument('-v', '--verbose', action='store_true', default=False)
-    parser.add_argument('-q', '--quality', action='store',
-                        type=int, default=85)
-
-    args = parser.parse_args()
-    if args.images_dir_path is None:
-        args.images_dir_path = os.getcwd()
-
-    verbose = args.verbose
-    pdf_path = os.path.join(os.getcwd(), args.pdf_file_name)
-    temps = create_pdf(pdf_path, args.image_list,
-                       quality=args.quality, im_dir=args.images_dir_path,
-                       log_func=log)
-
-    # If called by command-line, cleanup here. If using UI, cleanup is done in closeEvent()
-    temp_cleanup(temps, log)
-
-    if platform.system() == "Windows":
-        print('Do you want to see the exported file in the explorer? (y/n) ', end='')
-        if input() == 'y':
-            show_file_in_explorer(pdf_path)
+import io
+import os
+import sys
+import math
+import hashlib
+import datetime
+import tempfile
+import platform
+import shutil
+import subprocess
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import PIL
+from PIL import Image, ImageChops
+import pdfwriter
+import jpegmeta
+import instrument
+from cli import PAGE_SIZES
+
+try:
+    import numpy
+except ImportError:
+    # Pages are analyzed with PIL's histograms instead, see reduced_mode()
+    numpy = None
+
+action_index = 0
+verbose = False
+
+# Luminance quantization table from the JPEG standard, scaled by libjpeg to get a given quality
+STANDARD_LUMINANCE_TABLE = [16, 11, 10, 16, 24, 40, 51, 61,
+                            12, 12, 14, 19, 26, 58, 60, 55,
+                            14, 13, 16, 24, 40, 57, 69, 56,
+                            14, 17, 22, 29, 51, 87, 80, 62,
+                            18, 22, 37, 56, 68, 109, 103, 77,
+                            24, 35, 55, 64, 81, 104, 113, 92,
+                            49, 64, 78, 87, 103, 121, 120, 101,
+                            72, 92, 95, 98, 112, 100, 103, 99]
+
+# Qualities every page is trial-encoded with when searching for a target size, highest first
+QUALITY_GRID = [95, 90, 85, 80, 75, 70, 60, 50, 40, 30, 20, 10]
+
+# Estimated bytes a pdf file takes besides its images, per page and per document
+PAGE_OVERHEAD = 600
+DOCUMENT_OVERHEAD = 1024
+
+# Trial sizes found in this process, (path, modification time, size, max_size, color_reduction) -> {quality: bytes}
+trial_sizes_memo = {}
+
+# Width and height of the grid of differences a perceptual hash is made of, see difference_hash()
+HASH_SIZE = 8
+
+# Largest difference of the displayed aspect ratios of two near duplicate images
+ASPECT_TOLERANCE = 0.02
+
+# Largest difference between the channels of a pixel on a grayscale page when no tolerance is given
+DEFAULT_GRAY_TOLERANCE = 12
+
+# Share of the pixels of a grayscale page that may be colored, e.g. a stamp or a smudge
+COLOR_OUTLIERS = 0.001
+
+# Gray levels of a bitonal page are darker than the first or lighter than the second level,
+# except for BITONAL_OUTLIERS of its pixels, the anti-aliased edges of the text
+BITONAL_LEVELS = (64, 192)
+BITONAL_OUTLIERS = 0.03
+
+
+class ConversionCancelled(Exception):
+    """Raised by create_pdf() when its cancel_event is set
+
+    Attributes:
+    temp_files -- set of temp files created before the conversion was cancelled
+    """
+
+    def __init__(self, temp_files):
+        """Initiate method for ConversionCancelled
+
+        Positional arguments:
+        temp_files -- set of temp files created before the conversion was cancelled
+        """
+        super().__init__('Conversion cancelled')
+        self.temp_files = temp_files
+
+
+def show_file_in_explorer(file_path):
+    """Open the file explorer and highlight the given file in it.
+
+    This function is Windows-specific for now due to my lack of machines with different operating systems
+
+    Positional arguments:
+    file_path -- path of the file to be shown
+    """
+    if platform.system() == "Windows":
+        file_path = file_path.replace('/', '\\')
+        subprocess.Popen(f'explorer /select,{file_path}')
+
+
+def log(msg):
+    """Log a message to console using format [{action_index}][{date}]: {msg}.
+
+    Positional arguments:
+    msg -- message to be logged
+    """
+    global action_index
+    global verbose
+    if verbose:
+        date = str(datetime.datetime.now()).split('.')[0]
+        print(f'[{"{:05d}".format(action_index)}][{date}]: {msg}')
+    action_index += 1
+
+
+def compressed_image_name(old_name, quality, max_size=None, temp_dir=None, color_reduction=None):
+    """Format a file name as CMP_{quality}_{filename}, or CMP_{quality}_{long}x{short}_{filename} if max_size is given.
+
+    If color_reduction is given, G{tolerance}_ or G{tolerance}B_ for bitonal pages is added before filename.
+
+    Positional arguments:
+    old_name -- name of the original image file
+    quality -- desired JPEG quality of the output file
+
+    Keyword arguments:
+    max_size -- (long side, short side) the image is downsampled to fit in
+    temp_dir -- directory of the file, the temp directory of the user if None
+    color_reduction -- (tolerance, bitonal) grayscale and bitonal pages are detected with, see reduced_mode()
+    """
+    temp_dir = temp_dir or tempfile.gettempdir()
+    prefix = f"CMP_{str(quality)}_"
+    if max_size:
+        prefix += f"{max_size[0]}x{max_size[1]}_"
+    if color_reduction:
+        prefix += f"G{color_reduction[0]}{'B' if color_reduction[1] else ''}_"
+    return os.path.join(temp_dir, prefix + os.path.basename(old_name))
+
+
+def page_quality(name, quality, qualities=None):
+    """Return the quality the image name is compressed with, from qualities if it is in it.
+
+    Positional arguments:
+    name -- name of the image file
+    quality -- quality of every image that isn't in qualities
+
+    Keyword arguments:
+    qualities -- dictionary of {name: quality} of images with their own quality
+    """
+    if qualities:
+        return qualities.get(name, quality)
+    return quality
+
+
+def page_max_size(name, max_size, max_sizes=None):
+    """Return the (long side, short side) the image name is downsampled to fit in, from max_sizes if it is in it.
+
+    Positional arguments:
+    name -- name of the image file
+    max_size -- size of every image that isn't in max_sizes, see target_size()
+
+    Keyword arguments:
+    max_sizes -- dictionary of {name: (long side, short side)} of images with their own size, see fit_memory_budget()
+    """
+    if max_sizes:
+        return max_sizes.get(name, max_size)
+    return max_size
+
+
+def target_size(max_dim=None, dpi=None, page_size='A4'):
+    """Return (long side, short side) in pixels that images are downsampled to fit in, None to keep their size.
+
+    Keyword arguments:
+    max_dim -- maximum width and height of images in pixels
+    dpi -- resolution of images printed on a page of page_size
+    page_size -- key of PAGE_SIZES, used with dpi
+    """
+    sizes = []
+    if max_dim:
+        sizes.append((max_dim, max_dim))
+    if dpi:
+        short_side, long_side = sorted(PAGE_SIZES[page_size])
+        sizes.append((round(long_side * dpi), round(short_side * dpi)))
+
+    if not sizes:
+        return None
+    return min(size[0] for size in sizes), min(size[1] for size in sizes)
+
+
+def fitted_size(size, max_size):
+    """Return the (width, height) of an image downsampled to fit in max_size, keeping its aspect ratio.
+
+    Positional arguments:
+    size -- (width, height) of the image
+    max_size -- (long side, short side) to fit in, None to keep the size
+    """
+    if not max_size:
+        return size
+
+    width, height = size
+    scale = min(1, max_size[0] / max(width, height), max_size[1] / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def get_orientation(picture):
+    """Return the EXIF orientation of a PIL.Image object, 1 if it has none.
+
+    Only the header of the image is read, pixel data is not decoded.
+
+    Positional arguments:
+    picture -- PIL.Image object opened from a JPEG file
+    """
+    return picture.getexif().get(jpegmeta.ORIENTATION_TAG, 1)
+
+
+def image_orientation(path, picture):
+    """Return the EXIF orientation of an image, from the metadata index if it is a JPEG file.
+
+    Positional arguments:
+    path -- path of the image
+    picture -- PIL.Image object opened from path, read by get_orientation() if it isn't a JPEG file
+    """
+    info = jpegmeta.lookup(path)
+    return info.orientation if info is not None else get_orientation(picture)
+
+
+def apply_orientation(picture, orientation):
+    """Return a PIL.Image object rotated according to an EXIF orientation.
+
+    Positional arguments:
+    picture -- PIL.Image object
+    orientation -- EXIF orientation of the image, only 3, 6 and 8 are applied
+    """
+    if orientation == 3:
+        return picture.transpose(Image.ROTATE_180)
+    if orientation == 6:
+        return picture.transpose(Image.ROTATE_270)
+    if orientation == 8:
+        return picture.transpose(Image.ROTATE_90)
+    return picture
+
+
+def open_with_correct_rotation(im_dir, file_name, max_size=None, log_func=None):
+    """Return a PIL.Image object with correct rotation.
+
+    This function was added due to PIL's way of opening JPEG images.
+    JPEG images have an exif tag that tells the orientation of the image,
+    check this link for further information: (https://magnushoff.com/articles/jpeg-orientation/)
+    Opened image is rotated according to its orientation tag and returned to the caller.
+    If max_size is given, large images are decoded at a reduced scale
+    with PIL's draft mode and resampled to fit in max_size.
+
+    Positional arguments:
+    im_dir -- directory path of the image to be opened
+    file_name -- name of the image file to be opened
+
+    Keyword arguments:
+    max_size -- (long side, short side) the image is downsampled to fit in
+    log_func -- log function, decoding and rotating are timed if it is an instrument.Recorder object
+    """
+    with instrument.span(log_func, 'decode'):
+        picture = Image.open(os.path.join(im_dir, file_name))
+        orientation = image_orientation(os.path.join(im_dir, file_name), picture)
+
+        size = fitted_size(picture.size, max_size)
+        if size != picture.size:
+            # Let the JPEG decoder skip detail at 1/2, 1/4 or 1/8 scale before resampling
+            picture.draft(picture.mode, size)
+            picture = picture.resize(size, Image.LANCZOS)
+        else:
+            picture.load()
+
+    with instrument.span(log_func, 'rotate'):
+        picture = apply_orientation(picture, orientation)
+
+    return picture
+
+
+def make_thumbnail(im_dir, file_name, width):
+    """Return (width, height, pixels) of a thumbnail of an image with its orientation applied.
+
+    The image is decoded at a reduced scale with PIL's draft mode, so only a
+    fraction of its pixels are decoded. pixels are the RGB values as bytes.
+
+    Positional arguments:
+    im_dir -- directory path of the image
+    file_name -- name of the image file
+    width -- width of the thumbnail, its height keeps the aspect ratio of the image
+    """
+    with Image.open(os.path.join(im_dir, file_name)) as picture:
+        orientation = image_orientation(os.path.join(im_dir, file_name), picture)
+        displayed_width, displayed_height = displayed_size(picture.size, orientation)
+        height = max(1, round(displayed_height * width / displayed_width))
+
+        # Size of the thumbnail before it is rotated
+        stored_size = displayed_size((width, height), orientation)
+        picture.draft('RGB', stored_size)
+        thumbnail = picture.convert('RGB').resize(stored_size, Image.BILINEAR)
+
+    thumbnail = apply_orientation(thumbnail, orientation)
+    return width, height, thumbnail.tobytes()
+
+
+def reduced_mode(picture, tolerance, bitonal=False):
+    """Return the mode a page is encoded in, '1' if it is bitonal, 'L' if it is grayscale and its own mode otherwise.
+
+    A page is grayscale when the channels of all but COLOR_OUTLIERS of its pixels differ
+    by at most tolerance, photographed documents are never exactly gray. A grayscale page
+    is bitonal when it is almost only black and white, see BITONAL_LEVELS.
+    The channels are compared with NumPy if it is installed, with PIL's histograms otherwise.
+
+    Positional arguments:
+    picture -- PIL.Image object of the page
+    tolerance -- largest difference between the channels of a gray pixel
+
+    Keyword arguments:
+    bitonal -- also detect bitonal pages
+    """
+    if picture.mode not in ('RGB', 'L'):
+        return picture.mode
+
+    pixels = picture.width * picture.height
+    if picture.mode == 'RGB':
+        if numpy is not None:
+            channels = numpy.asarray(picture)
+            colored = numpy.count_nonzero(channels.max(axis=2) - channels.min(axis=2) > tolerance)
+        else:
+            red, green, blue = picture.split()
+            spread = ImageChops.subtract(ImageChops.lighter(ImageChops.lighter(red, green), blue),
+                                         ImageChops.darker(ImageChops.darker(red, green), blue))
+            colored = sum(spread.histogram()[tolerance + 1:])
+        if colored > COLOR_OUTLIERS * pixels:
+            return 'RGB'
+
+    if not bitonal:
+        return 'L'
+
+    histogram = picture.convert('L').histogram()
+    gray = sum(histogram[BITONAL_LEVELS[0]:BITONAL_LEVELS[1] + 1])
+    return '1' if gray <= BITONAL_OUTLIERS * pixels else 'L'
+
+
+def save_page(picture, mode, fp, quality):
+    """Save a page in mode, as a 1-bit PNG image if mode is '1' and as a JPEG image in the given quality otherwise.
+
+    A pdf file holds the pixel data of a PNG image as it is, see pdfwriter.read_png().
+
+    Positional arguments:
+    picture -- PIL.Image object of the page
+    mode -- mode returned by reduced_mode()
+    fp -- binary file object to save to
+    quality -- desired JPEG quality
+    """
+    if mode == '1':
+        # Threshold at the middle gray level, dithering would only add noise to the text
+        picture.convert('L').convert('1', dither=Image.NONE).save(fp, 'PNG')
+    elif mode != picture.mode:
+        picture.convert(mode).save(fp, 'JPEG', optimize=True, quality=quality)
+    else:
+        picture.save(fp, 'JPEG', optimize=True, quality=quality)
+
+
+def estimate_jpeg_quality(picture):
+    """Estimate the quality a JPEG image was saved with and return it, None if it is unknown.
+
+    Positional arguments:
+    picture -- PIL.Image object opened from a JPEG file
+    """
+    tables = getattr(picture, 'quantization', None)
+    if not tables:
+        return None
+    return quality_from_table(tables[min(tables)])
+
+
+def quality_from_table(luminance):
+    """Estimate the quality a JPEG image was saved with from its luminance quantization table, None if it is unknown.
+
+    The estimate compares the table with the standard table that libjpeg scales for every quality setting.
+
+    Positional arguments:
+    luminance -- the 64 values of the luminance quantization table
+    """
+    if not luminance:
+        return None
+
+    scale = sum(luminance) * 100 / sum(STANDARD_LUMINANCE_TABLE)
+    if scale <= 100:
+        quality = (200 - scale) / 2
+    else:
+        quality = 5000 / scale
+
+    return max(1, min(100, round(quality)))
+
+
+def passthrough_source(im_dir, file_name, quality, max_size=None):
+    """Return (path, orientation, size) if an image can be embedded without re-encoding, None otherwise.
+
+    An image is passed through when it is an RGB or grayscale JPEG that was saved
+    with a quality no higher than the desired quality, so re-encoding it would only
+    lose more detail. Its orientation is applied when the page is drawn instead.
+    Images that are larger than max_size are never passed through.
+    Only the header of the image is read, see jpegmeta.read_info().
+
+    Positional arguments:
+    im_dir -- directory path of the image
+    file_name -- name of the image file
+    quality -- desired quality of the output file
+
+    Keyword arguments:
+    max_size -- (long side, short side) images are downsampled to fit in
+    """
+    path = os.path.join(im_dir, file_name)
+    info = jpegmeta.lookup(path)
+    if info is None or info.components not in (1, 3) or info.bits != 8:
+        return None
+
+    size = info.width, info.height
+    if fitted_size(size, max_size) != size:
+        return None
+
+    source_quality = quality_from_table(info.luminance_table)
+    if source_quality is None or source_quality > quality:
+        return None
+
+    return path, info.orientation, size
+
+
+def displayed_size(size, orientation):
+    """Return the (width, height) of an image after its EXIF orientation is applied.
+
+    Positional arguments:
+    size -- (width, height) of the image as it is stored
+    orientation -- EXIF orientation of the image
+    """
+    width, height = size
+    if orientation in (6, 8):
+        return height, width
+    return width, height
+
+
+def write_atomically(path, data=None, source_path=None):
+    """Write bytes or a copy of a file to path under a temporary name and rename it.
+
+    A crash never leaves a partial file at path, so a file that exists there is complete.
+
+    Positional arguments:
+    path -- path of the file to be written
+
+    Keyword arguments:
+    data -- bytes to write
+    source_path -- path of a file to copy, used when data is None
+    """
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    if data is not None:
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+    else:
+        shutil.copyfile(source_path, temp_path)
+    os.replace(temp_path, path)
+
+
+def color_settings(gray_tolerance=None, bitonal=False):
+    """Return the (tolerance, bitonal) grayscale and bitonal pages are detected with, None to keep colors.
+
+    Keyword arguments:
+    gray_tolerance -- largest difference between the channels of a gray pixel, None to keep colors
+    bitonal -- also detect bitonal pages, gray_tolerance is DEFAULT_GRAY_TOLERANCE if it is None
+    """
+    if gray_tolerance is None and not bitonal:
+        return None
+    return DEFAULT_GRAY_TOLERANCE if gray_tolerance is None else gray_tolerance, bitonal
+
+
+def encoder_settings(quality, max_size=None, color_reduction=None):
+    """Return every setting that changes the output of compress(), used as part of cache keys.
+
+    Positional arguments:
+    quality -- desired quality of the output file
+
+    Keyword arguments:
+    max_size -- (long side, short side) the image is downsampled to fit in
+    color_reduction -- (tolerance, bitonal) grayscale and bitonal pages are detected with, see reduced_mode()
+    """
+    settings = {'format': 'JPEG', 'quality': quality, 'optimize': True, 'pillow': PIL.__version__}
+    if max_size:
+        settings['max_size'] = list(max_size)
+    if color_reduction:
+        settings['color_reduction'] = list(color_reduction)
+    return settings
+
+
+def _cache_lookup(im_dir, file_name, quality, cache, max_size, color_reduction=None):
+    """Return (key, path) of an image in the cache, path is None if it isn't cached.
+
+    Positional arguments:
+    im_dir -- directory path of the image
+    file_name -- name of the image file
+    quality -- desired quality of the output file
+    cache -- imagecache.CompressionCache object
+    max_size -- (long side, short side) the image is downsampled to fit in
+
+    Keyword arguments:
+    color_reduction -- (tolerance, bitonal) grayscale and bitonal pages are detected with, see reduced_mode()
+    """
+    key = cache.key(os.path.join(im_dir, file_name), encoder_settings(quality, max_size, color_reduction))
+    return key, cache.get(key)
+
+
+def encode(im_dir, file_name, log_func, quality=85, max_size=None, color_reduction=None):
+    """Return an image rotated, downsampled and compressed as a JPEG image in the given quality as bytes.
+
+    If color_reduction is given, grayscale pages are compressed as 1-channel JPEG images
+    and bitonal pages as 1-bit PNG images instead, see reduced_mode().
+    Nothing is logged, log_func is only used to time the stages and count bytes.
+
+    Positional arguments:
+    im_dir -- directory path of the image to be compressed
+    file_name -- name of the image file to be compressed
+    log_func -- log function
+
+    Keyword arguments:
+    quality -- desired quality of the output file
+    max_size -- (long side, short side) the image is downsampled to fit in, see target_size()
+    color_reduction -- (tolerance, bitonal) grayscale and bitonal pages are detected with, None to keep colors
+    """
+    picture = open_with_correct_rotation(im_dir, file_name, max_size, log_func)
+    mode = picture.mode
+    if color_reduction:
+        with instrument.span(log_func, 'analyze'):
+            mode = reduced_mode(picture, *color_reduction)
+        if mode == 'L' and picture.mode != 'L':
+            instrument.count(log_func, 'grayscale_pages')
+        elif mode == '1':
+            instrument.count(log_func, 'bitonal_pages')
+
+    buffer = io.BytesIO()
+    with instrument.span(log_func, 'encode'):
+        save_page(picture, mode, buffer, quality)
+
+    instrument.count(log_func, 'bytes_in', os.path.getsize(os.path.join(im_dir, file_name)))
+    instrument.count(log_func, 'bytes_out', buffer.tell())
+    return buffer.getvalue()
+
+
+def compress(im_dir, file_name, log_func, quality=85, cache=None, max_size=None, temp_dir=None,
+             color_reduction=None):
+    """Save PIL.Image object as a compressed JPEG image in the given quality.
+
+    If a cache is given, a cached image is copied instead of compressing
+    the image again, and newly compressed images are added to the cache.
+
+    Positional arguments:
+    im_dir -- directory path of the image to be compressed
+    file_name -- name of the image file to be compressed
+    log_func -- log function
+
+    Keyword arguments:
+    quality -- desired quality of the output file
+    cache -- imagecache.CompressionCache object, None to always compress
+    max_size -- (long side, short side) the image is downsampled to fit in, see target_size()
+    temp_dir -- directory of the compressed file, see compressed_image_name()
+    color_reduction -- (tolerance, bitonal) grayscale and bitonal pages are detected with, see encode()
+    """
+    path = compressed_image_name(file_name, quality, max_size, temp_dir, color_reduction)
+    key = None
+    if cache is not None:
+        key, cached = _cache_lookup(im_dir, file_name, quality, cache, max_size, color_reduction)
+        if cached:
+            with instrument.span(log_func, 'temp_write'):
+                write_atomically(path, source_path=cached)
+            instrument.count(log_func, 'cache_hits')
+            log_func(f'COMPRESSED {os.path.join(im_dir, file_name)} FROM CACHE')
+            return
+        instrument.count(log_func, 'cache_misses')
+
+    data = encode(im_dir, file_name, log_func, quality=quality, max_size=max_size,
+                  color_reduction=color_reduction)
+    with instrument.span(log_func, 'temp_write'):
+        write_atomically(path, data)
+    if key is not None:
+        cache.put(key, data)
+    log_func(f'COMPRESSED {os.path.join(im_dir, file_name)}')
+
+
+def compress_to_bytes(im_dir, file_name, log_func, quality=85, cache=None, max_size=None, color_reduction=None):
+    """Return PIL.Image object compressed as a JPEG image in the given quality as bytes.
+
+    Same as compress() but nothing is written to the temp directory.
+
+    Positional arguments:
+    im_dir -- directory path of the image to be compressed
+    file_name -- name of the image file to be compressed
+    log_func -- log function
+
+    Keyword arguments:
+    quality -- desired quality of the output file
+    cache -- imagecache.CompressionCache object, None to always compress
+    max_size -- (long side, short side) the image is downsampled to fit in, see target_size()
+    color_reduction -- (tolerance, bitonal) grayscale and bitonal pages are detected with, see encode()
+    """
+    key = None
+    if cache is not None:
+        key, cached = _cache_lookup(im_dir, file_name, quality, cache, max_size, color_reduction)
+        if cached:
+            with open(cached, 'rb') as file:
+                data = file.read()
+            instrument.count(log_func, 'cache_hits')
+            log_func(f'COMPRESSED {os.path.join(im_dir, file_name)} FROM CACHE')
+            return data
+        instrument.count(log_func, 'cache_misses')
+
+    data = encode(im_dir, file_name, log_func, quality=quality, max_size=max_size,
+                  color_reduction=color_reduction)
+    if key is not None:
+        cache.put(key, data)
+    log_func(f'COMPRESSED {os.path.join(im_dir, file_name)} IN MEMORY')
+    return data
+
+
+def _worker_log_func(trace):
+    """Return the log function of a worker process, an instrument.Recorder object if trace is True.
+
+    Worker processes can't share the log function of the caller, so nothing is logged there.
+    A Recorder object ignores messages as well but records spans and counters,
+    which are returned to the caller and merged into its instrument.Tracer object.
+    """
+    return instrument.Recorder() if trace else lambda msg: None
+
+
+def _compress_task(im_dir, file_name, quality, cache, max_size, temp_dir, trace=False, color_reduction=None):
+    """Compress an image in a worker process and return (path of the compressed file, recorder).
+
+    Worker processes can't share the log function of the caller,
+    so nothing is logged here. compress_all() logs the results instead.
+    recorder is the instrument.Recorder object of the worker if trace is True, None otherwise.
+
+    Positional arguments:
+    im_dir -- directory path of the image to be compressed
+    file_name -- name of the image file to be compressed
+    quality -- desired quality of the output file
+    cache -- imagecache.CompressionCache object or None
+    max_size -- (long side, short side) the image is downsampled to fit in or None
+    temp_dir -- directory of the compressed file or None
+
+    Keyword arguments:
+    trace -- record spans and counters
+    color_reduction -- (tolerance, bitonal) grayscale and bitonal pages are detected with, see encode()
+    """
+    log_func = _worker_log_func(trace)
+    compress(im_dir, file_name, log_func, quality=quality, cache=cache, max_size=max_size,
+             temp_dir=temp_dir, color_reduction=color_reduction)
+    return (compressed_image_name(file_name, quality, max_size, temp_dir, color_reduction),
+            log_func if trace else None)
+
+
+def _compress_to_bytes_task(im_dir, file_name, quality, cache, max_size, trace=False, color_reduction=None):
+    """Compress an image in a worker process and return (compressed JPEG image as bytes, recorder).
+
+    See _compress_task().
+
+    Positional arguments:
+    im_dir -- directory path of the image to be compressed
+    file_name -- name of the image file to be compressed
+    quality -- desired quality of the output file
+    cache -- imagecache.CompressionCache object or None
+    max_size -- (long side, short side) the image is downsampled to fit in or None
+
+    Keyword arguments:
+    trace -- record spans and counters
+    color_reduction -- (tolerance, bitonal) grayscale and bitonal pages are detected with, see encode()
+    """
+    log_func = _worker_log_func(trace)
+    data = compress_to_bytes(im_dir, file_name, log_func, quality=quality, cache=cache, max_size=max_size,
+                             color_reduction=color_reduction)
+    return data, log_func if trace else None
+
+
+def estimate_memory(path, max_size=None):
+    """Estimate the bytes decoding, resampling and rotating an image takes at its peak.
+
+    The size and color components are read from the header of the image, see jpegmeta.lookup().
+    If the image is downsampled, it is decoded at the reduced scale PIL's draft mode picks.
+
+    Positional arguments:
+    path -- path of the image
+
+    Keyword arguments:
+    max_size -- (long side, short side) the image is downsampled to fit in
+    """
+    info = jpegmeta.lookup(path)
+    if info is not None:
+        (width, height), channels = (info.width, info.height), info.components
+    else:
+        with Image.open(path) as picture:
+            (width, height), channels = picture.size, len(picture.getbands())
+
+    target_width, target_height = fitted_size((width, height), max_size)
+    if (target_width, target_height) == (width, height):
+        # The decoded image and its rotated copy
+        return 2 * width * height * channels
+
+    scale = 1
+    while scale < 8 and math.ceil(width / (scale * 2)) >= target_width and \
+            math.ceil(height / (scale * 2)) >= target_height:
+        scale *= 2
+    decoded_width, decoded_height = math.ceil(width / scale), math.ceil(height / scale)
+
+    # The decoded image, the horizontal pass of the resampling, the resampled image and its rotated copy
+    return (decoded_width * decoded_height + target_width * decoded_height
+            + 2 * target_width * target_height) * channels
+
+
+def memory_costs(im_dir, names, sizes, memory_budget):
+    """Return the estimate_memory() of every image, None if memory_budget is None.
+
+    Positional arguments:
+    im_dir -- directory path of the images
+    names -- names of the image files
+    sizes -- (long side, short side) every image is downsampled to fit in, or None
+    memory_budget -- bytes the images being decoded may take together, None means no limit
+    """
+    if memory_budget is None:
+        return None
+    return [estimate_memory(os.path.join(im_dir, name), size) for name, size in zip(names, sizes)]
+
+
+def budgeted_map(executor, fn, costs, budget, *iterables):
+    """Return an iterator of the results of fn called with the items of iterables, like executor.map().
+
+    If budget is given, calls are only submitted while the costs of the running calls fit in it together.
+    Calls are submitted in order, a call whose cost doesn't fit in budget alone runs when no other call is running.
+
+    Positional arguments:
+    executor -- concurrent.futures.Executor the calls are submitted to
+    fn -- function to call
+    costs -- list of the cost of every call, ignored if budget is None
+    budget -- total cost of the running calls, None means no limit
+    """
+    if budget is None:
+        return executor.map(fn, *iterables)
+    return _budgeted_results(executor, fn, costs, budget, list(zip(*iterables)))
+
+
+def _budgeted_results(executor, fn, costs, budget, calls):
+    """Submit calls while their costs fit in budget and yield their results in order, see budgeted_map()"""
+    futures = []
+    running = {}
+    used = 0
+    try:
+        for i in range(len(calls)):
+            while True:
+                for future in [future for future in running if future.done()]:
+                    used -= running.pop(future)
+                # Every running call comes after call i, so call i is submitted once nothing runs
+                while len(futures) < len(calls) and (not running or used + costs[len(futures)] <= budget):
+                    future = executor.submit(fn, *calls[len(futures)])
+                    running[future] = costs[len(futures)]
+                    used += costs[len(futures)]
+                    futures.append(future)
+                if futures[i].done():
+                    break
+                wait(running, return_when=FIRST_COMPLETED)
+
+            result = futures[i].result()
+            futures[i] = None
+            yield result
+    finally:
+        for future in running:
+            future.cancel()
+
+
+def compress_all(im_dir, list_images, log_func, quality=85, workers=None, cache=None, max_size=None,
+                 temp_dir=None, executor=None, qualities=None, max_sizes=None, memory_budget=None,
+                 color_reduction=None, journal=None):
+    """Compress every image in list_images in parallel and return any temp files created.
+
+    Images are decoded, rotated and re-encoded by a pool of worker processes.
+    Duplicate entries are compressed once and images that already have
+    a compressed file are skipped. Results are logged in the order of list_images.
+    If an executor is given, its workers are used instead of starting a new pool.
+    If memory_budget is given, images are only handed to the workers while their
+    estimated decoded sizes fit in it together, see budgeted_map().
+
+    Positional arguments:
+    im_dir -- directory path of the images to be compressed
+    list_images -- list of names of the image files to be compressed
+    log_func -- log function
+
+    Keyword arguments:
+    quality -- desired quality of the output files
+    workers -- number of worker processes, None means one per CPU
+    cache -- imagecache.CompressionCache object, None to always compress
+    max_size -- (long side, short side) images are downsampled to fit in, see target_size()
+    temp_dir -- directory of the compressed files, see compressed_image_name()
+    executor -- concurrent.futures.Executor shared with other callers
+    qualities -- dictionary of {name: quality} of images with their own quality, see page_quality()
+    max_sizes -- dictionary of {name: (long side, short side)} of images with their own size, see page_max_size()
+    memory_budget -- bytes the images being decoded may take together, None means no limit
+    color_reduction -- (tolerance, bitonal) grayscale and bitonal pages are detected with, see encode()
+    journal -- journal.Journal object every compressed file is recorded in as soon as it is done
+    """
+    temp_files = set()
+    pending = [str(name) for name in dict.fromkeys(list_images)
+               if not os.path.isfile(compressed_image_name(str(name), page_quality(str(name), quality, qualities),
+                                                           page_max_size(str(name), max_size, max_sizes),
+                                                           temp_dir, color_reduction))]
+    if not pending:
+        return temp_files
+
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return compress_all(im_dir, pending, log_func, quality=quality, cache=cache,
+                                max_size=max_size, temp_dir=temp_dir, executor=executor, qualities=qualities,
+                                max_sizes=max_sizes, memory_budget=memory_budget,
+                                color_reduction=color_reduction, journal=journal)
+
+    page_qualities = [page_quality(name, quality, qualities) for name in pending]
+    page_sizes = [page_max_size(name, max_size, max_sizes) for name in pending]
+    results = budgeted_map(executor, _compress_task, memory_costs(im_dir, pending, page_sizes, memory_budget),
+                           memory_budget, repeat(im_dir), pending, page_qualities, repeat(cache),
+                           page_sizes, repeat(temp_dir), repeat(instrument.is_recording(log_func)),
+                           repeat(color_reduction))
+    for name, (temp_file, recorder) in zip(pending, results):
+        instrument.merge(log_func, recorder)
+        temp_files.add(temp_file)
+        if journal is not None:
+            journal.record_compressed(name, temp_file, os.path.join(im_dir, name))
+        log_func(f'COMPRESSED {os.path.join(im_dir, name)}')
+
+    return temp_files
+
+
+def compress_all_to_memory(im_dir, list_images, log_func, quality=85, workers=None, spill_bytes=None,
+                           cache=None, max_size=None, temp_dir=None, executor=None, qualities=None,
+                           max_sizes=None, memory_budget=None, color_reduction=None, journal=None):
+    """Compress every image in list_images in parallel and return (buffers, temp_files).
+
+    buffers maps every image name to its compressed JPEG image as bytes.
+    Once spill_bytes bytes of compressed images are held in memory, the rest
+    of the images are spilled to temp files and mapped to their paths instead.
+    Images that already have a compressed file are mapped to it and not compressed again.
+    If an executor is given, its workers are used instead of starting a new pool.
+    memory_budget limits the images being decoded like in compress_all().
+
+    Positional arguments:
+    im_dir -- directory path of the images to be compressed
+    list_images -- list of names of the image files to be compressed
+    log_func -- log function
+
+    Keyword arguments:
+    quality -- desired quality of the output files
+    workers -- number of worker processes, None means one per CPU
+    spill_bytes -- bytes of compressed images to hold in memory, None means no limit
+    cache -- imagecache.CompressionCache object, None to always compress
+    max_size -- (long side, short side) images are downsampled to fit in, see target_size()
+    temp_dir -- directory of spilled files, see compressed_image_name()
+    executor -- concurrent.futures.Executor shared with other callers
+    qualities -- dictionary of {name: quality} of images with their own quality, see page_quality()
+    max_sizes -- dictionary of {name: (long side, short side)} of images with their own size, see page_max_size()
+    memory_budget -- bytes the images being decoded may take together, None means no limit
+    color_reduction -- (tolerance, bitonal) grayscale and bitonal pages are detected with, see encode()
+    journal -- journal.Journal object every spilled file is recorded in as soon as it is written
+    """
+    buffers = {}
+    temp_files = set()
+    pending = []
+    for name in dict.fromkeys(map(str, list_images)):
+        path = compressed_image_name(name, page_quality(name, quality, qualities),
+                                     page_max_size(name, max_size, max_sizes), temp_dir, color_reduction)
+        if os.path.isfile(path):
+            buffers[name] = path
+        else:
+            pending.append(name)
+
+    if not pending:
+        return buffers, temp_files
+
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return compress_all_to_memory(im_dir, pending, log_func, quality=quality, spill_bytes=spill_bytes,
+                                          cache=cache, max_size=max_size, temp_dir=temp_dir,
+                                          executor=executor, qualities=qualities, max_sizes=max_sizes,
+                                          memory_budget=memory_budget, color_reduction=color_reduction,
+                                          journal=journal)
+
+    held = 0
+    page_qualities = [page_quality(name, quality, qualities) for name in pending]
+    page_sizes = [page_max_size(name, max_size, max_sizes) for name in pending]
+    results = budgeted_map(executor, _compress_to_bytes_task, memory_costs(im_dir, pending, page_sizes, memory_budget),
+                           memory_budget, repeat(im_dir), pending, page_qualities, repeat(cache), page_sizes,
+                           repeat(instrument.is_recording(log_func)), repeat(color_reduction))
+    for name, page_q, page_size, (data, recorder) in zip(pending, page_qualities, page_sizes, results):
+        instrument.merge(log_func, recorder)
+        if spill_bytes is not None and held + len(data) > spill_bytes:
+            path = compressed_image_name(name, page_q, page_size, temp_dir, color_reduction)
+            with instrument.span(log_func, 'temp_write'):
+                write_atomically(path, data)
+            buffers[name] = path
+            temp_files.add(path)
+            if journal is not None:
+                journal.record_compressed(name, path, os.path.join(im_dir, name))
+            log_func(f'COMPRESSED {os.path.join(im_dir, name)} TO {path}')
+        else:
+            buffers[name] = data
+            held += len(data)
+            log_func(f'COMPRESSED {os.path.join(im_dir, name)} IN MEMORY')
+
+    return buffers, temp_files
+
+
+def trial_sizes(im_dir, file_name, max_size=None, cache=None, color_reduction=None):
+    """Return the sizes of an image compressed with every quality in QUALITY_GRID as {quality: bytes}.
+
+    The image is decoded once and encoded with every quality. Encoding is deterministic,
+    so the sizes are exactly the sizes compress() produces. If a cache is given,
+    the sizes are stored in it and an image is never trial-encoded twice.
+
+    Positional arguments:
+    im_dir -- directory path of the image
+    file_name -- name of the image file
+
+    Keyword arguments:
+    max_size -- (long side, short side) the image is downsampled to fit in, see target_size()
+    cache -- imagecache.CompressionCache object or None
+    color_reduction -- (tolerance, bitonal) grayscale and bitonal pages are detected with, see encode()
+    """
+    key = None
+    if cache is not None:
+        settings = encoder_settings(None, max_size, color_reduction)
+        settings['trials'] = QUALITY_GRID
+        key = cache.key(os.path.join(im_dir, file_name), settings)
+        sizes = cache.get_sizes(key)
+        if sizes is not None:
+            return sizes
+
+    picture = open_with_correct_rotation(im_dir, file_name, max_size)
+    mode = reduced_mode(picture, *color_reduction) if color_reduction else picture.mode
+    sizes = {}
+    for quality in QUALITY_GRID:
+        buffer = io.BytesIO()
+        save_page(picture, mode, buffer, quality)
+        sizes[quality] = buffer.tell()
+        if mode == '1':
+            # Bitonal pages don't have a quality
+            sizes = dict.fromkeys(QUALITY_GRID, buffer.tell())
+            break
+
+    if key is not None:
+        cache.put_sizes(key, sizes)
+    return sizes
+
+
+def allocate_qualities(sizes, counts, budget):
+    """Return {name: quality} of the highest qualities whose images fit in budget bytes together.
+
+    Every image gets a share of the budget in proportion to its size at a middle quality,
+    so complex pages get more bytes than simple ones, and the highest quality that fits
+    in its share. Images are then lowered, largest first, until they fit in the budget,
+    and the bytes left are spent raising the lowest qualities that still fit.
+    If the images don't fit even at the lowest quality, every image gets the lowest quality.
+
+    Positional arguments:
+    sizes -- dictionary of {name: {quality: bytes}} returned by trial_sizes()
+    counts -- dictionary of {name: number of pages showing the image}
+    budget -- bytes the images may take together
+    """
+    grid = sorted(QUALITY_GRID)
+    middle = grid[len(grid) // 2]
+    weight = {name: sizes[name][middle] * counts[name] for name in sizes}
+    total_weight = sum(weight.values()) or 1
+
+    qualities = {}
+    for name in sizes:
+        share = budget * weight[name] / total_weight / counts[name]
+        fitting = [q for q in grid if sizes[name][q] <= share]
+        qualities[name] = fitting[-1] if fitting else grid[0]
+
+    def total():
+        return sum(sizes[name][qualities[name]] * counts[name] for name in sizes)
+
+    # Lower the largest images until the budget is met
+    used = total()
+    while used > budget:
+        lowerable = [name for name in sizes if qualities[name] > grid[0]]
+        if not lowerable:
+            break
+        name = max(lowerable, key=lambda n: sizes[n][qualities[n]] * counts[n])
+        lower = grid[grid.index(qualities[name]) - 1]
+        used -= (sizes[name][qualities[name]] - sizes[name][lower]) * counts[name]
+        qualities[name] = lower
+
+    # Spend what is left raising the lowest qualities
+    while True:
+        candidates = []
+        for name in sizes:
+            if qualities[name] == grid[-1]:
+                continue
+            higher = grid[grid.index(qualities[name]) + 1]
+            extra = (sizes[name][higher] - sizes[name][qualities[name]]) * counts[name]
+            if used + extra <= budget:
+                candidates.append((qualities[name], extra, name, higher))
+        if not candidates:
+            break
+        _, extra, name, higher = min(candidates)
+        qualities[name] = higher
+        used += extra
+
+    return qualities
+
+
+def search_qualities(im_dir, list_images, target_bytes, log_func, workers=None, cache=None, max_size=None,
+                     executor=None, max_sizes=None, memory_budget=None, color_reduction=None):
+    """Return {name: quality} of every image so the pdf file of list_images fits in target_bytes.
+
+    Every image is trial-encoded with every quality in QUALITY_GRID in parallel, see trial_sizes().
+    Trial sizes are kept for the lifetime of the process and in the cache if one is given,
+    so searching again for the same images, e.g. with another target, doesn't decode them again.
+    The qualities are allocated by allocate_qualities().
+
+    Positional arguments:
+    im_dir -- directory path of the images
+    list_images -- list of names of the image files, in page order
+    target_bytes -- size limit of the pdf file in bytes
+    log_func -- log function
+
+    Keyword arguments:
+    workers -- number of worker processes, None means one per CPU, 1 to trial-encode in this process
+    cache -- imagecache.CompressionCache object or None
+    max_size -- (long side, short side) images are downsampled to fit in, see target_size()
+    executor -- concurrent.futures.Executor shared with other callers
+    max_sizes -- dictionary of {name: (long side, short side)} of images with their own size, see page_max_size()
+    memory_budget -- bytes the images being decoded may take together, see budgeted_map()
+    color_reduction -- (tolerance, bitonal) grayscale and bitonal pages are detected with, see encode()
+    """
+    counts = {}
+    for name in map(str, list_images):
+        counts[name] = counts.get(name, 0) + 1
+
+    sizes = {}
+    pending = []
+    memo_keys = {}
+    for name in counts:
+        stat = os.stat(os.path.join(im_dir, name))
+        memo_keys[name] = (os.path.abspath(os.path.join(im_dir, name)), stat.st_mtime_ns, stat.st_size,
+                           page_max_size(name, max_size, max_sizes), color_reduction)
+        if memo_keys[name] in trial_sizes_memo:
+            sizes[name] = trial_sizes_memo[memo_keys[name]]
+        else:
+            pending.append(name)
+
+    page_sizes = [page_max_size(name, max_size, max_sizes) for name in pending]
+    costs = memory_costs(im_dir, pending, page_sizes, memory_budget)
+    with instrument.span(log_func, 'trial_encode'):
+        if pending and executor is None and workers != 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(budgeted_map(pool, trial_sizes, costs, memory_budget, repeat(im_dir),
+                                            pending, page_sizes, repeat(cache), repeat(color_reduction)))
+        elif pending and executor is not None:
+            results = list(budgeted_map(executor, trial_sizes, costs, memory_budget, repeat(im_dir),
+                                        pending, page_sizes, repeat(cache), repeat(color_reduction)))
+        else:
+            results = [trial_sizes(im_dir, name, size, cache, color_reduction)
+                       for name, size in zip(pending, page_sizes)]
+
+    for name, result in zip(pending, results):
+        trial_sizes_memo[memo_keys[name]] = sizes[name] = result
+    instrument.count(log_func, 'trial_encoded', len(pending))
+
+    budget = target_bytes - DOCUMENT_OVERHEAD - PAGE_OVERHEAD * len(list_images)
+    qualities = allocate_qualities(sizes, counts, budget)
+
+    estimate = sum(sizes[name][qualities[name]] * counts[name] for name in counts) + target_bytes - budget
+    for name in counts:
+        log_func(f'QUALITY {qualities[name]} FOR {os.path.join(im_dir, name)}')
+    if estimate > target_bytes:
+        log_func(f'{target_bytes} BYTES CAN NOT BE MET, ESTIMATED {estimate} BYTES AT THE LOWEST QUALITY')
+    else:
+        log_func(f'ESTIMATED {estimate} BYTES FOR A TARGET OF {target_bytes} BYTES')
+
+    return qualities
+
+
+def content_hash(path):
+    """Return the SHA-256 hash of the contents of a file as a hex string"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def difference_hash(im_dir, file_name):
+    """Return (hash, displayed aspect ratio) of an image, the hash is a perceptual hash of HASH_SIZE ** 2 bits.
+
+    The image is decoded at a reduced scale, turned gray, rotated to its orientation
+    and shrunk to HASH_SIZE + 1 x HASH_SIZE pixels. Every bit tells whether a pixel
+    is darker than its right neighbour, so images that look the same have hashes
+    that differ in a few bits, even if they were encoded differently.
+
+    Positional arguments:
+    im_dir -- directory path of the image
+    file_name -- name of the image file
+    """
+    with Image.open(os.path.join(im_dir, file_name)) as picture:
+        orientation = image_orientation(os.path.join(im_dir, file_name), picture)
+        width, height = displayed_size(picture.size, orientation)
+        picture.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+        small = apply_orientation(picture.convert('L'), orientation)
+    small = small.resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR)
+
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(HASH_SIZE):
+        for column in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + column]
+            bits = bits << 1 | (left < pixels[row * (HASH_SIZE + 1) + column + 1])
+    return bits, width / height
+
+
+def _hash_task(im_dir, file_name, exact, perceptual):
+    """Return (content hash or None, difference hash or None) of an image, run by worker processes"""
+    return (content_hash(os.path.join(im_dir, file_name)) if exact else None,
+            difference_hash(im_dir, file_name) if perceptual else None)
+
+
+def find_duplicates(im_dir, list_images, log_func, near_threshold=None, workers=None, executor=None):
+    """Return {name: name of the first image showing the same picture} of every duplicate image in list_images.
+
+    Images with the same contents are duplicates. Only images that have the same file size
+    as another image are hashed, so a list without duplicates costs one stat per image.
+    If near_threshold is given, images whose perceptual hashes differ in at most
+    near_threshold bits and whose aspect ratios match are duplicates as well,
+    see difference_hash(). Hashes are computed in parallel like compress_all().
+
+    Positional arguments:
+    im_dir -- directory path of the images
+    list_images -- list of names of the image files, in page order
+    log_func -- log function
+
+    Keyword arguments:
+    near_threshold -- number of bits the perceptual hashes of near duplicates differ in,
+                      None to only find exact duplicates
+    workers -- number of worker processes, None means one per CPU, 1 to hash in this process
+    executor -- concurrent.futures.Executor shared with other callers
+    """
+    names = list(dict.fromkeys(map(str, list_images)))
+    sizes = {name: os.path.getsize(os.path.join(im_dir, name)) for name in names}
+    size_counts = {}
+    for size in sizes.values():
+        size_counts[size] = size_counts.get(size, 0) + 1
+
+    perceptual = near_threshold is not None
+    pending = [name for name in names if perceptual or size_counts[sizes[name]] > 1]
+    exact = [size_counts[sizes[name]] > 1 for name in pending]
+    if not pending:
+        return {}
+
+    with instrument.span(log_func, 'dedup_hash'):
+        if perceptual and executor is None and workers != 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                hashes = list(pool.map(_hash_task, repeat(im_dir), pending, exact, repeat(perceptual)))
+        elif perceptual and executor is not None:
+            hashes = list(executor.map(_hash_task, repeat(im_dir), pending, exact, repeat(perceptual)))
+        else:
+            hashes = [_hash_task(im_dir, name, is_exact, perceptual) for name, is_exact in zip(pending, exact)]
+
+    aliases = {}
+    contents = {}
+    originals = []
+    for name, (digest, near) in zip(pending, hashes):
+        if digest is not None and digest in contents:
+            aliases[name] = contents[digest]
+        elif near is not None:
+            for original, (bits, ratio) in originals:
+                if bin(bits ^ near[0]).count('1') <= near_threshold and \
+                        abs(ratio - near[1]) <= ASPECT_TOLERANCE * ratio:
+                    aliases[name] = original
+                    break
+
+        if name in aliases:
+            log_func(f'DUPLICATE {os.path.join(im_dir, name)} OF {os.path.join(im_dir, aliases[name])}')
+            continue
+        if digest is not None:
+            contents[digest] = name
+        if near is not None:
+            originals.append((name, near))
+
+    instrument.count(log_func, 'duplicates', len(aliases))
+    return aliases
+
+
+def fit_memory_budget(im_dir, list_images, max_size, memory_budget, log_func):
+    """Return {name: (long side, short side)} of images that only fit in memory_budget when downsampled.
+
+    Images whose estimate_memory() is larger than memory_budget even when they are decoded alone
+    are downsampled until it isn't, their long side shrinks by a fifth at a time.
+    Every other image keeps max_size.
+
+    Positional arguments:
+    im_dir -- directory path of the images
+    list_images -- list of names of the image files
+    max_size -- (long side, short side) every image is downsampled to fit in, or None
+    memory_budget -- bytes the images being decoded may take together
+    log_func -- log function
+    """
+    max_sizes = {}
+    for name in dict.fromkeys(map(str, list_images)):
+        path = os.path.join(im_dir, name)
+        if estimate_memory(path, max_size) <= memory_budget:
+            continue
+
+        info = jpegmeta.lookup(path)
+        if info is not None:
+            size = info.width, info.height
+        else:
+            with Image.open(path) as picture:
+                size = picture.size
+
+        long_side = max(fitted_size(size, max_size))
+        while True:
+            long_side = max(1, int(long_side * 0.8))
+            reduced = (long_side, min(long_side, max_size[1]) if max_size else long_side)
+            if long_side == 1 or estimate_memory(path, reduced) <= memory_budget:
+                break
+
+        max_sizes[name] = reduced
+        instrument.count(log_func, 'downscaled_for_memory')
+        log_func(f'DOWNSCALING {path} TO {fitted_size(size, reduced)} TO FIT THE MEMORY BUDGET')
+    return max_sizes
+
+
+def temp_cleanup(temp_list, log_func):
+    """Clean up the temp directory of the user.
+
+    Positional arguments:
+    temp_list -- list of names of the every temp file created
+    log_func -- log function
+    """
+    for file in temp_list:
+        os.remove(file)
+        log_func(f'REMOVING {file}')
+
+
+def create_pdf(pdf_file_path, list_images, quality=85, im_dir='', log_func=log, workers=1,
+               passthrough=False, writer='fpdf', in_memory=False, spill_bytes=None, cache=None,
+               max_dim=None, dpi=None, page_size='A4', temp_dir=None, executor=None,
+               progress_func=None, cancel_event=None, target_bytes=None, near_threshold=None, append=False,
+               memory_budget=None, gray_tolerance=None, bitonal=False, journal=None):
+    """Create pdf file and return any temp files created.
+
+    This is the main function called to create a pdf file.
+    If this function is called by this file, images are compressed here.
+    If this function is called by ui.py, images are already compressed before the call.
+    log_func parameter is added because this function can be called either from this file or ui.py,
+    in the ui version log function is different so it passes its own log function.
+    If workers is not 1, every image is compressed by compress_all() before the pdf is assembled,
+    otherwise images are compressed one at a time while pages are added.
+    If passthrough is True, images that passthrough_source() accepts are embedded
+    as they are and only the rest of the images are compressed.
+    The writer keyword selects how the file is written, see pdfwriter.open_writer().
+    With writer='stream' every page is written to the file as soon as it is added,
+    writer='compact' also packs the pages into object streams and writer='linear'
+    writes a linearized file, whose first page is shown before the rest is downloaded.
+    If in_memory is True, compressed images are passed to the writer as bytes and
+    temp files are only created when more than spill_bytes bytes would be held in memory.
+    If a cache is given, images are compressed through it and it is trimmed to its size limit at the end.
+    max_dim, dpi and page_size downsample large images, see target_size().
+    With dpi, a pixel also takes 72 / dpi points on the page instead of one, so an image
+    that fills the pixel size of page_size fills a page of that size.
+    If an executor is given, images are compressed by its workers before the pdf is assembled.
+    If log_func is an instrument.Tracer object, every stage is timed and pages and bytes are counted,
+    including the stages run by worker processes.
+    The file is written as {pdf_file_path}.part and renamed when it is complete,
+    so an existing file is only replaced by a complete one. If anything fails,
+    or cancel_event is set, the partial file is removed. Cancelling raises
+    ConversionCancelled, which holds the temp files created until then.
+    If target_bytes is given, quality is ignored and every image gets its own quality
+    so the file fits in target_bytes, see search_qualities(). passthrough is ignored
+    then, since the qualities are chosen from the sizes of re-encoded images.
+    Duplicate images are compressed once and embedded once, every page showing them
+    refers to the same image object, see find_duplicates(). near_threshold also
+    treats images that look the same as duplicates.
+    If append is True, the pages are added to the existing pdf file with an incremental
+    update, see pdfwriter.IncrementalPDFWriter, and writer is ignored. The file isn't
+    written under another name then, if anything fails it is cut back to its old size.
+    If the file doesn't exist yet, it is created as if append was False.
+    If memory_budget is given, images are only decoded in parallel while their estimated
+    decoded sizes fit in it together, and images that don't fit in it alone are downsampled
+    until they do, see fit_memory_budget(). It doesn't cover other conversions sharing executor.
+    If gray_tolerance is given or bitonal is True, pages that are grayscale within gray_tolerance are
+    compressed as 1-channel images, and if bitonal is True pages that are only black and white as
+    1-bit images, see reduced_mode(). Passed through images are embedded as they are.
+    If a journal is given, the duplicates, qualities, compressed files and, with a writer in
+    pdfwriter.RESUMABLE_WRITERS, every page written are recorded in it. If it was loaded from an interrupted conversion,
+    compressed files of unchanged images and the pages of the partial file are used again.
+    The partial file is kept then if the conversion fails, unless it was cancelled.
+
+    Positional arguments:
+    pdf_file_path -- path of the pdf file to be created
+    list_images -- list of every compressed images that are going to be used in the pdf.
+
+    Keyword arguments:
+    quality -- desired quality of the output file
+    im_dir -- directory path of the image to be compressed
+    log_func -- log function
+    workers -- number of worker processes used to compress images, None means one per CPU
+    passthrough -- embed original JPEG images without re-encoding them when possible
+    writer -- 'fpdf', 'stream', 'compact' or 'linear'
+    in_memory -- keep compressed images in memory instead of temp files
+    spill_bytes -- bytes of compressed images to hold in memory, None means no limit
+    cache -- imagecache.CompressionCache object, None to always compress
+    max_dim -- maximum width and height of images in pixels
+    dpi -- resolution of images printed on a page of page_size
+    page_size -- key of PAGE_SIZES, used with dpi
+    temp_dir -- directory of temp files, the temp directory of the user if None
+    executor -- concurrent.futures.Executor shared with other callers
+    progress_func -- function called with (pages added, number of pages) after every page
+    cancel_event -- threading.Event object that cancels the conversion when it is set
+    target_bytes -- size limit of the pdf file in bytes, None to use quality for every image
+    near_threshold -- number of bits the perceptual hashes of near duplicate images differ in,
+                      None to only merge exact duplicates
+    append -- add the pages to the end of the existing pdf file
+    memory_budget -- bytes the images being decoded may take together, None means no limit
+    gray_tolerance -- largest difference between the channels of a gray pixel, None to keep colors
+    bitonal -- also detect bitonal pages, gray_tolerance is DEFAULT_GRAY_TOLERANCE if it is None
+    journal -- journal.Journal object to record the progress in, None to not record it
+    """
+
+    temp_files = set()
+    if not pdf_file_path.endswith('.pdf'):
+        pdf_file_path += '.pdf'
+    if append and not os.path.isfile(pdf_file_path):
+        log_func(f'{pdf_file_path} DOES NOT EXIST, CREATING IT')
+        append = False
+
+    max_size = target_size(max_dim, dpi, page_size)
+    # Points a pixel takes on the page
+    scale = 72 / dpi if dpi else 1
+
+    color_reduction = color_settings(gray_tolerance, bitonal)
+
+    # Duplicates and qualities chosen before the conversion was interrupted
+    plan = journal.plan if journal is not None else None
+
+    # Every page shows the first image of its duplicates
+    if plan is None:
+        aliases = find_duplicates(im_dir, list_images, log_func, near_threshold, workers=workers,
+                                  executor=executor)
+    else:
+        aliases = plan['aliases']
+    list_images = [aliases.get(page, page) for page in map(str, list_images)]
+
+    # Sizes of images that don't use max_size, name -> (long side, short side)
+    max_sizes = None
+    if memory_budget is not None:
+        max_sizes = fit_memory_budget(im_dir, list_images, max_size, memory_budget, log_func)
+
+    # Qualities of images that don't use quality, name -> quality
+    qualities = None
+    if plan is not None:
+        qualities = plan['qualities']
+    elif target_bytes is not None:
+        qualities = search_qualities(im_dir, list_images, target_bytes, log_func, workers=workers, cache=cache,
+                                     max_size=max_size, executor=executor, max_sizes=max_sizes,
+                                     memory_budget=memory_budget, color_reduction=color_reduction)
+    if journal is not None and plan is None:
+        journal.record_plan(aliases, qualities)
+
+    def compressed_path(page):
+        """Return the path of the compressed file of a page"""
+        return compressed_image_name(page, page_quality(page, quality, qualities),
+                                     page_max_size(page, max_size, max_sizes), temp_dir, color_reduction)
+
+    def record_compressed(page):
+        """Record the compressed file of a page in the journal if there is one"""
+        if journal is not None and os.path.isfile(compressed_path(page)):
+            journal.record_compressed(page, compressed_path(page), os.path.join(im_dir, page))
+
+    if journal is not None and journal.resumed:
+        # Compressed files of images that changed since they were recorded are made again
+        for page in dict.fromkeys(list_images):
+            path = compressed_path(page)
+            if os.path.isfile(path) and not journal.is_current(page, path, os.path.join(im_dir, page)):
+                os.remove(path)
+
+    # Images that are embedded as they are, name -> (path, orientation, size)
+    sources = {}
+    if passthrough and qualities is None:
+        for page in dict.fromkeys(map(str, list_images)):
+            source = passthrough_source(im_dir, page, quality, max_size)
+            if source:
+                sources[page] = source
+
+    # Compressed images held in memory, name -> bytes or path of a spilled temp file
+    buffers = {}
+    remaining = [page for page in list_images if str(page) not in sources]
+    with instrument.span(log_func, 'compress_all'):
+        if (workers != 1 or executor is not None) and in_memory:
+            buffers, spilled = compress_all_to_memory(im_dir, remaining, log_func, quality=quality,
+                                                      workers=workers, spill_bytes=spill_bytes, cache=cache,
+                                                      max_size=max_size, temp_dir=temp_dir, executor=executor,
+                                                      qualities=qualities, max_sizes=max_sizes,
+                                                      memory_budget=memory_budget,
+                                                      color_reduction=color_reduction, journal=journal)
+            temp_files |= spilled
+        elif workers != 1 or executor is not None:
+            temp_files |= compress_all(im_dir, remaining, log_func, quality=quality, workers=workers,
+                                       cache=cache, max_size=max_size, temp_dir=temp_dir, executor=executor,
+                                       qualities=qualities, max_sizes=max_sizes, memory_budget=memory_budget,
+                                       color_reduction=color_reduction, journal=journal)
+
+    def check_cancelled():
+        """Raise ConversionCancelled if cancel_event is set"""
+        if cancel_event is not None and cancel_event.is_set():
+            raise ConversionCancelled(temp_files)
+
+    check_cancelled()
+
+    def page_source(page):
+        """Return (source, orientation) of a page, compressing its image if it wasn't compressed yet"""
+        if page in sources:
+            return sources[page][0], sources[page][1]
+        if page in buffers:
+            return buffers[page], 1
+
+        page_q = page_quality(page, quality, qualities)
+        page_size = page_max_size(page, max_size, max_sizes)
+        path = compressed_path(page)
+        if not os.path.isfile(path):
+            if in_memory:
+                return compress_to_bytes(im_dir, page, log_func, quality=page_q, cache=cache,
+                                         max_size=page_size, color_reduction=color_reduction), 1
+
+            compress(im_dir, page, log_func, quality=page_q, cache=cache, max_size=page_size,
+                     temp_dir=temp_dir, color_reduction=color_reduction)
+            temp_files.add(path)
+            record_compressed(page)
+
+        return path, 1
+
+    # Pages written to the partial file before the conversion was interrupted
+    resumed_pages = 0
+    if append:
+        part_path = None
+        if journal is not None and journal.append_size is not None:
+            # Cut off the pages an interrupted update left behind
+            if os.path.getsize(pdf_file_path) < journal.append_size:
+                raise ValueError(f'{pdf_file_path} changed since the conversion was interrupted')
+            with open(pdf_file_path, 'r+b') as file:
+                file.truncate(journal.append_size)
+        elif journal is not None:
+            journal.record_append(os.path.getsize(pdf_file_path))
+        pdf = pdfwriter.IncrementalPDFWriter(pdf_file_path, scale=scale)
+    else:
+        cover = str(list_images[0])
+        source, orientation = page_source(cover)
+        if isinstance(source, bytes):
+            # Keep the cover in memory so it isn't compressed again when its page is added
+            buffers[cover] = source
+        width, height = (side * scale for side in displayed_size(pdfwriter.image_info(source)[:2], orientation))
+
+        part_path = pdf_file_path + '.part'
+        pdf = None
+        if journal is not None and journal.writer_states and writer in pdfwriter.RESUMABLE_WRITERS and \
+                os.path.isfile(part_path):
+            try:
+                pdf = pdfwriter.open_writer(writer, part_path, width, height, states=journal.writer_states,
+                                            scale=scale)
+                resumed_pages = len(journal.writer_states)
+                log_func(f'RESUMING {part_path} AFTER {resumed_pages} PAGES')
+            except ValueError as e:
+                log_func(f'CAN NOT RESUME {part_path}: {e}')
+        if pdf is None:
+            if journal is not None and journal.writer_states:
+                journal.restart_pages()
+            pdf = pdfwriter.open_writer(writer, part_path, width, height, scale=scale)
+
+    # Only some writers can continue a partial file
+    checkpoints = journal is not None and not append and writer in pdfwriter.RESUMABLE_WRITERS
+    try:
+        for i, page in enumerate(map(str, list_images)):
+            check_cancelled()
+            if i < resumed_pages:
+                if progress_func is not None:
+                    progress_func(i + 1, len(list_images))
+                continue
+
+            source, orientation = page_source(page)
+            with instrument.span(log_func, 'embed'):
+                pdf.add_page(source, orientation, key=page)
+            if checkpoints:
+                journal.record_page(i, pdf.checkpoint())
+            instrument.count(log_func, 'pages')
+            if page in sources:
+                instrument.count(log_func, 'passthrough')
+            log_func(f'ADDING {source if isinstance(source, str) else os.path.join(im_dir, page)}')
+            if progress_func is not None:
+                progress_func(i + 1, len(list_images))
+
+        check_cancelled()
+        with instrument.span(log_func, 'output'):
+            pdf.close()
+        if part_path is not None:
+            os.replace(part_path, pdf_file_path)
+    except BaseException as e:
+        pdf.abort()
+        # The partial file of an interrupted conversion is continued when it is resumed
+        resumable = journal is not None and not isinstance(e, ConversionCancelled)
+        if part_path is not None and os.path.exists(part_path) and not resumable:
+            os.remove(part_path)
+        raise
+
+    instrument.count(log_func, 'pdf_bytes', os.path.getsize(pdf_file_path))
+    log_func(f'{"APPENDED" if append else "EXPORTED"} TO {pdf_file_path}')
+
+    if cache is not None:
+        with instrument.span(log_func, 'evict'):
+            freed = cache.evict()
+        if freed:
+            log_func(f'EVICTED {freed} BYTES FROM {cache.directory}')
+
+    return temp_files
+
+
+if __name__ == '__main__':
+    import cli
+    sys.exit(cli.main(use_daemon=False))
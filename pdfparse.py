@@ -0,0 +1,490 @@
+import re
+import zlib
+import collections
+
+WHITESPACE = b'\x00\t\n\x0c\r '
+DELIMITERS = b'()<>[]{}/%'
+
+# Characters a literal string escape sequence stands for
+ESCAPES = {ord('n'): b'\n', ord('r'): b'\r', ord('t'): b'\t', ord('b'): b'\b', ord('f'): b'\f',
+           ord('('): b'(', ord(')'): b')', ord('\\'): b'\\'}
+
+NUMBER = re.compile(rb'[+-]?(\d+\.?\d*|\.\d+)')
+INTEGER = re.compile(rb'\d+')
+
+Reference = collections.namedtuple('Reference', ['id', 'generation'])
+
+
+class Name(str):
+    """A PDF name such as /Type, stored without its slash"""
+
+
+def skip_whitespace(data, pos):
+    """Return the position of the first character at or after pos that isn't whitespace or a comment"""
+    while pos < len(data):
+        if data[pos] in WHITESPACE:
+            pos += 1
+        elif data[pos] == ord('%'):
+            while pos < len(data) and data[pos] not in b'\r\n':
+                pos += 1
+        else:
+            break
+    return pos
+
+
+def _token_end(data, pos):
+    """Return the position after the regular characters starting at pos"""
+    while pos < len(data) and data[pos] not in WHITESPACE and data[pos] not in DELIMITERS:
+        pos += 1
+    return pos
+
+
+def parse_object(data, pos=0):
+    """Parse one PDF object in data and return (object, position after it).
+
+    Dictionaries are returned as dict with Name keys, arrays as lists, names as Name,
+    strings as bytes, indirect references as Reference and numbers as int or float.
+    Streams aren't parsed, only the dictionary before the stream keyword is.
+
+    Positional arguments:
+    data -- bytes the object is in
+
+    Keyword arguments:
+    pos -- position the object starts at, whitespace before it is skipped
+    """
+    pos = skip_whitespace(data, pos)
+    if pos >= len(data):
+        raise ValueError('Unexpected end of PDF data')
+
+    if data.startswith(b'<<', pos):
+        dictionary = {}
+        pos += 2
+        while True:
+            pos = skip_whitespace(data, pos)
+            if data.startswith(b'>>', pos):
+                return dictionary, pos + 2
+            key, pos = parse_object(data, pos)
+            if not isinstance(key, Name):
+                raise ValueError(f'Dictionary key is not a name at {pos}')
+            dictionary[key], pos = parse_object(data, pos)
+
+    char = data[pos]
+    if char == ord('['):
+        array = []
+        pos += 1
+        while True:
+            pos = skip_whitespace(data, pos)
+            if data.startswith(b']', pos):
+                return array, pos + 1
+            value, pos = parse_object(data, pos)
+            array.append(value)
+
+    if char == ord('/'):
+        end = _token_end(data, pos + 1)
+        name = re.sub(rb'#([0-9A-Fa-f]{2})', lambda m: bytes([int(m.group(1), 16)]), data[pos + 1:end])
+        return Name(name.decode('latin-1')), end
+
+    if char == ord('<'):
+        end = data.index(b'>', pos)
+        digits = re.sub(rb'\s', b'', data[pos + 1:end])
+        if len(digits) % 2:
+            digits += b'0'
+        return bytes.fromhex(digits.decode('ascii')), end + 1
+
+    if char == ord('('):
+        return _parse_literal_string(data, pos + 1)
+
+    end = _token_end(data, pos)
+    token = data[pos:end]
+    if not token:
+        raise ValueError(f'Unexpected character {chr(char)!r} at {pos}')
+    if token == b'true':
+        return True, end
+    if token == b'false':
+        return False, end
+    if token == b'null':
+        return None, end
+    if not NUMBER.fullmatch(token):
+        raise ValueError(f'Unexpected token {token!r} at {pos}')
+    if b'.' in token:
+        return float(token), end
+
+    # An integer may be the object number of an indirect reference such as 12 0 R
+    number = int(token)
+    generation_pos = skip_whitespace(data, end)
+    generation = INTEGER.match(data, generation_pos)
+    if generation:
+        r_pos = skip_whitespace(data, generation.end())
+        if data[r_pos:r_pos + 1] == b'R' and _token_end(data, r_pos) == r_pos + 1:
+            return Reference(number, int(generation.group())), r_pos + 1
+    return number, end
+
+
+def _parse_literal_string(data, pos):
+    """Parse a literal string whose opening parenthesis is before pos and return (bytes, position after it)"""
+    result = bytearray()
+    depth = 1
+    while True:
+        char = data[pos]
+        pos += 1
+        if char == ord('\\'):
+            escaped = data[pos]
+            pos += 1
+            if escaped in ESCAPES:
+                result += ESCAPES[escaped]
+            elif ord('0') <= escaped <= ord('7'):
+                octal = re.match(rb'[0-7]{1,3}', data[pos - 1:pos + 2]).group()
+                result.append(int(octal, 8) & 0xFF)
+                pos += len(octal) - 1
+            elif escaped == ord('\r'):
+                if data[pos:pos + 1] == b'\n':
+                    pos += 1
+            elif escaped != ord('\n'):
+                result.append(escaped)
+        elif char == ord('('):
+            depth += 1
+            result.append(char)
+        elif char == ord(')'):
+            depth -= 1
+            if depth == 0:
+                return bytes(result), pos
+            result.append(char)
+        else:
+            result.append(char)
+
+
+def serialize(value):
+    """Return the PDF source of an object returned by parse_object()"""
+    if isinstance(value, Name):
+        return '/' + ''.join(c if 33 <= ord(c) <= 126 and c not in '()<>[]{}/%#' else f'#{ord(c):02X}'
+                             for c in value)
+    if isinstance(value, Reference):
+        return f'{value.id} {value.generation} R'
+    if isinstance(value, dict):
+        return '<<' + ' '.join(f'{serialize(Name(key))} {serialize(item)}' for key, item in value.items()) + '>>'
+    if isinstance(value, list):
+        return '[' + ' '.join(serialize(item) for item in value) + ']'
+    if isinstance(value, bytes):
+        return '<' + value.hex() + '>'
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    if value is None:
+        return 'null'
+    if isinstance(value, float):
+        return f'{value:.4f}'.rstrip('0').rstrip('.')
+    return str(value)
+
+
+def undo_png_predictors(data, row_length, pixel_length):
+    """Return data with the PNG predictor of every row undone.
+
+    Positional arguments:
+    data -- rows that each start with the byte of their predictor
+    row_length -- bytes in a row without its predictor byte
+    pixel_length -- bytes in a pixel, at least 1
+    """
+    rows = []
+    previous = bytearray(row_length)
+    for pos in range(0, len(data), row_length + 1):
+        predictor = data[pos]
+        row = bytearray(data[pos + 1:pos + 1 + row_length])
+        for i in range(len(row)):
+            left = row[i - pixel_length] if i >= pixel_length else 0
+            up = previous[i]
+            if predictor == 1:
+                row[i] = (row[i] + left) & 0xFF
+            elif predictor == 2:
+                row[i] = (row[i] + up) & 0xFF
+            elif predictor == 3:
+                row[i] = (row[i] + (left + up) // 2) & 0xFF
+            elif predictor == 4:
+                up_left = previous[i - pixel_length] if i >= pixel_length else 0
+                estimate = left + up - up_left
+                distances = abs(estimate - left), abs(estimate - up), abs(estimate - up_left)
+                if distances[0] <= min(distances[1:]):
+                    closest = left
+                else:
+                    closest = up if distances[1] <= distances[2] else up_left
+                row[i] = (row[i] + closest) & 0xFF
+        rows.append(bytes(row))
+        previous = row
+    return b''.join(rows)
+
+
+def decode_stream(dictionary, data):
+    """Return the data of a stream with its filters undone.
+
+    Only FlateDecode is supported, with or without predictors.
+    Raises ValueError for other filters.
+
+    Positional arguments:
+    dictionary -- stream dictionary returned by parse_object()
+    data -- bytes between the stream and endstream keywords
+    """
+    filters = dictionary.get('Filter', [])
+    parameters = dictionary.get('DecodeParms', [])
+    if not isinstance(filters, list):
+        filters, parameters = [filters], [parameters]
+
+    for i, name in enumerate(filters):
+        if name != 'FlateDecode':
+            raise ValueError(f'Streams with the {name} filter are not supported')
+        data = zlib.decompress(data)
+
+        parameter = parameters[i] if i < len(parameters) and parameters[i] else {}
+        predictor = parameter.get('Predictor', 1)
+        if predictor >= 10:
+            pixel_bits = parameter.get('Colors', 1) * parameter.get('BitsPerComponent', 8)
+            data = undo_png_predictors(data, (parameter.get('Columns', 1) * pixel_bits + 7) // 8,
+                                       max(1, pixel_bits // 8))
+        elif predictor != 1:
+            raise ValueError(f'Predictor {predictor} is not supported')
+    return data
+
+
+class PDFReader:
+    """A class to read the structure of an existing pdf file without loading it
+
+    Only the end of the file, the cross-reference sections and the objects
+    that are asked for are read, so opening a large file costs about the same
+    as opening a small one. Cross-reference tables and streams are read, and
+    objects in object streams as well, the last object stream read is kept.
+
+    Methods:
+    object(object_id) -- return the object with the given number
+    resolve(value) -- return the object a Reference points to, or value itself
+    page_tree() -- return (id of the root page tree node, its dictionary)
+    page_size() -- return (width, height) of the first page in points
+    linearization() -- return the linearization dictionary of the file, None if it isn't linearized
+    """
+
+    def __init__(self, pdf_file_path):
+        """Initiate method for PDFReader
+
+        Positional arguments:
+        pdf_file_path -- path of the pdf file
+        """
+        self.pdf_file_path = pdf_file_path
+        self.file = open(pdf_file_path, 'rb')
+        try:
+            self.startxref = self._find_startxref()
+            # Object number -> offset, (number of its object stream, index in it) or None if it is free
+            self.offsets = {}
+            self.trailer = None
+            # True if the last cross-reference section is a stream
+            self.xref_stream = None
+            # (number, first offset, [(object number, offset)], data) of the last object stream read
+            self.object_stream = None
+            self._read_xref(self.startxref)
+        except BaseException:
+            self.file.close()
+            raise
+
+        if 'Encrypt' in self.trailer:
+            self.file.close()
+            raise ValueError('Encrypted pdf files are not supported')
+
+    def __enter__(self):
+        """Return the reader itself, the file is closed at the end of the with block"""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Close the file"""
+        self.close()
+
+    def close(self):
+        """Close the file"""
+        self.file.close()
+
+    def _find_startxref(self):
+        """Return the offset written after the last startxref keyword of the file"""
+        self.file.seek(0, 2)
+        size = self.file.tell()
+        self.file.seek(max(0, size - 2048))
+        tail = self.file.read()
+        pos = tail.rfind(b'startxref')
+        if pos < 0:
+            raise ValueError('No startxref found, the file is not a complete pdf file')
+        return parse_object(tail, pos + len(b'startxref'))[0]
+
+    def _read_xref(self, offset):
+        """Read the cross-reference section at offset and every earlier section it refers to with /Prev"""
+        visited = set()
+        while offset is not None and offset not in visited:
+            visited.add(offset)
+            self.file.seek(offset)
+            is_stream = self.file.read(4) != b'xref'
+            if is_stream:
+                trailer = self._read_xref_stream(offset)
+            else:
+                trailer = self._read_xref_table(offset)
+
+            if self.trailer is None:
+                self.trailer = trailer
+                self.xref_stream = is_stream
+            offset = trailer.get('Prev')
+
+    def _read_xref_table(self, offset):
+        """Read the cross-reference table at offset and return its trailer"""
+        data = self._read_until(offset, b'startxref')
+        pos = data.index(b'trailer')
+        trailer = parse_object(data, pos + len(b'trailer'))[0]
+        # A hybrid file lists the objects in object streams in a cross-reference stream, the table lists them as free
+        if 'XRefStm' in trailer:
+            self._read_xref_stream(trailer['XRefStm'])
+
+        pos = len(b'xref')
+        while True:
+            pos = skip_whitespace(data, pos)
+            if data.startswith(b'trailer', pos):
+                return trailer
+            start, pos = parse_object(data, pos)
+            count, pos = parse_object(data, pos)
+            pos = skip_whitespace(data, pos)
+            for i in range(count):
+                entry = data[pos + 20 * i:pos + 20 * i + 20]
+                # Newer sections are read first, their entries win
+                if start + i not in self.offsets:
+                    self.offsets[start + i] = int(entry[:10]) if entry[17:18] == b'n' else None
+            pos += 20 * count
+
+    def _read_xref_stream(self, offset):
+        """Read the cross-reference stream at offset and return its dictionary, which is its trailer"""
+        dictionary, data = self._read_stream(offset)
+        if dictionary.get('Type') != 'XRef':
+            raise ValueError(f'No cross-reference section at offset {offset}')
+
+        widths = dictionary['W']
+        index = dictionary.get('Index', [0, dictionary['Size']])
+        pos = 0
+        for start, count in zip(index[::2], index[1::2]):
+            for object_id in range(start, start + count):
+                fields = []
+                for width in widths:
+                    fields.append(int.from_bytes(data[pos:pos + width], 'big'))
+                    pos += width
+                # The type is 1 if its field is left out
+                entry_type = fields[0] if widths[0] else 1
+                if object_id in self.offsets:
+                    continue
+                if entry_type == 1:
+                    self.offsets[object_id] = fields[1]
+                elif entry_type == 2:
+                    self.offsets[object_id] = fields[1], fields[2]
+                else:
+                    self.offsets[object_id] = None
+        return dictionary
+
+    def _read_stream(self, offset):
+        """Return (dictionary, data with its filters undone) of the stream object at offset"""
+        data = self._read_until(offset, b'stream')
+        match = re.match(rb'\s*(\d+)\s+(\d+)\s+obj', data)
+        if not match:
+            raise ValueError(f'No object at offset {offset}')
+        dictionary = parse_object(data, match.end())[0]
+
+        # The stream keyword is followed by CRLF or LF
+        start = offset + len(data)
+        self.file.seek(start)
+        start += 2 if self.file.read(1) == b'\r' else 1
+        length = self.resolve(dictionary['Length'])
+        self.file.seek(start)
+        return dictionary, decode_stream(dictionary, self.file.read(length))
+
+    def _read_until(self, offset, keyword, chunk_size=65536):
+        """Return the bytes of the file from offset until the end of the next keyword"""
+        self.file.seek(offset)
+        data = b''
+        while True:
+            chunk = self.file.read(chunk_size)
+            if not chunk:
+                raise ValueError(f'{keyword.decode()} not found after offset {offset}')
+            # The keyword can be split between two chunks
+            search_from = max(0, len(data) - len(keyword))
+            data += chunk
+            pos = data.find(keyword, search_from)
+            if pos >= 0:
+                return data[:pos + len(keyword)]
+
+    def object(self, object_id):
+        """Return the object with the given number, None if it is free or missing.
+
+        Positional arguments:
+        object_id -- object number
+        """
+        offset = self.offsets.get(object_id)
+        if offset is None:
+            return None
+        if isinstance(offset, tuple):
+            return self._compressed_object(object_id, *offset)
+
+        data = self._read_until(offset, b'endobj')
+        match = re.match(rb'\s*(\d+)\s+(\d+)\s+obj', data)
+        if not match or int(match.group(1)) != object_id:
+            raise ValueError(f'Object {object_id} is not at offset {offset}')
+        return parse_object(data, match.end())[0]
+
+    def _compressed_object(self, object_id, stream_id, index):
+        """Return an object stored in an object stream.
+
+        Positional arguments:
+        object_id -- object number
+        stream_id -- object number of the object stream
+        index -- index of the object in the object stream
+        """
+        if self.object_stream is None or self.object_stream[0] != stream_id:
+            dictionary, data = self._read_stream(self.offsets[stream_id])
+            numbers = [int(number) for number in INTEGER.findall(data[:dictionary['First']])]
+            self.object_stream = stream_id, dictionary['First'], list(zip(numbers[::2], numbers[1::2])), data
+
+        _, first, objects, data = self.object_stream
+        number, position = objects[index]
+        if number != object_id:
+            raise ValueError(f'Object {object_id} is not in object stream {stream_id}')
+        return parse_object(data, first + position)[0]
+
+    def resolve(self, value):
+        """Return the object a Reference points to, or value itself if it isn't a Reference"""
+        if isinstance(value, Reference):
+            return self.object(value.id)
+        return value
+
+    def page_tree(self):
+        """Return (id of the root page tree node, its dictionary)"""
+        pages_ref = self.resolve(self.trailer['Root'])['Pages']
+        return pages_ref.id, self.resolve(pages_ref)
+
+    def page_size(self):
+        """Return (width, height) in points of the first page, its MediaBox may be inherited from the page tree"""
+        node = self.resolve(self.resolve(self.trailer['Root'])['Pages'])
+        media_box = None
+        while node is not None:
+            media_box = self.resolve(node.get('MediaBox', media_box))
+            kids = self.resolve(node.get('Kids'))
+            if not kids:
+                break
+            node = self.resolve(kids[0])
+
+        if media_box is None:
+            raise ValueError('The pdf file has no page size')
+        x0, y0, x1, y1 = (self.resolve(value) for value in media_box)
+        return x1 - x0, y1 - y0
+
+    def linearization(self):
+        """Return the linearization dictionary of the file, None if it isn't linearized or was updated since"""
+        self.file.seek(0)
+        match = re.search(rb'\d+\s+\d+\s+obj', self.file.read(1024))
+        if not match:
+            return None
+        self.file.seek(match.end())
+        try:
+            dictionary = parse_object(self.file.read(1024))[0]
+        except (ValueError, IndexError):
+            return None
+        if not isinstance(dictionary, dict) or 'Linearized' not in dictionary:
+            return None
+
+        self.file.seek(0, 2)
+        return dictionary if dictionary.get('L') == self.file.tell() else None
@@ -0,0 +1,978 @@
+import io
+import os
+import zlib
+import shutil
+import struct
+import collections
+from fpdf import FPDF
+import jpegmeta
+import pdfparse
+
+PDF_HEADER = b'%PDF-1.3\n%\xe2\xe3\xcf\xd3\n'
+# Object and cross-reference streams need pdf 1.5
+COMPACT_HEADER = b'%PDF-1.5\n%\xe2\xe3\xcf\xd3\n'
+PRODUCER = 'JPEG-to-PDF'
+
+COLORSPACES = {1: 'DeviceGray', 3: 'DeviceRGB', 4: 'DeviceCMYK'}
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Number of objects CompactPDFWriter packs into one object stream
+OBJECT_STREAM_SIZE = 100
+
+# Entries of a cross-reference stream dictionary that describe the stream, not the file
+XREF_STREAM_KEYS = ('Type', 'W', 'Index', 'Length', 'Filter', 'DecodeParms')
+
+# Writers that can continue an unfinished file, see StreamingPDFWriter.checkpoint()
+RESUMABLE_WRITERS = ('stream', 'compact')
+
+
+def read_jpeg_info(fp):
+    """Read the frame header of a JPEG file and return (width, height, components, bits).
+
+    Only the markers before the first SOF marker are read, the position of fp is restored afterwards.
+
+    Positional arguments:
+    fp -- binary file object of the JPEG image
+    """
+    info = jpegmeta.read_info(fp)
+    return info.width, info.height, info.components, info.bits
+
+
+def read_png(data):
+    """Return (width, height, components, bits, pixel data) of a grayscale PNG image.
+
+    The pixel data is the zlib stream of the IDAT chunks, a pdf file holds it as it is
+    with the FlateDecode filter and the PNG predictors, see png_dictionary().
+    Raises ValueError if data isn't a grayscale PNG image without interlacing.
+
+    Positional arguments:
+    data -- the PNG image as bytes
+    """
+    if bytes(data[:len(PNG_SIGNATURE)]) != PNG_SIGNATURE:
+        raise ValueError('Not a PNG file')
+
+    header = None
+    chunks = []
+    pos = len(PNG_SIGNATURE)
+    try:
+        while pos < len(data):
+            length, chunk_type = struct.unpack_from('>I4s', data, pos)
+            chunk = data[pos + 8:pos + 8 + length]
+            if chunk_type == b'IHDR':
+                header = struct.unpack('>IIBBBBB', chunk)
+            elif chunk_type == b'IDAT':
+                chunks.append(bytes(chunk))
+            elif chunk_type == b'IEND':
+                break
+            # Length, type and CRC
+            pos += 12 + length
+    except struct.error:
+        raise ValueError('Corrupt PNG file')
+
+    if header is None:
+        raise ValueError('Corrupt PNG file')
+    width, height, bits, color_type, _, _, interlace = header
+    if color_type != 0 or interlace:
+        raise ValueError('Only grayscale PNG images without interlacing are supported')
+    return width, height, 1, bits, b''.join(chunks)
+
+
+def image_info(source):
+    """Return (width, height, components, bits) of a JPEG or PNG image given as a path or as bytes.
+
+    JPEG images given as a path are looked up in the metadata index, see jpegmeta.lookup().
+
+    Positional arguments:
+    source -- path of the image or the image itself as bytes
+    """
+    if isinstance(source, str):
+        info = jpegmeta.lookup(source)
+        if info is not None:
+            return info.width, info.height, info.components, info.bits
+        with open(source, 'rb') as fp:
+            data = fp.read()
+        if not data.startswith(PNG_SIGNATURE):
+            raise ValueError(f'{source} is not a JPEG or PNG file')
+        return read_png(data)[:4]
+    if bytes(source[:len(PNG_SIGNATURE)]) == PNG_SIGNATURE:
+        return read_png(source)[:4]
+    return read_jpeg_info(io.BytesIO(source))
+
+
+def png_dictionary(width, height, components, bits):
+    """Return the stream dictionary entries of an image XObject holding the pixel data of a PNG image.
+
+    Positional arguments:
+    width -- width of the image in pixels
+    height -- height of the image in pixels
+    components -- number of color components of the image
+    bits -- bits per component
+    """
+    return (f'/Type /XObject /Subtype /Image /Width {width} /Height {height} '
+            f'/ColorSpace /{COLORSPACES[components]} /BitsPerComponent {bits} /Filter /FlateDecode '
+            f'/DecodeParms <<{png_decode_parameters(width, components, bits)}>>')
+
+
+def png_decode_parameters(width, components, bits):
+    """Return the FlateDecode parameters that undo the PNG predictors of every row of an image"""
+    return f'/Predictor 15 /Colors {components} /BitsPerComponent {bits} /Columns {width}'
+
+
+def image_dictionary(width, height, components, bits):
+    """Return the stream dictionary entries of a JPEG image XObject.
+
+    Positional arguments:
+    width -- width of the image in pixels
+    height -- height of the image in pixels
+    components -- number of color components of the image
+    bits -- bits per component
+    """
+    dictionary = (f'/Type /XObject /Subtype /Image /Width {width} /Height {height} '
+                  f'/ColorSpace /{COLORSPACES[components]} /BitsPerComponent {bits} /Filter /DCTDecode')
+    if components == 4:
+        # Adobe applications write inverted CMYK JPEG images, same as FPDF
+        dictionary += ' /Decode [1 0 1 0 1 0 1 0]'
+    return dictionary
+
+
+def orientation_matrix(orientation, width, height, page_height):
+    """Return the PDF transformation matrix that shows an image drawn at the top left of a page in its EXIF orientation.
+
+    Images are drawn with their stored width and height, the matrix rotates them
+    in place so the displayed image also starts at the top left corner of the page.
+
+    Positional arguments:
+    orientation -- EXIF orientation of the image
+    width -- stored width of the image in points
+    height -- stored height of the image in points
+    page_height -- height of the page in points
+    """
+    if orientation == 3:
+        return -1, 0, 0, -1, width, 2 * page_height - height
+    if orientation == 6:
+        return 0, -1, 1, 0, height - page_height, page_height
+    if orientation == 8:
+        return 0, 1, -1, 0, page_height, page_height - width
+    return 1, 0, 0, 1, 0, 0
+
+
+def page_content(orientation, width, height, page_height, name):
+    """Return the content stream of a page that draws an image at its top left in its EXIF orientation.
+
+    Positional arguments:
+    orientation -- EXIF orientation of the image
+    width -- stored width of the image in points
+    height -- stored height of the image in points
+    page_height -- height of the page in points
+    name -- name of the image in the resources of the page, without its slash
+    """
+    content = 'q %.2f %.2f %.2f %.2f %.2f %.2f cm ' % orientation_matrix(orientation, width, height, page_height)
+    content += 'q %.2f 0 0 %.2f 0 %.2f cm /%s Do Q Q' % (width, height, page_height - height, name)
+    return content.encode('latin-1')
+
+
+def subsections(object_ids):
+    """Return (first object number, count) of every run of consecutive numbers in a sorted list of object numbers"""
+    runs = []
+    start = 0
+    for i in range(1, len(object_ids) + 1):
+        if i == len(object_ids) or object_ids[i] != object_ids[i - 1] + 1:
+            runs.append((object_ids[start], i - start))
+            start = i
+    return runs
+
+
+def pack_bits(values, bits):
+    """Return values packed into bytes with the given number of bits each, padded to a whole byte.
+
+    Positional arguments:
+    values -- list of non-negative integers smaller than 2 ** bits
+    bits -- number of bits of every value
+    """
+    number = 0
+    for value in values:
+        number = number << bits | value
+    padding = -len(values) * bits % 8
+    return (number << padding).to_bytes((len(values) * bits + padding) // 8, 'big')
+
+
+def open_writer(kind, pdf_file_path, width, height, states=None, scale=1):
+    """Return a writer of the given kind for a pdf file with pages of size width x height.
+
+    IncrementalPDFWriter isn't opened here, it takes its page size from the file it appends to.
+
+    Positional arguments:
+    kind -- 'fpdf' to build the document in memory, 'stream' to write pages as they are added,
+            'compact' to also pack the pages into object streams or 'linear' for a linearized file
+    pdf_file_path -- path of the pdf file to be created
+    width -- page width in points
+    height -- page height in points
+
+    Keyword arguments:
+    states -- list of states returned by checkpoint() to continue an unfinished file from, see RESUMABLE_WRITERS
+    scale -- points a pixel of an image takes on the page, 72 / DPI
+    """
+    if kind == 'fpdf':
+        return FPDFWriter(pdf_file_path, width, height, scale=scale)
+    if kind == 'stream':
+        return StreamingPDFWriter(pdf_file_path, width, height, states=states, scale=scale)
+    if kind == 'compact':
+        return CompactPDFWriter(pdf_file_path, width, height, states=states, scale=scale)
+    if kind == 'linear':
+        return LinearizedPDFWriter(pdf_file_path, width, height, scale=scale)
+    raise ValueError(f'Unknown pdf writer: {kind}')
+
+
+class FPDFWriter:
+    """A class to write a pdf file with FPDF
+
+    Every page is kept in memory and the file is written when close() is called.
+    Images are registered in FPDF's image table directly with the header read
+    by image_info() or read_png(), so FPDF never parses them. Pages showing the same image share
+    one image object, see add_page().
+
+    Methods:
+    add_page(source, orientation=1, key=None) -- add a page showing a JPEG or PNG image
+    close() -- write the pdf file
+    abort() -- discard every page without writing the file
+    """
+
+    def __init__(self, pdf_file_path, width, height, scale=1):
+        """Initiate method for FPDFWriter
+
+        Positional arguments:
+        pdf_file_path -- path of the pdf file to be created
+        width -- page width in points
+        height -- page height in points
+
+        Keyword arguments:
+        scale -- points a pixel of an image takes on the page, 72 / DPI
+        """
+        self.pdf_file_path = pdf_file_path
+        self.scale = scale
+        self.pdf = FPDF(unit='pt', format=[width, height])
+        self.buffer_count = 0
+        self.buffer_names = {}
+
+    def _register(self, name, source, data):
+        """Add a JPEG or PNG image to FPDF's image table under name"""
+        if bytes(data[:len(PNG_SIGNATURE)]) == PNG_SIGNATURE:
+            width, height, components, bits, pixels = read_png(data)
+            self.pdf.images[name] = {'w': width, 'h': height, 'cs': COLORSPACES[components], 'bpc': bits,
+                                     'f': 'FlateDecode', 'dp': png_decode_parameters(width, components, bits),
+                                     'data': pixels, 'i': len(self.pdf.images) + 1}
+            return
+
+        width, height, components, bits = image_info(source)
+        self.pdf.images[name] = {'w': width, 'h': height, 'cs': COLORSPACES[components],
+                                 'bpc': bits, 'f': 'DCTDecode', 'data': bytes(data), 'i': len(self.pdf.images) + 1}
+
+    def _register_buffer(self, data):
+        """Add an image given as bytes to FPDF's image table and return the name it is stored with"""
+        self.buffer_count += 1
+        name = f'<buffer {self.buffer_count}>'
+        self._register(name, data, data)
+        return name
+
+    def add_page(self, source, orientation=1, key=None):
+        """Add a page and draw a JPEG or PNG image at its top left in its EXIF orientation.
+
+        FPDF stores an image given as a path once, no matter how many pages show it.
+        Images given as bytes are stored once for every key.
+
+        Positional arguments:
+        source -- path of the image or the image itself as bytes
+
+        Keyword arguments:
+        orientation -- EXIF orientation of the image
+        key -- name of the image, pages with the same key share its image object
+        """
+        if isinstance(source, str):
+            name = source
+            if name not in self.pdf.images:
+                with open(source, 'rb') as fp:
+                    self._register(name, source, fp.read())
+        elif key is not None and key in self.buffer_names:
+            name = self.buffer_names[key]
+        else:
+            name = self._register_buffer(source)
+            if key is not None:
+                self.buffer_names[key] = name
+
+        self.pdf.add_page()
+        info = self.pdf.images[name]
+        width, height = info['w'] * self.scale, info['h'] * self.scale
+        if orientation not in (3, 6, 8):
+            self.pdf.image(name, 0, 0, width, height)
+            return
+
+        matrix = orientation_matrix(orientation, width, height, self.pdf.h)
+        self.pdf._out('q %.2f %.2f %.2f %.2f %.2f %.2f cm' % matrix)
+        self.pdf.image(name, 0, 0, width, height)
+        self.pdf._out('Q')
+
+    def close(self):
+        """Write the pdf file"""
+        self.pdf.output(self.pdf_file_path, 'F')
+
+    def abort(self):
+        """Discard every page, nothing has been written to the file yet"""
+        self.pdf = None
+
+
+class StreamingPDFWriter:
+    """A class to write a pdf file page by page
+
+    Every image is copied to the file as soon as its page is added,
+    only the object offsets are kept in memory. The page tree, catalog
+    and cross-reference table are written when close() is called.
+    Pages showing the same image share one image object, see add_page().
+    An unfinished file can be continued from the states checkpoint() returned.
+
+    Methods:
+    add_page(source, orientation=1, key=None) -- add a page showing a JPEG or PNG image
+    checkpoint() -- flush the file and return what was written since the last checkpoint
+    close() -- finish the pdf file
+    abort() -- close the unfinished file, the caller removes it
+    """
+
+    header = PDF_HEADER
+
+    def __init__(self, pdf_file_path, width, height, states=None, scale=1):
+        """Initiate method for StreamingPDFWriter
+
+        Raises ValueError if states are given and the file is shorter than they say.
+
+        Positional arguments:
+        pdf_file_path -- path of the pdf file to be created
+        width -- page width in points
+        height -- page height in points
+
+        Keyword arguments:
+        states -- list of states returned by checkpoint() to continue an unfinished file from, None to start a new file
+        scale -- points a pixel of an image takes on the page, 72 / DPI
+        """
+        self.pdf_file_path = pdf_file_path
+        self.width = width
+        self.height = height
+        self.scale = scale
+        self.offsets = {}
+        self.page_ids = []
+        # Image objects already written, key -> (object id, width, height)
+        self.images = {}
+
+        self.object_count = 0
+        self.pages_id = self._new_object()
+        self.catalog_id = self._new_object()
+        self.info_id = self._new_object()
+
+        if not states:
+            self.file = open(pdf_file_path, 'wb')
+            self.file.write(self.header)
+        else:
+            for state in states:
+                self.offsets.update((int(object_id), offset) for object_id, offset in state['offsets'].items())
+                self.page_ids.extend(state['page_ids'])
+                self.images.update((key, tuple(image)) for key, image in state['images'].items())
+            self.object_count = states[-1]['object_count']
+
+            self.file = open(pdf_file_path, 'r+b')
+            if os.fstat(self.file.fileno()).st_size < states[-1]['size']:
+                self.file.close()
+                raise ValueError(f'{pdf_file_path} is shorter than its last checkpoint')
+            # Anything written after the last checkpoint is incomplete
+            self.file.truncate(states[-1]['size'])
+            self.file.seek(states[-1]['size'])
+
+        # Objects and pages already returned by checkpoint()
+        self.checkpointed_objects = self.object_count
+        self.checkpointed_pages = len(self.page_ids)
+
+    def _new_object(self):
+        """Reserve an object number and return it"""
+        self.object_count += 1
+        return self.object_count
+
+    def _begin_object(self, object_id):
+        """Record the offset of an object and write its header"""
+        self.offsets[object_id] = self.file.tell()
+        self.file.write(f'{object_id} 0 obj\n'.encode('latin-1'))
+
+    def _write_object(self, object_id, body):
+        """Write an object that has no stream
+
+        Positional arguments:
+        object_id -- number of the object
+        body -- PDF source of the object
+        """
+        self._begin_object(object_id)
+        self.file.write(f'{body}\nendobj\n'.encode('latin-1'))
+
+    def _write_stream(self, object_id, dictionary, data=None, source=None, length=0):
+        """Write a stream object from bytes or by copying a binary file object
+
+        Positional arguments:
+        object_id -- number of the object
+        dictionary -- entries of the stream dictionary except /Length
+
+        Keyword arguments:
+        data -- bytes of the stream
+        source -- binary file object to copy the stream from, used when data is None
+        length -- length of the stream copied from source
+        """
+        if data is not None:
+            length = len(data)
+
+        self._begin_object(object_id)
+        self.file.write(f'<<{dictionary} /Length {length}>>\nstream\n'.encode('latin-1'))
+        if data is not None:
+            self.file.write(data)
+        else:
+            shutil.copyfileobj(source, self.file)
+        self.file.write(b'\nendstream\nendobj\n')
+
+    def _write_xref_stream(self, trailer, compressed=None):
+        """Write a compressed cross-reference stream of the objects written and the end of the file.
+
+        Only objects in self.offsets and compressed are listed. If compressed is given,
+        the stream is the only cross-reference section of the file and lists the free object 0 as well.
+
+        Positional arguments:
+        trailer -- dictionary of trailer entries such as Root, Info and Prev, Size is added
+
+        Keyword arguments:
+        compressed -- dictionary of {object number: (number of its object stream, index in it)}
+        """
+        xref_id = self._new_object()
+        xref_offset = self.offsets[xref_id] = self.file.tell()
+        width = max(1, (max(xref_offset, self.object_count).bit_length() + 7) // 8)
+
+        rows = {object_id: b'\x01' + offset.to_bytes(width, 'big') + b'\x00\x00'
+                for object_id, offset in self.offsets.items()}
+        if compressed is not None:
+            rows[0] = b'\x00' + bytes(width) + b'\xff\xff'
+            rows.update((object_id, b'\x02' + stream_id.to_bytes(width, 'big') + index.to_bytes(2, 'big'))
+                        for object_id, (stream_id, index) in compressed.items())
+        object_ids = sorted(rows)
+
+        trailer = dict(trailer)
+        trailer.update({'Type': pdfparse.Name('XRef'), 'Size': self.object_count + 1,
+                        'Index': [number for run in subsections(object_ids) for number in run],
+                        'W': [1, width, 2], 'Filter': pdfparse.Name('FlateDecode')})
+        data = zlib.compress(b''.join(rows[object_id] for object_id in object_ids))
+        self._write_stream(xref_id, pdfparse.serialize(trailer)[2:-2], data=data)
+        self.file.write(f'startxref\n{xref_offset}\n%%EOF\n'.encode('latin-1'))
+
+    def _write_image(self, source):
+        """Write a JPEG or PNG image given as a path or as bytes and return (object id, width, height).
+
+        JPEG images are copied as they are, only the pixel data of PNG images is copied, see read_png().
+        """
+        image_id = self._new_object()
+        if isinstance(source, str):
+            with open(source, 'rb') as fp:
+                is_png = fp.read(len(PNG_SIGNATURE)) == PNG_SIGNATURE
+                fp.seek(0)
+                if not is_png:
+                    width, height, components, bits = image_info(source)
+                    self._write_stream(image_id, image_dictionary(width, height, components, bits),
+                                       source=fp, length=os.fstat(fp.fileno()).st_size)
+                    return image_id, width, height
+                source = fp.read()
+
+        if bytes(source[:len(PNG_SIGNATURE)]) == PNG_SIGNATURE:
+            width, height, components, bits, pixels = read_png(source)
+            self._write_stream(image_id, png_dictionary(width, height, components, bits), data=pixels)
+        else:
+            width, height, components, bits = read_jpeg_info(io.BytesIO(source))
+            self._write_stream(image_id, image_dictionary(width, height, components, bits),
+                               data=memoryview(source).cast('B'))
+
+        return image_id, width, height
+
+    def _add_image(self, source, key):
+        """Return (object id, width, height) of the image of a page, it is written unless its key was added before"""
+        if key is None and isinstance(source, str):
+            key = source
+        if key is not None and key in self.images:
+            return self.images[key]
+
+        image = self._write_image(source)
+        if key is not None:
+            self.images[key] = image
+        return image
+
+    def add_page(self, source, orientation=1, key=None):
+        """Add a page and draw a JPEG or PNG image at its top left in its EXIF orientation.
+
+        An image is written once for every key, later pages with the same key
+        refer to the image object that was already written.
+
+        Positional arguments:
+        source -- path of the image or the image itself as bytes
+
+        Keyword arguments:
+        orientation -- EXIF orientation of the image
+        key -- name of the image, the path of source if None
+        """
+        image_id, width, height = self._add_image(source, key)
+        content_id = self._new_object()
+        self._write_stream(content_id, '', data=page_content(orientation, width * self.scale, height * self.scale,
+                                                             self.height, f'I{image_id}'))
+
+        page_id = self._new_object()
+        self._write_object(page_id, f'<</Type /Page /Parent {self.pages_id} 0 R '
+                                    f'/MediaBox [0 0 {self.width:.2f} {self.height:.2f}] '
+                                    f'/Resources <</ProcSet [/PDF /ImageB /ImageC] '
+                                    f'/XObject <</I{image_id} {image_id} 0 R>>>> '
+                                    f'/Contents {content_id} 0 R>>')
+        self.page_ids.append(page_id)
+
+    def checkpoint(self):
+        """Flush the file and return the objects, pages and images written since the last checkpoint as a dictionary.
+
+        Passing every state returned so far to __init__() continues the file from here.
+        """
+        self.file.flush()
+        state = {'size': self.file.tell(), 'object_count': self.object_count,
+                 'offsets': {object_id: offset for object_id, offset in self.offsets.items()
+                             if object_id > self.checkpointed_objects},
+                 'page_ids': self.page_ids[self.checkpointed_pages:],
+                 'images': {key: list(image) for key, image in self.images.items()
+                            if image[0] > self.checkpointed_objects}}
+        self.checkpointed_objects = self.object_count
+        self.checkpointed_pages = len(self.page_ids)
+        return state
+
+    def close(self):
+        """Write the page tree, catalog and cross-reference table and close the file"""
+        kids = ' '.join(f'{page_id} 0 R' for page_id in self.page_ids)
+        self._write_object(self.pages_id, f'<</Type /Pages /Kids [{kids}] /Count {len(self.page_ids)}>>')
+        self._write_object(self.catalog_id, f'<</Type /Catalog /Pages {self.pages_id} 0 R>>')
+        self._write_object(self.info_id, f'<</Producer ({PRODUCER})>>')
+
+        xref_offset = self.file.tell()
+        xref = [f'xref\n0 {self.object_count + 1}\n', '0000000000 65535 f \n']
+        for object_id in range(1, self.object_count + 1):
+            xref.append(f'{self.offsets[object_id]:010d} 00000 n \n')
+        xref.append(f'trailer\n<</Size {self.object_count + 1} /Root {self.catalog_id} 0 R '
+                    f'/Info {self.info_id} 0 R>>\nstartxref\n{xref_offset}\n%%EOF\n')
+        self.file.write(''.join(xref).encode('latin-1'))
+        self.file.close()
+
+    def abort(self):
+        """Close the unfinished file without writing the page tree, so it can be removed"""
+        self.file.close()
+
+
+class IncrementalPDFWriter(StreamingPDFWriter):
+    """A class to append pages to an existing pdf file with an incremental update
+
+    The existing file is never rewritten. New images, pages, the root page tree node
+    with the new pages added to its kids and a cross-reference section listing only
+    those objects are written after the end of the file, so appending costs about
+    the same no matter how large the file is. New pages get the size of the first
+    page of the file, images are drawn with scale points a pixel. The cross-reference
+    section is a stream if the last section of the file is one.
+
+    Methods:
+    add_page(source, orientation=1, key=None) -- add a page showing a JPEG or PNG image
+    close() -- finish the update
+    abort() -- cut the file back to its size before the update
+    """
+
+    def __init__(self, pdf_file_path, scale=1):
+        """Initiate method for IncrementalPDFWriter
+
+        Positional arguments:
+        pdf_file_path -- path of the pdf file to append to
+
+        Keyword arguments:
+        scale -- points a pixel of an image takes on the page, 72 / DPI
+        """
+        with pdfparse.PDFReader(pdf_file_path) as reader:
+            self.width, self.height = reader.page_size()
+            self.pages_id, pages = reader.page_tree()
+            # Kids and Count may be indirect objects, the update writes them directly into the node
+            self.pages = dict(pages, **{key: reader.resolve(pages[key]) for key in ('Kids', 'Count')
+                                        if key in pages})
+            self.trailer = reader.trailer
+            self.prev = reader.startxref
+            self.xref_stream = reader.xref_stream
+
+        self.pdf_file_path = pdf_file_path
+        self.scale = scale
+        self.offsets = {}
+        self.page_ids = []
+        self.images = {}
+
+        self.object_count = self.trailer['Size'] - 1
+        self.checkpointed_objects = self.object_count
+        self.checkpointed_pages = 0
+
+        self.file = open(pdf_file_path, 'r+b')
+        self.file.seek(0, 2)
+        self.original_size = self.file.tell()
+        self.file.seek(-1, 2)
+        if self.file.read(1) not in b'\r\n':
+            self.file.write(b'\n')
+
+    def close(self):
+        """Write the root page tree node, the cross-reference section of the update and its trailer, close the file"""
+        pages = dict(self.pages)
+        pages['Kids'] = list(pages.get('Kids', [])) + [pdfparse.Reference(page_id, 0)
+                                                       for page_id in self.page_ids]
+        pages['Count'] = pages.get('Count', 0) + len(self.page_ids)
+        self._write_object(self.pages_id, pdfparse.serialize(pages))
+
+        trailer = {key: value for key, value in self.trailer.items()
+                   if key not in ('Size', 'Prev', 'XRefStm') + XREF_STREAM_KEYS}
+        trailer['Prev'] = self.prev
+        if self.xref_stream:
+            self._write_xref_stream(trailer)
+            self.file.close()
+            return
+
+        xref_offset = self.file.tell()
+        xref = ['xref\n']
+        object_ids = sorted(self.offsets)
+        for start, count in subsections(object_ids):
+            xref.append(f'{start} {count}\n')
+            xref.extend(f'{self.offsets[object_id]:010d} 00000 n \n' for object_id in range(start, start + count))
+
+        trailer['Size'] = self.object_count + 1
+        xref.append(f'trailer\n{pdfparse.serialize(trailer)}\nstartxref\n{xref_offset}\n%%EOF\n')
+        self.file.write(''.join(xref).encode('latin-1'))
+        self.file.close()
+
+    def abort(self):
+        """Cut the file back to its size before the update and close it"""
+        self.file.truncate(self.original_size)
+        self.file.close()
+
+
+class CompactPDFWriter(StreamingPDFWriter):
+    """A class to write a compact pdf 1.5 file page by page
+
+    Images are copied to the file as soon as their page is added, like StreamingPDFWriter does.
+    Pages showing images of the same size and orientation share one content stream, which draws
+    the image named /I0 in their resources, and the page size is only stored in the page tree.
+    Page objects, the page tree, catalog and info are kept in memory and packed into compressed
+    object streams when close() is called, followed by a compressed cross-reference stream,
+    so every page takes a few bytes of the file besides its image instead of hundreds.
+
+    Methods:
+    add_page(source, orientation=1, key=None) -- add a page showing a JPEG or PNG image
+    checkpoint() -- flush the file and return what was written since the last checkpoint
+    close() -- write the object streams and the cross-reference stream
+    abort() -- close the unfinished file, the caller removes it
+    """
+
+    header = COMPACT_HEADER
+
+    def __init__(self, pdf_file_path, width, height, states=None, scale=1):
+        """Initiate method for CompactPDFWriter
+
+        Raises ValueError if states are given and the file is shorter than they say.
+
+        Positional arguments:
+        pdf_file_path -- path of the pdf file to be created
+        width -- page width in points
+        height -- page height in points
+
+        Keyword arguments:
+        states -- list of states returned by checkpoint() to continue an unfinished file from, None to start a new file
+        scale -- points a pixel of an image takes on the page, 72 / DPI
+        """
+        # Page object id -> (image object id, content stream object id), the page objects are written by close()
+        self.page_objects = {}
+        # Content streams already written, (orientation, image width, image height) -> object id
+        self.contents = {}
+        super().__init__(pdf_file_path, width, height, states=states, scale=scale)
+
+        for state in states or []:
+            self.page_objects.update((page_id, (image_id, content_id))
+                                     for page_id, image_id, content_id in state['page_objects'])
+            self.contents.update(((orientation, width, height), content_id)
+                                 for orientation, width, height, content_id in state['contents'])
+
+    def add_page(self, source, orientation=1, key=None):
+        """Add a page and draw a JPEG or PNG image at its top left in its EXIF orientation.
+
+        An image is written once for every key and a content stream once for every size
+        and orientation of the images, later pages refer to the objects already written.
+
+        Positional arguments:
+        source -- path of the image or the image itself as bytes
+
+        Keyword arguments:
+        orientation -- EXIF orientation of the image
+        key -- name of the image, the path of source if None
+        """
+        image_id, width, height = self._add_image(source, key)
+
+        content_key = (orientation if orientation in (3, 6, 8) else 1, width, height)
+        if content_key not in self.contents:
+            self.contents[content_key] = self._new_object()
+            self._write_stream(self.contents[content_key], '',
+                               data=page_content(content_key[0], width * self.scale, height * self.scale,
+                                                 self.height, 'I0'))
+
+        page_id = self._new_object()
+        self.page_objects[page_id] = image_id, self.contents[content_key]
+        self.page_ids.append(page_id)
+
+    def checkpoint(self):
+        """Flush the file and return the objects, pages and images written since the last checkpoint as a dictionary.
+
+        Passing every state returned so far to __init__() continues the file from here.
+        """
+        page_objects = [[page_id, *self.page_objects[page_id]] for page_id in self.page_ids[self.checkpointed_pages:]]
+        contents = [[*content_key, content_id] for content_key, content_id in self.contents.items()
+                    if content_id > self.checkpointed_objects]
+        state = super().checkpoint()
+        state['page_objects'] = page_objects
+        state['contents'] = contents
+        return state
+
+    def close(self):
+        """Write the page objects, page tree, catalog and info in object streams and the cross-reference stream.
+
+        The file is closed afterwards.
+        """
+        objects = {page_id: f'<</Type /Page /Parent {self.pages_id} 0 R /Resources <</XObject <</I0 {image_id} 0 R>>>> '
+                            f'/Contents {content_id} 0 R>>'
+                   for page_id, (image_id, content_id) in self.page_objects.items()}
+        kids = ' '.join(f'{page_id} 0 R' for page_id in self.page_ids)
+        objects[self.pages_id] = (f'<</Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} '
+                                  f'/MediaBox [0 0 {self.width:.2f} {self.height:.2f}]>>')
+        objects[self.catalog_id] = f'<</Type /Catalog /Pages {self.pages_id} 0 R>>'
+        objects[self.info_id] = f'<</Producer ({PRODUCER})>>'
+
+        # Object number -> (number of its object stream, index in it)
+        compressed = {}
+        object_ids = sorted(objects)
+        for start in range(0, len(object_ids), OBJECT_STREAM_SIZE):
+            chunk = object_ids[start:start + OBJECT_STREAM_SIZE]
+            bodies = [objects[object_id].encode('latin-1') for object_id in chunk]
+            positions = [0]
+            for body in bodies[:-1]:
+                positions.append(positions[-1] + len(body) + 1)
+            index = ' '.join(f'{object_id} {position}' for object_id, position in zip(chunk, positions))
+            index = index.encode('latin-1') + b'\n'
+
+            stream_id = self._new_object()
+            self._write_stream(stream_id, f'/Type /ObjStm /N {len(chunk)} /First {len(index)} /Filter /FlateDecode',
+                               data=zlib.compress(index + b'\n'.join(bodies)))
+            compressed.update((object_id, (stream_id, i)) for i, object_id in enumerate(chunk))
+
+        self._write_xref_stream({'Root': pdfparse.Reference(self.catalog_id, 0),
+                                 'Info': pdfparse.Reference(self.info_id, 0)}, compressed)
+        self.file.close()
+
+
+class LinearizedPDFWriter(CompactPDFWriter):
+    """A class to write a linearized pdf file, whose first page can be shown before the rest of it is downloaded
+
+    Pages are added like CompactPDFWriter does, but only the data of the image and content streams
+    is written to the file while pages are added. close() writes the file again in the order of
+    the linearized format: the linearization dictionary, a cross-reference section of the first page,
+    the catalog, the hint tables and every object the first page needs come first, followed by the
+    other pages, the objects several pages share and the main cross-reference section. The hint tables
+    tell a viewer where every page and shared object is. Every page object holds its page size.
+    Closing copies every stream once more and the file can't be continued after an interruption.
+
+    Methods:
+    add_page(source, orientation=1, key=None) -- add a page showing a JPEG or PNG image
+    close() -- write the linearized file
+    abort() -- close the unfinished file, the caller removes it
+    """
+
+    header = PDF_HEADER
+
+    def __init__(self, pdf_file_path, width, height, scale=1):
+        """Initiate method for LinearizedPDFWriter
+
+        Positional arguments:
+        pdf_file_path -- path of the pdf file to be created
+        width -- page width in points
+        height -- page height in points
+
+        Keyword arguments:
+        scale -- points a pixel of an image takes on the page, 72 / DPI
+        """
+        # Stream object id -> (stream dictionary entries, offset of its data in the file, length of its data)
+        self.streams = {}
+        super().__init__(pdf_file_path, width, height, scale=scale)
+
+    def _write_stream(self, object_id, dictionary, data=None, source=None, length=0):
+        """Write the data of a stream object and remember where it is, close() writes the object around it"""
+        if data is not None:
+            length = len(data)
+
+        self.streams[object_id] = dictionary, self.file.tell(), length
+        if data is not None:
+            self.file.write(data)
+        else:
+            shutil.copyfileobj(source, self.file)
+
+    def _pieces(self, object_id, numbers):
+        """Return the parts of an object in the linearized file, bytes or (offset, length) of stream data to copy
+
+        Positional arguments:
+        object_id -- number of the object while pages were added
+        numbers -- dictionary of {number while pages were added: number in the linearized file}
+        """
+        number = numbers[object_id]
+        if object_id in self.streams:
+            dictionary, offset, length = self.streams[object_id]
+            return [f'{number} 0 obj\n<<{dictionary} /Length {length}>>\nstream\n'.encode('latin-1'),
+                    (offset, length), b'\nendstream\nendobj\n']
+
+        if object_id in self.page_objects:
+            image_id, content_id = self.page_objects[object_id]
+            body = (f'<</Type /Page /Parent {numbers[self.pages_id]} 0 R '
+                    f'/MediaBox [0 0 {self.width:.2f} {self.height:.2f}] '
+                    f'/Resources <</XObject <</I0 {numbers[image_id]} 0 R>>>> /Contents {numbers[content_id]} 0 R>>')
+        elif object_id == self.pages_id:
+            kids = ' '.join(f'{numbers[page_id]} 0 R' for page_id in self.page_ids)
+            body = f'<</Type /Pages /Kids [{kids}] /Count {len(self.page_ids)}>>'
+        elif object_id == self.catalog_id:
+            body = f'<</Type /Catalog /Pages {numbers[self.pages_id]} 0 R>>'
+        else:
+            body = f'<</Producer ({PRODUCER})>>'
+        return [f'{number} 0 obj\n{body}\nendobj\n'.encode('latin-1')]
+
+    def _hint_tables(self, sections, shared, lengths, offsets, numbers):
+        """Return the data of the hint stream and the length of its page offset hint table.
+
+        Offsets in hint tables leave out the hint stream itself.
+
+        Positional arguments:
+        sections -- list of the objects in the section of every page, its page object first
+        shared -- list of the objects in the shared objects section
+        lengths -- dictionary of {object: length in the file}
+        offsets -- dictionary of {object: offset in the file without the hint stream}
+        numbers -- dictionary of {number while pages were added: number in the linearized file}
+        """
+        # Shared objects are numbered by the hint tables: the objects of the first page, then the shared section
+        shared_numbers = {object_id: i for i, object_id in enumerate(sections[0] + shared)}
+        object_counts = [len(section) for section in sections]
+        page_lengths = [sum(lengths[object_id] for object_id in section) for section in sections]
+        references = [[shared_numbers[object_id] for object_id in reversed(self.page_objects[section[0]])
+                       if object_id not in section] for section in sections]
+        largest_reference = max((number for page in references for number in page), default=0)
+
+        least_objects, least_length = min(object_counts), min(page_lengths)
+        objects_bits = (max(object_counts) - least_objects).bit_length()
+        length_bits = (max(page_lengths) - least_length).bit_length()
+        count_bits = max(len(page) for page in references).bit_length()
+        reference_bits = largest_reference.bit_length()
+
+        # Like Acrobat, the content stream of a page is said to be the whole page
+        page_table = struct.pack('>IIHIHIHIHHHHH', least_objects, offsets[sections[0][0]], objects_bits,
+                                 least_length, length_bits, 0, 0, least_length, length_bits,
+                                 count_bits, reference_bits, 0, 1)
+        page_table += pack_bits([count - least_objects for count in object_counts], objects_bits)
+        page_table += pack_bits([length - least_length for length in page_lengths], length_bits)
+        page_table += pack_bits([len(page) for page in references], count_bits)
+        page_table += pack_bits([number for page in references for number in page], reference_bits)
+        page_table += pack_bits([length - least_length for length in page_lengths], length_bits)
+
+        shared_lengths = [lengths[object_id] for object_id in sections[0] + shared]
+        least_shared = min(shared_lengths)
+        shared_bits = (max(shared_lengths) - least_shared).bit_length()
+        shared_table = struct.pack('>IIIIHIH', numbers[shared[0]] if shared else 0,
+                                   offsets[shared[0]] if shared else 0, len(sections[0]),
+                                   len(shared_lengths), 0, least_shared, shared_bits)
+        shared_table += pack_bits([length - least_shared for length in shared_lengths], shared_bits)
+        shared_table += pack_bits([0] * len(shared_lengths), 1)
+
+        return page_table + shared_table, len(page_table)
+
+    def close(self):
+        """Write the linearized file in place of the stream data written so far and close it"""
+        pages = [(page_id, *self.page_objects[page_id]) for page_id in self.page_ids]
+        users = collections.Counter(object_id for _, image_id, content_id in pages
+                                    for object_id in (image_id, content_id))
+
+        # Every page section holds its page object and the streams only it shows, the first one everything it shows
+        sections = [[page_id] for page_id in self.page_ids]
+        shared = []
+        placed = set()
+        for i, (_, image_id, content_id) in enumerate(pages):
+            for object_id in (content_id, image_id):
+                if object_id not in placed:
+                    placed.add(object_id)
+                    (sections[i] if i == 0 or users[object_id] == 1 else shared).append(object_id)
+
+        # Objects of the first page come last in number, so the first cross-reference section holds only them
+        main = [object_id for section in sections[1:] for object_id in section] + shared + [self.pages_id, self.info_id]
+        first_page = ['linearization', self.catalog_id, 'hints'] + sections[0]
+        numbers = {object_id: number for number, object_id in enumerate(main + first_page, 1)}
+        first_number, size = numbers['linearization'], len(numbers) + 1
+
+        pieces = {object_id: self._pieces(object_id, numbers) for object_id in main + first_page[1:2] + sections[0]}
+        lengths = {object_id: sum(len(piece) if isinstance(piece, bytes) else piece[1] for piece in object_pieces)
+                   for object_id, object_pieces in pieces.items()}
+
+        def linearization(length, hints, hints_length, first_page_end, main_xref):
+            return (f'{first_number} 0 obj\n<</Linearized 1 /L {length:10d} /H [{hints:10d} {hints_length:10d}] '
+                    f'/O {numbers[sections[0][0]]} /E {first_page_end:10d} /N {len(pages)} /T {main_xref:10d}>>\n'
+                    f'endobj\n').encode('latin-1')
+
+        def first_xref(offsets, main_xref):
+            entries = ''.join(f'{offsets[object_id]:010d} 00000 n \n' for object_id in first_page)
+            return (f'xref\n{first_number} {len(first_page)}\n{entries}trailer\n<</Size {size} '
+                    f'/Root {numbers[self.catalog_id]} 0 R /Info {numbers[self.info_id]} 0 R /Prev {main_xref:10d}>>\n'
+                    f'startxref\n0\n%%EOF\n').encode('latin-1')
+
+        # Numbers are padded, so these two take the same space whatever the offsets are
+        offsets = {'linearization': len(self.header)}
+        position = offsets['linearization'] + len(linearization(0, 0, 0, 0, 0))
+        xref_offset = position
+        position += len(first_xref(collections.defaultdict(int), 0))
+        for object_id in first_page[1:2] + sections[0] + main:
+            offsets[object_id] = position
+            position += lengths[object_id]
+
+        hints, shared_table = self._hint_tables(sections, shared, lengths, offsets, numbers)
+        hints_object = (f'{numbers["hints"]} 0 obj\n<</S {shared_table} /Length {len(hints)}>>\nstream\n'
+                        .encode('latin-1') + hints + b'\nendstream\nendobj\n')
+        offsets['hints'] = offsets[sections[0][0]]
+        for object_id in sections[0] + main:
+            offsets[object_id] += len(hints_object)
+        pieces['hints'] = [hints_object]
+
+        main_xref = offsets[main[-1]] + lengths[main[-1]]
+        entries = ''.join(f'{offsets[object_id]:010d} 00000 n \n' for object_id in main)
+        main_xref_section = (f'xref\n0 {first_number}\n0000000000 65535 f \n{entries}'
+                             f'trailer\n<</Size {first_number}>>\nstartxref\n{xref_offset}\n%%EOF\n').encode('latin-1')
+        first_page_end = offsets[sections[0][-1]] + lengths[sections[0][-1]]
+
+        self.file.close()
+        temp_path = self.pdf_file_path + '.tmp'
+        try:
+            with open(self.pdf_file_path, 'rb') as body, open(temp_path, 'wb') as file:
+                file.write(self.header)
+                file.write(linearization(main_xref + len(main_xref_section), offsets['hints'], len(hints_object),
+                                         first_page_end, main_xref + len(f'xref\n0 {first_number}')))
+                file.write(first_xref(offsets, main_xref))
+                for object_id in first_page[1:] + main:
+                    for piece in pieces[object_id]:
+                        if isinstance(piece, bytes):
+                            file.write(piece)
+                            continue
+                        offset, length = piece
+                        body.seek(offset)
+                        while length:
+                            chunk = body.read(min(length, 1024 * 1024))
+                            file.write(chunk)
+                            length -= len(chunk)
+                file.write(main_xref_section)
+            os.replace(temp_path, self.pdf_file_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
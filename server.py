@@ -0,0 +1,419 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+import collections
+import email.parser
+import email.policy
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from PIL import UnidentifiedImageError
+import cli
+import journal
+import jpegtopdf
+import imagecache
+
+
+def parse_bool(value):
+    """Return a boolean given as JSON or as a query string value such as 1, true or yes"""
+    return value if isinstance(value, bool) else str(value).lower() in ('1', 'true', 'yes')
+
+
+def parse_bytes(value):
+    """Return a size given as a number of bytes or as a string such as 10MB, see cli.parse_size()"""
+    return value if isinstance(value, int) else cli.parse_size(value)
+
+
+def parse_choice(choices):
+    """Return a function that returns a string value if it is in choices and raises ValueError otherwise"""
+    def parse(value):
+        if str(value) not in choices:
+            raise ValueError(f'{value} is not one of {", ".join(choices)}')
+        return str(value)
+    return parse
+
+
+# Options a request can set and how their values are read, the rest of create_pdf()'s keywords are fixed
+REQUEST_OPTIONS = {'quality': int, 'max_dim': int, 'dpi': int, 'page_size': parse_choice(list(cli.PAGE_SIZES)),
+                   'writer': parse_choice(cli.WRITERS),
+                   'target_bytes': parse_bytes, 'near_threshold': int, 'passthrough': parse_bool,
+                   'gray_tolerance': int, 'bitonal': parse_bool}
+
+# Upper bounds of the latency histogram in seconds
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+
+# Seconds pages/sec is averaged over
+RATE_WINDOW = 60
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 411: 'Length Required',
+           413: 'Payload Too Large', 429: 'Too Many Requests', 500: 'Internal Server Error'}
+
+
+class HTTPError(Exception):
+    """Raised while handling a request to answer it with an error status
+
+    Attributes:
+    status -- HTTP status code
+    """
+
+    def __init__(self, status, message):
+        """Initiate method for HTTPError
+
+        Positional arguments:
+        status -- HTTP status code
+        message -- text of the response
+        """
+        super().__init__(message)
+        self.status = status
+
+
+class Metrics:
+    """A class to count requests, their latencies and the pages converted
+
+    Methods:
+    observe(status, seconds, pages=0) -- record a finished request
+    render(queue_length, running) -- return every metric in the Prometheus text format
+    """
+
+    def __init__(self):
+        """Initiate method for Metrics"""
+        self.requests = collections.Counter()
+        self.latency_counts = [0] * len(LATENCY_BUCKETS)
+        self.latency_sum = 0.0
+        self.latency_count = 0
+        self.pages_total = 0
+        # (time, pages) of conversions finished in the last RATE_WINDOW seconds
+        self.recent = collections.deque()
+
+    def observe(self, status, seconds, pages=0):
+        """Record a finished request.
+
+        Positional arguments:
+        status -- HTTP status code of the response
+        seconds -- time from reading the request to the end of the response
+
+        Keyword arguments:
+        pages -- number of pages converted
+        """
+        self.requests[status] += 1
+        if status != 200:
+            return
+
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.latency_counts[i] += 1
+                break
+        self.latency_sum += seconds
+        self.latency_count += 1
+        self.pages_total += pages
+        self.recent.append((time.monotonic(), pages))
+
+    def pages_per_second(self):
+        """Return the pages converted per second in the last RATE_WINDOW seconds"""
+        now = time.monotonic()
+        while self.recent and self.recent[0][0] < now - RATE_WINDOW:
+            self.recent.popleft()
+        return sum(pages for _, pages in self.recent) / RATE_WINDOW
+
+    def render(self, queue_length, running):
+        """Return every metric in the Prometheus text format.
+
+        Positional arguments:
+        queue_length -- number of requests waiting for a conversion slot
+        running -- number of conversions running
+        """
+        lines = [f'jpegtopdf_queue_length {queue_length}',
+                 f'jpegtopdf_running {running}',
+                 f'jpegtopdf_pages_total {self.pages_total}',
+                 f'jpegtopdf_pages_per_second {self.pages_per_second():.3f}']
+        for status, n in sorted(self.requests.items()):
+            lines.append(f'jpegtopdf_requests_total{{status="{status}"}} {n}')
+
+        cumulative = 0
+        for bound, n in zip(LATENCY_BUCKETS, self.latency_counts):
+            cumulative += n
+            le = '+Inf' if bound == float('inf') else bound
+            lines.append(f'jpegtopdf_latency_seconds_bucket{{le="{le}"}} {cumulative}')
+        lines.append(f'jpegtopdf_latency_seconds_sum {self.latency_sum:.3f}')
+        lines.append(f'jpegtopdf_latency_seconds_count {self.latency_count}')
+        return '\n'.join(lines) + '\n'
+
+
+class ConversionServer:
+    """A class to convert images sent over HTTP without blocking the event loop
+
+    POST /convert takes either a multipart/form-data upload of JPEG files, in page order,
+    with options in the query string (e.g. /convert?quality=70), or a JSON object
+    {"images": [...], "dir": ..., options...} naming images below the root directory.
+    The pdf file is streamed back. Conversions run on a thread pool and compress their
+    images in one shared pool of worker processes. At most max_concurrent conversions
+    run at the same time and at most queue_depth requests wait for them, any other
+    request is answered with 429. GET /metrics returns the metrics in the Prometheus format.
+
+    Methods:
+    start(host, port) -- start listening and return the asyncio.Server object
+    close() -- stop the thread pool and the worker processes
+    """
+
+    def __init__(self, max_concurrent=2, queue_depth=8, workers=None, root=None,
+                 max_upload_bytes=256 * 1024 * 1024, cache=None, log_func=jpegtopdf.log):
+        """Initiate method for ConversionServer
+
+        Keyword arguments:
+        max_concurrent -- number of conversions running at the same time
+        queue_depth -- number of requests waiting for a conversion before 429 is returned
+        workers -- number of worker processes, None means one per CPU
+        root -- directory JSON requests can name images in, None to only accept uploads
+        max_upload_bytes -- size limit of a request body
+        cache -- imagecache.CompressionCache object, None to always compress
+        log_func -- log function
+        """
+        self.max_concurrent = max_concurrent
+        self.queue_depth = queue_depth
+        self.root = os.path.realpath(root) if root else None
+        self.max_upload_bytes = max_upload_bytes
+        self.cache = cache
+        self.log_func = log_func
+
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.job_executor = ThreadPoolExecutor(max_workers=max_concurrent)
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.metrics = Metrics()
+        self.waiting = 0
+        self.running = 0
+
+    async def start(self, host='127.0.0.1', port=8080):
+        """Start listening and return the asyncio.Server object, port 0 picks a free port"""
+        # Start the worker processes before accepting connections, a process forked
+        # while a request is answered keeps its socket open after the response
+        await asyncio.get_running_loop().run_in_executor(self.executor, int)
+        return await asyncio.start_server(self.handle, host, port)
+
+    def close(self):
+        """Stop the thread pool and the worker processes"""
+        self.job_executor.shutdown()
+        self.executor.shutdown()
+
+    async def handle(self, reader, writer):
+        """Answer one request and close the connection"""
+        start = time.perf_counter()
+        status, pages, route = 500, 0, None
+        try:
+            method, path, headers = await self.read_head(reader)
+            url = urllib.parse.urlsplit(path)
+            route = url.path
+            if route == '/metrics':
+                if method != 'GET':
+                    raise HTTPError(405, 'Use GET')
+                body = self.metrics.render(self.waiting, self.running).encode('utf-8')
+                await self.respond(writer, 200, body, 'text/plain; version=0.0.4')
+                return
+            if route != '/convert':
+                raise HTTPError(404, 'Not found')
+            if method != 'POST':
+                raise HTTPError(405, 'Use POST')
+
+            # Refuse before reading the body, so a saturated server doesn't buffer uploads
+            if self.waiting + self.running >= self.max_concurrent + self.queue_depth:
+                raise HTTPError(429, 'Too many requests')
+
+            self.waiting += 1
+            pages = await self.convert(reader, writer, headers, urllib.parse.parse_qsl(url.query))
+            status = 200
+        except HTTPError as e:
+            status = e.status
+            await self.respond(writer, e.status, f'{e}\n'.encode('utf-8'), 'text/plain',
+                               {'Retry-After': '1'} if e.status == 429 else None)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            status = 400
+        except Exception as e:
+            self.log_func(f'ERROR {type(e).__name__}: {e}')
+            await self.respond(writer, 500, f'{type(e).__name__}: {e}\n'.encode('utf-8'), 'text/plain')
+        finally:
+            if route == '/convert':
+                self.metrics.observe(status, time.perf_counter() - start, pages)
+            writer.close()
+
+    async def read_head(self, reader):
+        """Read the request line and headers and return (method, path, headers with lower case names)"""
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.LimitOverrunError:
+            raise HTTPError(400, 'Headers are too long')
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, path, _ = lines[0].split(' ', 2)
+        except ValueError:
+            raise HTTPError(400, 'Malformed request line')
+
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        return method, path, headers
+
+    async def respond(self, writer, status, body, content_type, extra_headers=None):
+        """Send a response with a body given as bytes"""
+        head = self.head(status, len(body), content_type, extra_headers)
+        try:
+            writer.write(head + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    def head(self, status, length, content_type, extra_headers=None):
+        """Return the status line and headers of a response as bytes"""
+        headers = {'Content-Type': content_type, 'Content-Length': str(length), 'Connection': 'close'}
+        headers.update(extra_headers or {})
+        lines = [f'HTTP/1.1 {status} {REASONS[status]}'] + [f'{name}: {value}' for name, value in headers.items()]
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    def read_job(self, content_type, body, query, work_dir):
+        """Return (directory of the images, their names, create_pdf() options) of a request.
+
+        Uploaded files are written to work_dir in the order they were sent.
+        """
+        if content_type.startswith('multipart/form-data'):
+            message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                f'Content-Type: {content_type}\r\n\r\n'.encode('latin-1') + body)
+            images = []
+            for part in message.iter_parts():
+                if part.get_filename() is None:
+                    continue
+                name = f'{len(images):05d}.jpg'
+                with open(os.path.join(work_dir, name), 'wb') as file:
+                    file.write(part.get_payload(decode=True))
+                images.append(name)
+            return work_dir, images, self.read_options(dict(query))
+
+        if content_type.startswith('application/json'):
+            if self.root is None:
+                raise HTTPError(400, 'This server only accepts uploads')
+            try:
+                job = json.loads(body)
+            except ValueError as e:
+                raise HTTPError(400, f'Invalid JSON: {e}')
+            if not isinstance(job, dict):
+                raise HTTPError(400, 'Send a JSON object')
+            if not isinstance(job.get('dir', ''), str):
+                raise HTTPError(400, 'dir must be a string')
+            images = job.pop('images', [])
+            if not isinstance(images, list) or not all(isinstance(image, str) for image in images):
+                raise HTTPError(400, 'images must be a list of strings')
+            im_dir = os.path.realpath(os.path.join(self.root, job.pop('dir', '')))
+            for image in images:
+                path = os.path.realpath(os.path.join(im_dir, image))
+                if os.path.commonpath([self.root, path]) != self.root:
+                    raise HTTPError(400, f'{image} is outside of the root directory')
+            return im_dir, images, self.read_options(job)
+
+        raise HTTPError(400, 'Send multipart/form-data or application/json')
+
+    def read_options(self, values):
+        """Return the create_pdf() options of a request, raise HTTPError for unknown or invalid ones"""
+        unknown = set(values) - set(REQUEST_OPTIONS)
+        if unknown:
+            raise HTTPError(400, f'Unknown options: {", ".join(sorted(unknown))}')
+        try:
+            return {key: REQUEST_OPTIONS[key](value) for key, value in values.items()}
+        except (AttributeError, TypeError, ValueError) as e:
+            raise HTTPError(400, f'Invalid option: {e}')
+
+    async def convert(self, reader, writer, headers, query):
+        """Read the body of an admitted request, convert its images, stream the pdf back and return its number of pages.
+
+        The request is counted in self.waiting by the caller until a conversion slot is free.
+        The body is parsed and uploads are written on a thread, so the event loop keeps
+        answering other requests meanwhile.
+        """
+        run_dir = journal.RunDirectory()
+        work_dir = run_dir.path
+        try:
+            try:
+                length = headers.get('content-length')
+                if length is None:
+                    raise HTTPError(411, 'Content-Length is required')
+                if not length.isdigit():
+                    raise HTTPError(400, f'Invalid Content-Length: {length}')
+                if int(length) > self.max_upload_bytes:
+                    raise HTTPError(413, f'Requests are limited to {self.max_upload_bytes} bytes')
+                body = await reader.readexactly(int(length))
+
+                loop = asyncio.get_running_loop()
+                im_dir, images, options = await loop.run_in_executor(
+                    None, self.read_job, headers.get('content-type', ''), body, query, work_dir)
+                if not images:
+                    raise HTTPError(400, 'No images')
+                await self.semaphore.acquire()
+            finally:
+                self.waiting -= 1
+
+            self.running += 1
+            try:
+                pdf_path = os.path.join(work_dir, 'output.pdf')
+                try:
+                    await loop.run_in_executor(
+                        self.job_executor,
+                        lambda: jpegtopdf.create_pdf(pdf_path, images, im_dir=im_dir, log_func=self.log_func,
+                                                     cache=self.cache, temp_dir=work_dir,
+                                                     executor=self.executor, **options))
+                except UnidentifiedImageError as e:
+                    # Name the image as the request did, not by its path on the server
+                    raise HTTPError(400, f'Not an image: {str(e).replace(im_dir + os.sep, "")}')
+                except FileNotFoundError as e:
+                    raise HTTPError(400, f'No such image: {os.path.basename(e.filename or "")}')
+            finally:
+                self.running -= 1
+                self.semaphore.release()
+
+            writer.write(self.head(200, os.path.getsize(pdf_path), 'application/pdf',
+                                   {'Content-Disposition': 'attachment; filename="output.pdf"'}))
+            with open(pdf_path, 'rb') as file:
+                for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                    writer.write(chunk)
+                    await writer.drain()
+            return len(images)
+        finally:
+            run_dir.release()
+
+
+async def serve(args):
+    """Run the server of parsed command line arguments until it is interrupted"""
+    jpegtopdf.verbose = args.verbose
+    journal.cleanup_orphans(jpegtopdf.log)
+    cache = None
+    if args.cache or args.cache_dir is not None:
+        cache = imagecache.CompressionCache(args.cache_dir, args.cache_mb * 1024 * 1024)
+
+    conversion_server = ConversionServer(args.concurrency, args.queue_depth, args.workers, args.root,
+                                         args.max_upload_mb * 1024 * 1024, cache)
+    server = await conversion_server.start(args.host, args.port)
+    print(f'LISTENING ON http://{args.host}:{server.sockets[0].getsockname()[1]}')
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        conversion_server.close()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', action='store', default='127.0.0.1')
+    parser.add_argument('--port', action='store', type=int, default=8080)
+    parser.add_argument('-w', '--workers', action='store', type=int, default=None)
+    parser.add_argument('-j', '--concurrency', action='store', type=int, default=2)
+    parser.add_argument('--queue-depth', action='store', type=int, default=8)
+    parser.add_argument('--root', action='store', default=None)
+    parser.add_argument('--max-upload-mb', action='store', type=int, default=256)
+    parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    parser.add_argument('-c', '--cache', action='store_true', default=False)
+    parser.add_argument('--cache-dir', action='store', default=None)
+    parser.add_argument('--cache-mb', action='store', type=int, default=512)
+
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
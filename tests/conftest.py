@@ -0,0 +1,57 @@
+import os
+import sys
+import struct
+import zlib
+import pytest
+
+# The modules are files in the root of the repository, not a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def segment(marker, data):
+    """Return a JPEG segment with its marker and length"""
+    return b'\xff' + bytes([marker]) + struct.pack('>H', len(data) + 2) + data
+
+
+def exif_segment(orientation):
+    """Return an APP1 segment with big-endian EXIF data holding only an orientation"""
+    tiff = b'MM\x00\x2a' + struct.pack('>I', 8) + struct.pack('>H', 1)
+    tiff += struct.pack('>HHI', 0x0112, 3, 1) + struct.pack('>H', orientation) + b'\x00\x00'
+    return segment(0xE1, b'Exif\x00\x00' + tiff + b'\x00\x00\x00\x00')
+
+
+def jpeg_header(width=20, height=10, components=3, orientation=None, progressive=False, before_frame=b''):
+    """Return the markers of a JPEG image up to its frame header, followed by EOI
+
+    The writers copy JPEG images as they are and only read their headers, so no scan data is needed.
+    """
+    data = b'\xff\xd8'
+    if orientation is not None:
+        data += exif_segment(orientation)
+    data += segment(0xDB, b'\x00' + bytes(range(1, 65)))
+    data += before_frame
+    sof = 0xC2 if progressive else 0xC0
+    data += segment(sof, struct.pack('>BHHB', 8, height, width, components) + b'\x01\x11\x00' * components)
+    return data + b'\xff\xd9'
+
+
+def png_image(width=16, height=8, value=0):
+    """Return a 1-bit grayscale PNG image filled with value"""
+    def chunk(chunk_type, data):
+        return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+    rows = b''.join(b'\x00' + bytes([value]) * ((width + 7) // 8) for _ in range(height))
+    return (PNG_SIGNATURE + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 1, 0, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+@pytest.fixture
+def jpeg_file(tmp_path):
+    """Return a function that writes a JPEG header to tmp_path and returns its path"""
+    def write(name='image.jpg', **kwargs):
+        path = tmp_path / name
+        path.write_bytes(jpeg_header(**kwargs))
+        return str(path)
+    return write
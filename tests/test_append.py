@@ -0,0 +1,121 @@
+import pytest
+
+pytest.importorskip('fpdf')
+
+import pdfparse  # noqa: E402
+import pdfwriter  # noqa: E402
+from conftest import jpeg_header  # noqa: E402
+
+
+def build_pdf(path, objects, root):
+    """Write a pdf file with the given object bodies, numbered from 1, and a cross-reference table"""
+    data = b'%PDF-1.4\n'
+    offsets = []
+    for object_id, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += f'{object_id} 0 obj\n{body}\nendobj\n'.encode('latin-1')
+    xref = len(data)
+    data += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode('latin-1')
+    data += b''.join(f'{offset:010d} 00000 n \n'.encode('latin-1') for offset in offsets)
+    data += f'trailer\n<</Size {len(objects) + 1} /Root {root} 0 R>>\nstartxref\n{xref}\n%%EOF\n'.encode('latin-1')
+    path.write_bytes(data)
+
+
+def append(path, sources, scale=1):
+    writer = pdfwriter.IncrementalPDFWriter(str(path), scale=scale)
+    for source in sources:
+        writer.add_page(source)
+    writer.close()
+
+
+def page_widths(path):
+    with pdfparse.PDFReader(str(path)) as reader:
+        _, tree = reader.page_tree()
+        kids = reader.resolve(tree['Kids'])
+        assert reader.resolve(tree['Count']) == len(kids)
+        widths = []
+        for kid in kids:
+            xobjects = reader.resolve(reader.resolve(reader.resolve(kid)['Resources'])['XObject'])
+            widths.append(sorted(reader.object(reference.id)['Width'] for reference in xobjects.values()))
+        return widths
+
+
+@pytest.mark.parametrize('kind', ('stream', 'compact', 'linear'))
+def test_append_adds_pages_after_the_existing_ones(kind, tmp_path):
+    pdf = tmp_path / 'out.pdf'
+    writer = pdfwriter.open_writer(kind, str(pdf), 300, 400)
+    writer.add_page(jpeg_header(width=20))
+    writer.close()
+    data = pdf.read_bytes()
+
+    append(pdf, [jpeg_header(width=30), jpeg_header(width=40)])
+    append(pdf, [jpeg_header(width=50)])
+
+    assert page_widths(pdf) == [[20], [30], [40], [50]]
+    # The existing file isn't rewritten
+    assert pdf.read_bytes()[:len(data)] == data
+    with pdfparse.PDFReader(str(pdf)) as reader:
+        assert [round(value) for value in reader.page_size()] == [300, 400]
+        # An updated file isn't linearized anymore
+        assert reader.linearization() is None
+
+
+def test_append_adds_pages_to_the_pages_fpdf_wrote(tmp_path):
+    pdf = tmp_path / 'out.pdf'
+    writer = pdfwriter.open_writer('fpdf', str(pdf), 300, 400)
+    writer.add_page(jpeg_header(width=20))
+    writer.close()
+
+    append(pdf, [jpeg_header(width=30)])
+    assert page_widths(pdf) == [[20], [30]]
+
+
+def test_append_resolves_indirect_kids_count_and_media_box(tmp_path):
+    pdf = tmp_path / 'indirect.pdf'
+    build_pdf(pdf, [
+        '<</Type /Catalog /Pages 2 0 R>>',
+        '<</Type /Pages /Kids 3 0 R /Count 4 0 R /MediaBox 5 0 R>>',
+        '[6 0 R]',
+        '1',
+        '[0 0 7 0 R 500]',
+        '<</Type /Page /Parent 2 0 R /Resources <<>>>>',
+        '200',
+    ], root=1)
+
+    append(pdf, [jpeg_header(width=30)])
+
+    with pdfparse.PDFReader(str(pdf)) as reader:
+        assert reader.page_size() == (200, 500)
+        _, tree = reader.page_tree()
+        assert tree['Count'] == 2
+        assert [kid.id for kid in tree['Kids']][0] == 6
+        page = reader.resolve(tree['Kids'][1])
+        assert page['MediaBox'] == [0, 0, 200, 500]
+
+
+def test_abort_cuts_the_file_back(tmp_path):
+    pdf = tmp_path / 'out.pdf'
+    writer = pdfwriter.open_writer('stream', str(pdf), 300, 400)
+    writer.add_page(jpeg_header())
+    writer.close()
+    data = pdf.read_bytes()
+
+    writer = pdfwriter.IncrementalPDFWriter(str(pdf))
+    writer.add_page(jpeg_header())
+    writer.abort()
+    assert pdf.read_bytes() == data
+
+
+def test_create_pdf_creates_a_missing_file_to_append_to(tmp_path):
+    image = pytest.importorskip('PIL.Image')
+    import jpegtopdf
+
+    image.new('RGB', (40, 30), 'red').save(tmp_path / 'first.jpg')
+    image.new('RGB', (50, 30), 'blue').save(tmp_path / 'second.jpg')
+    pdf = str(tmp_path / 'out.pdf')
+
+    for name in ('first.jpg', 'second.jpg'):
+        jpegtopdf.create_pdf(pdf, [name], im_dir=str(tmp_path), log_func=lambda message: None,
+                             temp_dir=str(tmp_path), append=True)
+
+    assert page_widths(pdf) == [[40], [50]]
@@ -0,0 +1,91 @@
+import io
+import os
+import pytest
+import jpegmeta
+from conftest import jpeg_header, exif_segment, segment
+
+XMP = segment(0xE1, b'http://ns.adobe.com/xap/1.0/\x00<x:xmpmeta/>')
+# The reader stops after the precision, height, width and component count of the frame header
+FRAME_END = jpeg_header().index(b'\xff\xc0') + 10
+
+
+def read(data):
+    return jpegmeta.read_info(io.BytesIO(data))
+
+
+def test_read_info_reads_the_frame_header():
+    info = read(jpeg_header(width=640, height=480, components=1, progressive=True))
+    assert (info.width, info.height, info.components, info.bits, info.progressive) == (640, 480, 1, 8, True)
+    assert info.orientation == 1
+    assert info.luminance_table == tuple(range(1, 65))
+
+
+def test_read_info_restores_the_position():
+    fp = io.BytesIO(jpeg_header())
+    jpegmeta.read_info(fp)
+    assert fp.tell() == 0
+
+
+def test_read_info_skips_fill_bytes_before_markers():
+    data = jpeg_header(before_frame=b'\xff\xff\xff')
+    assert read(data).width == 20
+
+
+@pytest.mark.parametrize('before, after, orientation', [
+    (exif_segment(6), b'', 6),
+    (exif_segment(6), XMP, 6),
+    (XMP, exif_segment(8), 8),
+    (XMP, b'', 1),
+    (exif_segment(3), exif_segment(6), 3),
+])
+def test_read_info_takes_the_orientation_of_the_first_exif_segment(before, after, orientation):
+    data = b'\xff\xd8' + before + after + jpeg_header()[2:]
+    assert read(data).orientation == orientation
+
+
+def test_read_info_rejects_other_files():
+    with pytest.raises(ValueError):
+        read(b'\x89PNG\r\n\x1a\n')
+
+
+@pytest.mark.parametrize('data', [
+    jpeg_header()[:size] for size in range(2, FRAME_END)
+] + [
+    b'\xff\xd8\xff\xff\xff',
+    b'\xff\xd8' + segment(0xDB, b'\x00' + bytes(64))[:-10],
+    b'\xff\xd8\xff\xe0\x00\x01',
+])
+def test_read_info_rejects_truncated_and_corrupt_headers(data):
+    with pytest.raises(ValueError):
+        read(data)
+
+
+def test_index_reads_a_file_again_when_it_changes(jpeg_file):
+    index = jpegmeta.MetadataIndex()
+    path = jpeg_file(width=20)
+    assert index.get(path).width == 20
+
+    with open(path, 'wb') as file:
+        file.write(jpeg_header(width=300))
+    os.utime(path, ns=(0, 0))
+    assert index.get(path).width == 300
+
+
+def test_index_remembers_files_that_are_not_jpeg_files(tmp_path, jpeg_file):
+    index = jpegmeta.MetadataIndex()
+    text = tmp_path / 'notes.txt'
+    text.write_bytes(b'not an image')
+    truncated = tmp_path / 'truncated.jpg'
+    truncated.write_bytes(b'\xff\xd8\xff\xff')
+    assert index.get(str(text)) is None
+    assert index.get(str(truncated)) is None
+
+
+def test_index_evicts_the_least_recently_used_files(jpeg_file):
+    index = jpegmeta.MetadataIndex(max_entries=2)
+    first, second, third = (jpeg_file(f'{i}.jpg') for i in range(3))
+    index.get(first)
+    index.get(second)
+    index.get(first)
+    index.get(third)
+    assert list(index.entries) == [os.path.abspath(first), os.path.abspath(third)]
@@ -0,0 +1,34 @@
+import pytest
+
+pytest.importorskip('fpdf')
+Image = pytest.importorskip('PIL.Image')
+
+import jpegtopdf  # noqa: E402
+import pdfparse  # noqa: E402
+
+
+def convert(tmp_path, size, **kwargs):
+    Image.new('RGB', size, 'white').save(tmp_path / 'page.jpg')
+    pdf = str(tmp_path / 'out.pdf')
+    jpegtopdf.create_pdf(pdf, ['page.jpg'], im_dir=str(tmp_path), log_func=lambda message: None,
+                         temp_dir=str(tmp_path), **kwargs)
+    with pdfparse.PDFReader(pdf) as reader:
+        return reader.page_size()
+
+
+@pytest.mark.parametrize('writer', ('fpdf', 'stream', 'compact', 'linear'))
+@pytest.mark.parametrize('dpi', (50, 100))
+def test_dpi_gives_pages_of_the_page_size(tmp_path, writer, dpi):
+    # An A4 page scanned at 200 dpi is downsampled to dpi and printed on an A4 page
+    width, height = convert(tmp_path, (1654, 2338), dpi=dpi, writer=writer)
+    assert width == pytest.approx(8.27 * 72, abs=1)
+    assert height == pytest.approx(11.69 * 72, abs=1)
+
+
+def test_pages_take_a_point_a_pixel_without_dpi(tmp_path):
+    assert convert(tmp_path, (300, 200)) == pytest.approx((300, 200))
+
+
+def test_small_images_are_not_enlarged_for_dpi(tmp_path):
+    width, height = convert(tmp_path, (100, 50), dpi=100)
+    assert (width, height) == pytest.approx((72, 36))
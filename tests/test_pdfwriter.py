@@ -0,0 +1,96 @@
+import json
+import pytest
+
+pytest.importorskip('fpdf')
+
+import pdfparse  # noqa: E402
+import pdfwriter  # noqa: E402
+from conftest import jpeg_header, png_image  # noqa: E402
+
+WRITERS = ('fpdf', 'stream', 'compact', 'linear')
+
+
+def write(kind, path, sources, width=300, height=400, **kwargs):
+    writer = pdfwriter.open_writer(kind, str(path), width, height, **kwargs)
+    for source in sources:
+        writer.add_page(source)
+    writer.close()
+
+
+def pages(reader):
+    """Return the page dictionaries of a pdf file with a flat page tree"""
+    _, tree = reader.page_tree()
+    return [reader.resolve(kid) for kid in reader.resolve(tree['Kids'])]
+
+
+def images(reader, page):
+    xobjects = reader.resolve(reader.resolve(page['Resources'])['XObject'])
+    return [reader.object(reference.id) for reference in xobjects.values()]
+
+
+@pytest.mark.parametrize('kind', WRITERS)
+def test_writers_write_files_the_reader_reads(kind, tmp_path):
+    pdf = tmp_path / 'out.pdf'
+    write(kind, pdf, [jpeg_header(width=20, height=10), png_image(16, 8), jpeg_header(width=30, height=40)])
+
+    with pdfparse.PDFReader(str(pdf)) as reader:
+        _, tree = reader.page_tree()
+        assert reader.resolve(tree['Count']) == 3
+        assert [round(value) for value in reader.page_size()] == [300, 400]
+        # FPDF puts every image in the resources of every page
+        widths = {image['Width'] for page in pages(reader) for image in images(reader, page)}
+        assert widths == {20, 16, 30}
+        assert (reader.linearization() is not None) == (kind == 'linear')
+
+
+@pytest.mark.parametrize('kind', WRITERS[1:])
+def test_pages_with_the_same_key_share_their_image(kind, tmp_path):
+    pdf = tmp_path / 'out.pdf'
+    writer = pdfwriter.open_writer(kind, str(pdf), 300, 400)
+    for _ in range(3):
+        writer.add_page(jpeg_header(), key='same')
+    writer.close()
+
+    with pdfparse.PDFReader(str(pdf)) as reader:
+        references = {tuple(reader.resolve(reader.resolve(page['Resources'])['XObject']).values())
+                      for page in pages(reader)}
+        assert len(references) == 1
+
+
+@pytest.mark.parametrize('kind', pdfwriter.RESUMABLE_WRITERS)
+def test_writers_continue_from_their_checkpoints(kind, tmp_path):
+    pdf = tmp_path / 'out.pdf'
+    writer = pdfwriter.open_writer(kind, str(pdf), 300, 400)
+    writer.add_page(jpeg_header(width=20))
+    states = [writer.checkpoint()]
+    writer.add_page(jpeg_header(width=30))
+    states.append(writer.checkpoint())
+    # Pages after the last checkpoint are lost when the program stops
+    writer.add_page(jpeg_header(width=99))
+    writer.abort()
+
+    # The states are kept in a json journal
+    states = json.loads(json.dumps(states))
+    writer = pdfwriter.open_writer(kind, str(pdf), 300, 400, states=states)
+    writer.add_page(jpeg_header(width=40))
+    writer.close()
+
+    with pdfparse.PDFReader(str(pdf)) as reader:
+        widths = [image['Width'] for page in pages(reader) for image in images(reader, page)]
+        assert widths == [20, 30, 40]
+
+
+@pytest.mark.parametrize('kind', WRITERS[1:])
+def test_scale_sets_the_size_images_are_drawn_at(kind, tmp_path):
+    pdf = tmp_path / 'out.pdf'
+    write(kind, pdf, [jpeg_header(width=200, height=100)], scale=0.5)
+
+    with pdfparse.PDFReader(str(pdf)) as reader:
+        contents = pages(reader)[0]['Contents']
+        _, data = reader._read_stream(reader.offsets[contents.id])
+        assert b'100.00 0 0 50.00 ' in data
+
+
+def test_open_writer_rejects_unknown_writers(tmp_path):
+    with pytest.raises(ValueError):
+        pdfwriter.open_writer('pdfkit', str(tmp_path / 'out.pdf'), 300, 400)
@@ -0,0 +1,138 @@
+import io
+import json
+import asyncio
+import pytest
+
+pytest.importorskip('fpdf')
+Image = pytest.importorskip('PIL.Image')
+
+import server  # noqa: E402
+
+BOUNDARY = 'jpegtopdf-test'
+
+
+def post(path, body, content_type='application/json', length=None):
+    """Return a POST request as bytes, Content-Length is left out if length is False"""
+    head = [f'POST {path} HTTP/1.1', 'Host: localhost', f'Content-Type: {content_type}']
+    if length is not False:
+        head.append(f'Content-Length: {len(body) if length is None else length}')
+    return ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body
+
+
+def upload(*files):
+    """Return a multipart/form-data request uploading the given files"""
+    body = b''
+    for i, data in enumerate(files):
+        body += (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="image"; filename="{i}.jpg"\r\n'
+                 f'Content-Type: image/jpeg\r\n\r\n').encode('latin-1') + data + b'\r\n'
+    body += f'--{BOUNDARY}--\r\n'.encode('latin-1')
+    return post('/convert', body, f'multipart/form-data; boundary={BOUNDARY}')
+
+
+def jpeg(size=(40, 30)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'red').save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def send(conversion_server, request):
+    """Send a request to conversion_server and return (status, headers, body) of its response"""
+    async def run():
+        listener = await conversion_server.start(port=0)
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', listener.sockets[0].getsockname()[1])
+            writer.write(request)
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+        finally:
+            listener.close()
+        return response
+
+    head, _, body = asyncio.run(run()).partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    headers = dict(line.split(': ', 1) for line in lines[1:])
+    return int(lines[0].split()[1]), headers, body
+
+
+@pytest.fixture
+def conversion_server(tmp_path):
+    (tmp_path / 'page.jpg').write_bytes(jpeg())
+    (tmp_path / 'notes.jpg').write_bytes(b'not an image')
+    conversion_server = server.ConversionServer(max_concurrent=1, queue_depth=0, workers=1, root=str(tmp_path),
+                                                log_func=lambda message: None)
+    yield conversion_server
+    conversion_server.close()
+
+
+def test_uploads_are_converted(conversion_server):
+    status, headers, body = send(conversion_server, upload(jpeg(), jpeg((30, 40))))
+    assert status == 200
+    assert headers['Content-Type'] == 'application/pdf'
+    assert body.startswith(b'%PDF')
+    assert int(headers['Content-Length']) == len(body)
+
+
+def test_images_are_converted_by_name(conversion_server):
+    status, _, body = send(conversion_server, post('/convert', json.dumps({'images': ['page.jpg'],
+                                                                           'writer': 'compact'}).encode()))
+    assert status == 200
+    assert body.startswith(b'%PDF-1.5')
+
+
+@pytest.mark.parametrize('job', [
+    b'{"images": ',
+    b'["page.jpg"]',
+    b'{"images": "page.jpg"}',
+    b'{"images": [1, 2]}',
+    b'{"images": ["page.jpg"], "dir": 1}',
+    b'{"images": []}',
+    b'{"images": ["../page.jpg"]}',
+    b'{"images": ["page.jpg"], "writer": "pdfkit"}',
+    b'{"images": ["page.jpg"], "page_size": "B5"}',
+    b'{"images": ["page.jpg"], "quality": "high"}',
+    b'{"images": ["page.jpg"], "colour": true}',
+    b'{"images": ["notes.jpg"]}',
+    b'{"images": ["missing.jpg"]}',
+])
+def test_invalid_jobs_are_bad_requests(conversion_server, job):
+    status, _, body = send(conversion_server, post('/convert', job))
+    assert status == 400
+    assert conversion_server.root.encode() not in body
+
+
+def test_uploads_that_are_not_images_are_bad_requests(conversion_server):
+    assert send(conversion_server, upload(b'not an image'))[0] == 400
+
+
+@pytest.mark.parametrize('request_bytes, status', [
+    (post('/convert', b'{}', length=False), 411),
+    (post('/convert', b'{}', length='-1'), 400),
+    (post('/convert', b'{}', length='2x'), 400),
+    (post('/convert', b'{}', 'text/plain'), 400),
+    (post('/convert?quality=50', b'{}', length=10 ** 12), 413),
+    (post('/pdf', b'{}'), 404),
+    (b'GET /convert HTTP/1.1\r\n\r\n', 405),
+    (post('/metrics', b''), 405),
+    (b'nonsense\r\n\r\n', 400),
+])
+def test_invalid_requests_get_error_statuses(conversion_server, request_bytes, status):
+    assert send(conversion_server, request_bytes)[0] == status
+
+
+def test_requests_are_refused_when_the_queue_is_full(conversion_server):
+    conversion_server.running = 1
+    status, headers, _ = send(conversion_server, upload(jpeg()))
+    assert status == 429
+    assert headers['Retry-After'] == '1'
+
+
+def test_metrics_count_the_requests(conversion_server):
+    send(conversion_server, upload(jpeg()))
+    send(conversion_server, post('/convert', b'[]'))
+    status, _, body = send(conversion_server, b'GET /metrics HTTP/1.1\r\n\r\n')
+    assert status == 200
+    lines = body.decode().splitlines()
+    assert 'jpegtopdf_pages_total 1' in lines
+    assert 'jpegtopdf_requests_total{status="200"} 1' in lines
+    assert 'jpegtopdf_requests_total{status="400"} 1' in lines
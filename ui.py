@@ -1,415 +1,980 @@
-import os
-import sys
-import datetime
-import platform
-import jpegtopdf
-from PyQt5 import QtWidgets, QtGui, QtCore
-
-
-class LabelWidgetCouple(QtWidgets.QHBoxLayout):
-    """A class to create a label and a widget next to it
-
-    Since it inherits QtWidgets.QHBoxLayout, passing a LabelWidgetCouple object to e.g. QtWidgets.QGridLayout().addLayout() would work.
-    """
-
-    def __init__(self, label_text, widget):
-        """Initiate method for LabelWidgetCouple
-
-        Positional arguments:
-        label_text -- text of the label
-        widget -- QtWidgets.QWidget object next to the label
-        """
-
-        super().__init__()
-
-        self.label = QtWidgets.QLabel(label_text)
-        self.addWidget(self.label)
-
-        self.widget = widget
-        self.addWidget(self.widget)
-
-
-class Theme:
-    """A class for holding three colors
-
-    Three colors are: bg_color, mid_color and fg_color.
-    Mostly, only bg_color and fg_color is used but mid_color was also added
-    to create more depth with some widgets.
-
-    Methods:
-
-    @staticmethod
-    load_from_json(fp) -- load a json file, convert it to a Theme object and return it
-
-    """
-
-    def __init__(self, source_file, fg_color="#BBBBBB", mid_color="#252525", bg_color="#151515"):
-        """Initiate method for Theme
-
-        Positional arguments:
-        source_file -- source file path of the theme
-
-        Keyword arguments:
-        fg_color -- foreground color
-        mid_color -- a color between bg_color and fg_color
-        bg_color -- background color
-
-        """
-        self.fg_color = fg_color
-        self.mid_color = mid_color
-        self.bg_color = bg_color
-        self.source_file = source_file
-
-    @staticmethod
-    def load_from_json(fp):
-        """Load a json file, convert it to a Theme object and return it
-
-        If no file named fp was found then source_file is set to None 
-        and the program uses the hard coded colors.
-        """
-        import json
-        t = Theme(fp)
-        try:
-            with open(fp, 'r') as file:
-                t_dict = json.load(file)
-                t.bg_color = t_dict['bg_color']
-                t.mid_color = t_dict['mid_color']
-                t.fg_color = t_dict['fg_color']
-        except FileNotFoundError:
-            t.fg_color = "#BBBBBB"
-            t.mid_color = "#252525"
-            t.bg_color = "#151515"
-            t.source_file = None
-        return t
-
-
-class Window(QtWidgets.QMainWindow):
-    """Main window class
-
-    This class is the main window of the application.
-
-    Methods:
-    initiate_ui() -- initiate every permament UI component
-    make_set_image_func(order_index) -- return another function to be called 
-                                        when a combobox is changed
-    open_file_names_dialog() -- open a dialog to choose one or more files 
-                                of type .jpg or .jpeg  and return the paths
-    log(msg) -- log a message to the log console
-    get_quality_input() -- get current quality in the QTextEdit
-    create_pdf() -- open a dialog to save file and calls jpegtopdf.create_pdf()
-    closeEvent(*args, **kwargs) -- overridden function from 
-                                   QtWidgets.QMainWindow, do temp cleanup
-
-    """
-
-    def __init__(self, title, theme):
-        """Initiate method for Window.
-
-        Positional arguments:
-        title -- window title
-        theme -- theme of the window
-
-        """
-        super().__init__()
-        self.theme = theme
-        self.action_index = 0
-        self.setGeometry(0, 0, 850, 500)
-
-        self.setMinimumWidth(650)
-        self.setMinimumHeight(400)
-
-        self.temp_files = set()
-        self.list_images = []
-        self.list_pixmaps = []
-
-        self.current_pixmap_width = 100
-
-        self.setWindowTitle(title)
-        self.setStyleSheet(
-            f'background:{theme.bg_color}; color:{theme.fg_color}')
-        self.initiate_ui()
-        self.show()
-        self.log('PROGRAM STARTED SUCCESSFULLY')
-
-    def initiate_ui(self):
-        """Initiate every permament UI component.
-
-        Most UI initiation is done here but some widgets 
-        like local gbox, vbox and cb are initiated in 
-        open_files_name_dialog()
-
-        """
-        # Main Layout
-        self.layout = QtWidgets.QGridLayout()
-
-        # Top bar
-        self.top_bar = QtWidgets.QFrame()
-        self.top_bar.setStyleSheet(f'background:{self.theme.mid_color}')
-        self.top_bar.setFixedHeight(75)
-        self.layout.addWidget(self.top_bar, 0, 0)
-
-        self.top_bar_layout = QtWidgets.QGridLayout(self.top_bar)
-        self.top_bar_layout.setColumnStretch(2, 4)
-
-        # Title
-        title_font = QtGui.QFont()
-        title_font.setBold(True)
-        title_font.setPointSize(25)
-        self.title_label = QtWidgets.QLabel('JPEG-to-PDF')
-        self.title_label.setFont(title_font)
-
-        # By-line
-        by_font = QtGui.QFont()
-        by_font.setBold(True)
-        by_font.setPointSize(12)
-        self.by_label = QtWidgets.QLabel('by Arda Özcan')
-        self.by_label.setFont(by_font)
-
-        self.top_bar_layout.addWidget(self.title_label, 0, 3)
-        self.top_bar_layout.addWidget(self.by_label, 1, 3)
-
-        # Open files button
-        self.open_files_button = QtWidgets.QPushButton('Open Files...')
-        self.open_files_button.pressed.connect(self.open_file_names_dialog)
-        self.top_bar_layout.addWidget(self.open_files_button, 0, 0)
-
-        # Save button
-        self.save_button = QtWidgets.QPushButton('Save')
-        self.save_button.pressed.connect(self.create_pdf)
-        self.top_bar_layout.addWidget(self.save_button, 1, 0)
-
-        # Quality input
-        self.quality_input = LabelWidgetCouple(
-            'JPEG Quality: ', QtWidgets.QLineEdit('85'))
-        self.quality_input.widget.setValidator(QtGui.QIntValidator())
-        self.top_bar_layout.addLayout(self.quality_input, 0, 1)
-
-        # Pixmap width
-        self.pixmap_width_slider = QtWidgets.QSlider()
-        self.pixmap_width_slider.setOrientation(QtCore.Qt.Horizontal)
-        self.pixmap_width_slider.setFixedWidth(self.get_scroll_width())
-        self.pixmap_width_slider.setMaximum(250)
-        self.pixmap_width_slider.setMinimum(150)
-        # Start in the middle
-        self.pixmap_width_slider.setValue(self.pixmap_width_slider.minimum()
-                                          + ((self.pixmap_width_slider.maximum() - self.pixmap_width_slider.minimum()) * 0.5))
-        self.pixmap_width_slider.valueChanged.connect(
-            self.on_pixmap_width_changed)
-
-        # Bottom bar
-        self.bottom_bar = QtWidgets.QFrame()
-        self.bottom_bar.setStyleSheet(f'background:{self.theme.bg_color}')
-        self.layout.addWidget(self.bottom_bar, 1, 0)
-
-        self.bottom_bar_layout = QtWidgets.QGridLayout(self.bottom_bar)
-        self.bottom_bar_right_layout = QtWidgets.QGridLayout()
-
-        # Layout for combo boxes that will be created
-        self.combo_box_layout = QtWidgets.QVBoxLayout()
-
-        # Log console
-        self.log_console = QtWidgets.QTextEdit()
-        self.log_console.setStyleSheet(f'background:{self.theme.mid_color}')
-        self.log_console.setFocusPolicy(QtCore.Qt.NoFocus)
-
-        self.bottom_bar_right_layout.addWidget(self.log_console, 1, 0)
-        self.bottom_bar_right_layout.addLayout(self.combo_box_layout, 0, 0)
-
-        self.bottom_bar_layout.addLayout(self.bottom_bar_right_layout, 0, 1)
-
-        # Scroll area
-        self.scroll = QtWidgets.QScrollArea()
-        self.scroll.setWidgetResizable(True)
-        self.scroll.setFixedWidth(self.get_scroll_width())
-        self.bottom_bar_layout.addWidget(self.scroll, 0, 0)
-        self.bottom_bar_layout.addWidget(self.pixmap_width_slider, 1, 0)
-
-        self.w = QtWidgets.QWidget()
-        self.setCentralWidget(self.w)
-        self.w.setLayout(self.layout)
-
-    def make_set_image_func(self, order_index):
-        """Create a set_image(image_index) function specific for every order_index.
-
-        QtWidgets.QComboBox.currentIndexChanged calls its connected function 
-        and passes in the new index when the selection changes. For every combobox 
-        at index of order_index, a set_image(image_index) function is created and connected to
-        currentIndexChanged signal so when a selection changes, image order and pixmap of the label
-        in order_index changes to the image at the image_index.
-
-        Positional argumenst:
-        order_index -- index of combobox and label
-
-        For further information on function returning check:
-        https://stackoverflow.com/questions/12738031/creating-a-new-function-as-return-in-python-function/12738091
-        https://en.wikipedia.org/wiki/First-class_function
-
-        """
-        def set_image(image_index):
-            """Set image of label at the order_index to image at image_index"""
-            # Change order of images
-            self.image_order[order_index] = image_index
-
-            # Create new QPixmap with path of image at index of image_index
-            new_p = QtGui.QPixmap(os.path.join(
-                self.image_dir, self.list_images[image_index]))
-            new_p = new_p.scaledToWidth(self.current_pixmap_width)
-
-            # Set pixmap of label at index of order_index
-            self.label_list[order_index].setPixmap(new_p)
-
-        return set_image
-
-    def on_pixmap_width_changed(self, v):
-        """Change related widgets according to pixmap width slider
-        
-        This is called when self.pixmap_width_slider 's value changes.
-        
-        Positional arguments:
-        v -- new value
-        """
-        for i in range(len(self.list_images)):
-            self.label_list[i].setPixmap(
-                self.list_pixmaps[self.image_order[i]].scaledToWidth(v))
-        self.scroll.setFixedWidth(self.get_scroll_width())
-        self.pixmap_width_slider.setFixedWidth(self.get_scroll_width())
-        self.current_pixmap_width = v
-
-    def open_file_names_dialog(self):
-        """Open a 'Open files' dialog and update everything accordingly
-
-        This method opens a dialog to get input files. 
-        If the return value is None, this method returns as well.
-        If the operation was successful, this method continues to 
-        update every widget and variable accordingly. 
-        """
-        files, _ = QtWidgets.QFileDialog.getOpenFileNames(
-            self, "Choose files", "", "JPEG Files (*.jpg; *.jpeg)")
-
-        if not files:
-            return
-
-        # Empty lists for a new process
-        self.list_images = []
-        self.label_list = []
-        self.list_pixmaps = []
-
-        # Update self.image_dir
-        self.image_dir = os.path.split(files[0])[0]
-
-        # These variables are for UI layout
-        gbox = QtWidgets.QGroupBox()
-        vbox = QtWidgets.QVBoxLayout()
-        for i, f in enumerate(files):
-            # Add image name to self.list_images
-            self.list_images.append(os.path.split(f)[1])
-            compressed_name = jpegtopdf.compressed_image_name(
-                self.list_images[i], self.get_quality_input())
-
-            # Compress image
-            jpegtopdf.compress(
-                self.image_dir, self.list_images[i], self.log,
-                self.get_quality_input())
-
-            # Add compressed image to self.temp_files
-            self.temp_files.add(compressed_name)
-
-            p = QtGui.QPixmap(compressed_name)
-            self.list_pixmaps.append(p)
-            p = p.scaledToWidth(self.current_pixmap_width)
-
-            l = QtWidgets.QLabel()
-            l.setPixmap(p)
-            self.label_list.append(l)
-            vbox.addWidget(l)
-
-        # List to hold image indexes of labels
-        self.image_order = [i for i in range(len(self.list_images))]
-
-        # Loop to clear previous comboboxes
-        for i in reversed(range(self.combo_box_layout.count())):
-            self.combo_box_layout.itemAt(i).widget().setParent(None)
-
-        # Loop to create new comboboxes
-        for i in range(len(self.list_images)):
-            cb = QtWidgets.QComboBox()
-            cb.addItems(self.list_images)
-            cb.setCurrentIndex(i)
-
-            set_order_func = self.make_set_image_func(i)
-            cb.currentIndexChanged.connect(set_order_func)
-            self.combo_box_layout.addWidget(cb)
-
-        gbox.setLayout(vbox)
-        self.scroll.setWidget(gbox)
-
-    def log(self, msg):
-        """Log a message to the log console using format [{self.action_index}][{date}]: {msg}.
-
-        Positional arguments:
-        msg -- message to be logged
-        """
-        date = str(datetime.datetime.now()).split('.')[0]
-        prompt = f'[{"{:05d}".format(self.action_index)}][{date}]: '
-        # Used HTML tags to create both bold and regular text in one line
-        self.log_console.append(f'<b>{prompt}</b> <h>{msg}</h>')
-        self.action_index += 1
-
-    def get_quality_input(self):
-        """Get the current input from the QTextEdit"""
-        try:
-            quality = int(self.quality_input.widget.text())
-        except ValueError:
-            quality = 85
-
-        return quality
-
-    def get_scroll_width(self):
-        return self.current_pixmap_width + 46
-
-    def create_pdf(self):
-        """Call the jpegtopdf.create_pdf function using the correct inputs.
-
-        Temp files that are returned from the jpegtopdf.create_pdf 
-        function are unioned with self.temp_files to be used in temp_cleanup.
-        If the user is using Windows, a dialog appears and 
-        asks if the user wants to see the exported file in the explorer. 
-        If the user says yes, it is shown.
-        """
-        pdf_file_name, _ = QtWidgets.QFileDialog.getSaveFileName(
-            self, "Save file", "", "PDF File (*.pdf)")
-
-        if not pdf_file_name:
-            return
-
-        if not pdf_file_name.endswith('.pdf'):
-            pdf_file_name += '.pdf'
-
-        additional_temps = jpegtopdf.create_pdf(pdf_file_name, [self.list_images[i] for i in self.image_order],
-                                                quality=self.get_quality_input(), im_dir=self.image_dir, log_func=self.log)
-
-        self.temp_files = self.temp_files.union(additional_temps)
-
-        if platform.system() == "Windows":
-            buttons = QtWidgets.QMessageBox.No | QtWidgets.QMessageBox.Yes
-            msg = QtWidgets.QMessageBox.question(
-                self, 'JPEG-to-PDF', 'Do you want to see the exported file in the explorer?', buttons,
-                QtWidgets.QMessageBox.No)
-
-            if msg == QtWidgets.QMessageBox.Yes:
-                jpegtopdf.show_file_in_explorer(pdf_file_name)
-
-    def closeEvent(self, *args, **kwargs):
-        """Clean temp files up in close event.
-        Note: If the application is forcibly closed, this cleanup can't be done.
-        """
-        jpegtopdf.temp_cleanup(self.temp_files, self.log)
-        super(QtWidgets.QMainWindow, self).closeEvent(*args, **kwargs)
-
-
-if __name__ == '__main__':
-
-    app = QtWidgets.QApplication(sys.argv)
-    app.setStyle('Fusion')
-    w = Window('JPEG-to-PDF', Theme.load_from_json('theme.json'))
-    sys.exit(app.exec_())
+import os
+import sys
+import time
+import datetime
+import platform
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import journal
+import jpegtopdf
+import imagecache
+import instrument
+from PyQt5 import QtWidgets, QtGui, QtCore
+
+
+class LabelWidgetCouple(QtWidgets.QHBoxLayout):
+    """A class to create a label and a widget next to it
+
+    Since it inherits QtWidgets.QHBoxLayout, passing a LabelWidgetCouple object to e.g. QtWidgets.QGridLayout().addLayout() would work.
+    """
+
+    def __init__(self, label_text, widget):
+        """Initiate method for LabelWidgetCouple
+
+        Positional arguments:
+        label_text -- text of the label
+        widget -- QtWidgets.QWidget object next to the label
+        """
+
+        super().__init__()
+
+        self.label = QtWidgets.QLabel(label_text)
+        self.addWidget(self.label)
+
+        self.widget = widget
+        self.addWidget(self.widget)
+
+
+class Theme:
+    """A class for holding three colors
+
+    Three colors are: bg_color, mid_color and fg_color.
+    Mostly, only bg_color and fg_color is used but mid_color was also added
+    to create more depth with some widgets.
+
+    Methods:
+
+    @staticmethod
+    load_from_json(fp) -- load a json file, convert it to a Theme object and return it
+
+    """
+
+    def __init__(self, source_file, fg_color="#BBBBBB", mid_color="#252525", bg_color="#151515"):
+        """Initiate method for Theme
+
+        Positional arguments:
+        source_file -- source file path of the theme
+
+        Keyword arguments:
+        fg_color -- foreground color
+        mid_color -- a color between bg_color and fg_color
+        bg_color -- background color
+
+        """
+        self.fg_color = fg_color
+        self.mid_color = mid_color
+        self.bg_color = bg_color
+        self.source_file = source_file
+
+    @staticmethod
+    def load_from_json(fp):
+        """Load a json file, convert it to a Theme object and return it
+
+        If no file named fp was found then source_file is set to None 
+        and the program uses the hard coded colors.
+        """
+        import json
+        t = Theme(fp)
+        try:
+            with open(fp, 'r') as file:
+                t_dict = json.load(file)
+                t.bg_color = t_dict['bg_color']
+                t.mid_color = t_dict['mid_color']
+                t.fg_color = t_dict['fg_color']
+        except FileNotFoundError:
+            t.fg_color = "#BBBBBB"
+            t.mid_color = "#252525"
+            t.bg_color = "#151515"
+            t.source_file = None
+        return t
+
+
+class ThumbnailCache:
+    """A class for thumbnails of images in a few widths
+
+    Every image is decoded once as a thumbnail as wide as the largest tier.
+    Smaller tiers are scaled from the largest one when they are first used
+    and other widths are scaled from the nearest tier that isn't smaller,
+    so no image is decoded again while the pixmap width slider is dragged.
+    Least recently used pixmaps are evicted when they take more than max_bytes.
+
+    Methods:
+    tier(width) -- return the tier a pixmap of width is scaled from
+    put(key, image) -- add the thumbnail of an image as a QtGui.QImage object
+    get(key, width) -- return the thumbnail of an image scaled to width or None
+    """
+
+    def __init__(self, tiers=(150, 200, 250), max_bytes=48 * 1024 * 1024):
+        """Initiate method for ThumbnailCache
+
+        Keyword arguments:
+        tiers -- widths of the cached pixmaps
+        max_bytes -- memory the cached pixmaps may take in bytes
+        """
+        self.tiers = sorted(tiers)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.pixmaps = OrderedDict()
+
+    def tier(self, width):
+        """Return the smallest tier that is at least width, the largest tier if there is none"""
+        for tier in self.tiers:
+            if tier >= width:
+                return tier
+        return self.tiers[-1]
+
+    def _store(self, key, tier, pixmap):
+        """Store the pixmap of key in tier and evict pixmaps until they fit in max_bytes"""
+        old = self.pixmaps.pop((key, tier), None)
+        if old is not None:
+            self.size -= old.width() * old.height() * old.depth() // 8
+
+        self.pixmaps[key, tier] = pixmap
+        self.size += pixmap.width() * pixmap.height() * pixmap.depth() // 8
+        while self.size > self.max_bytes and len(self.pixmaps) > 1:
+            _, evicted = self.pixmaps.popitem(last=False)
+            self.size -= evicted.width() * evicted.height() * evicted.depth() // 8
+
+    def put(self, key, image):
+        """Add the thumbnail of an image.
+
+        Positional arguments:
+        key -- key of the image, e.g. its path
+        image -- QtGui.QImage object as wide as the largest tier
+        """
+        self._store(key, self.tiers[-1], QtGui.QPixmap.fromImage(image))
+
+    def get(self, key, width):
+        """Return the thumbnail of an image scaled to width, None if it isn't cached.
+
+        Positional arguments:
+        key -- key of the image given to put()
+        width -- width of the returned pixmap
+        """
+        tier = self.tier(width)
+        pixmap = self.pixmaps.get((key, tier))
+        if pixmap is None:
+            # Scale the tier from the smallest larger tier that is still cached
+            larger = [self.pixmaps[key, t] for t in self.tiers if t > tier and (key, t) in self.pixmaps]
+            if not larger:
+                return None
+            pixmap = larger[0].scaledToWidth(tier, QtCore.Qt.SmoothTransformation)
+            self._store(key, tier, pixmap)
+        else:
+            self.pixmaps.move_to_end((key, tier))
+
+        if pixmap.width() == width:
+            return pixmap
+        return pixmap.scaledToWidth(width, QtCore.Qt.SmoothTransformation)
+
+
+class PageListModel(QtCore.QAbstractListModel):
+    """A class for the pages of the pdf file shown by a QtWidgets.QListView
+
+    Row i of the model is page i, which shows the image at order[i] in names.
+    The model holds the lists of the window itself, so reordering pages with
+    drag and drop changes the order the pdf file is created in.
+    Thumbnails are only asked for when the view paints a row, so opening
+    thousands of images creates no widgets or pixmaps up front.
+
+    Methods:
+    set_pages(names, order) -- show a new list of images
+    move_rows(rows, destination) -- move pages in front of the page at destination
+    image_changed(image_index) -- repaint every page that shows an image
+    """
+
+    MIME_TYPE = 'application/x-jpegtopdf-pages'
+
+    def __init__(self, thumbnail_func):
+        """Initiate method for PageListModel
+
+        Positional arguments:
+        thumbnail_func -- function that returns the thumbnail of an image index as a QtGui.QIcon object or None
+        """
+        super().__init__()
+        self.names = []
+        self.order = []
+        self.thumbnail_func = thumbnail_func
+
+    def set_pages(self, names, order):
+        """Show a new list of images.
+
+        Positional arguments:
+        names -- list of names of the images
+        order -- list of indexes of names in the order of the pages, changed in place when pages are moved
+        """
+        self.beginResetModel()
+        self.names = names
+        self.order = order
+        self.endResetModel()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        """Return the number of pages"""
+        return 0 if parent.isValid() else len(self.order)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        """Return the page number and image name or the thumbnail of a page"""
+        if not index.isValid():
+            return None
+
+        image_index = self.order[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            return f'{index.row() + 1}. {self.names[image_index]}'
+        if role == QtCore.Qt.DecorationRole:
+            return self.thumbnail_func(image_index)
+        return None
+
+    def flags(self, index):
+        """Let pages be dragged and dropped between other pages"""
+        if index.isValid():
+            return super().flags(index) | QtCore.Qt.ItemIsDragEnabled
+        return super().flags(index) | QtCore.Qt.ItemIsDropEnabled
+
+    def supportedDropActions(self):
+        """Return the drop actions of the model, pages are only moved"""
+        return QtCore.Qt.MoveAction
+
+    def mimeTypes(self):
+        """Return the MIME type of dragged pages"""
+        return [self.MIME_TYPE]
+
+    def mimeData(self, indexes):
+        """Return the rows of dragged pages as a QtCore.QMimeData object"""
+        rows = sorted({index.row() for index in indexes})
+        data = QtCore.QMimeData()
+        data.setData(self.MIME_TYPE, ','.join(map(str, rows)).encode('ascii'))
+        return data
+
+    def dropMimeData(self, data, action, row, column, parent):
+        """Move dropped pages in front of row, to the end if row is -1.
+
+        False is returned even though the pages were moved,
+        otherwise the view would remove the dragged rows afterwards.
+        """
+        if action != QtCore.Qt.MoveAction or not data.hasFormat(self.MIME_TYPE):
+            return False
+
+        if row == -1:
+            row = parent.row() if parent.isValid() else len(self.order)
+        rows = [int(r) for r in bytes(data.data(self.MIME_TYPE)).decode('ascii').split(',')]
+        self.move_rows(rows, row)
+        return False
+
+    def move_rows(self, rows, destination):
+        """Move pages in front of the page at destination, keeping their order.
+
+        Selected rows follow their pages.
+
+        Positional arguments:
+        rows -- sorted list of rows of the pages to be moved
+        destination -- row the pages are moved in front of, len(order) to move them to the end
+        """
+        self.layoutAboutToBeChanged.emit()
+
+        moved = set(rows)
+        kept = [r for r in range(len(self.order)) if r not in moved]
+        insert_at = destination - sum(1 for r in rows if r < destination)
+        # new_rows[new row] = old row
+        new_rows = kept[:insert_at] + rows + kept[insert_at:]
+        new_position = [0] * len(new_rows)
+        for new, old in enumerate(new_rows):
+            new_position[old] = new
+
+        self.order[:] = [self.order[old] for old in new_rows]
+        for index in self.persistentIndexList():
+            self.changePersistentIndex(index, self.index(new_position[index.row()]))
+
+        self.layoutChanged.emit()
+
+    def image_changed(self, image_index):
+        """Repaint every page that shows the image at image_index"""
+        for row, i in enumerate(self.order):
+            if i == image_index:
+                self.dataChanged.emit(self.index(row), self.index(row), [QtCore.Qt.DecorationRole])
+
+
+class CompressionSignals(QtCore.QObject):
+    """A class for the signals of background work
+
+    Futures call their done callbacks from a thread of the executor,
+    emitting a signal from there passes the future to the GUI thread.
+    """
+    compressed = QtCore.pyqtSignal(object)
+    thumbnail_ready = QtCore.pyqtSignal(object)
+
+
+class ExportThread(QtCore.QThread):
+    """A class to create a pdf file in the background
+
+    jpegtopdf.create_pdf() is called with a log function and a progress function
+    that emit signals, so the window is only updated in the GUI thread.
+    Setting cancel_event stops the export before the next page, without leaving
+    a partial pdf file behind.
+
+    Signals:
+    logged(msg) -- a message was logged
+    summary(line) -- a line of the timing summary was logged
+    progressed(pages added, number of pages) -- a page was added
+    exported(pdf file path, temp files, error) -- the export is over, error is None if it succeeded
+    """
+    logged = QtCore.pyqtSignal(str)
+    summary = QtCore.pyqtSignal(str)
+    progressed = QtCore.pyqtSignal(int, int)
+    exported = QtCore.pyqtSignal(str, object, object)
+
+    def __init__(self, pdf_file_name, images, quality, im_dir, cache, executor=None, timings=False, temp_dir=None):
+        """Initiate method for ExportThread
+
+        Positional arguments:
+        pdf_file_name -- path of the pdf file to be created
+        images -- list of names of the images in the order of the pages
+        quality -- desired JPEG quality
+        im_dir -- directory path of the images
+        cache -- imagecache.CompressionCache object
+
+        Keyword arguments:
+        executor -- concurrent.futures.Executor that compresses images which aren't compressed yet
+        timings -- log a summary of every stage when the export is over
+        temp_dir -- directory of the compressed images, see jpegtopdf.compressed_image_name()
+        """
+        super().__init__()
+        self.pdf_file_name = pdf_file_name
+        self.images = images
+        self.quality = quality
+        self.im_dir = im_dir
+        self.cache = cache
+        self.executor = executor
+        self.timings = timings
+        self.temp_dir = temp_dir
+        self.cancel_event = threading.Event()
+        self.temp_files = set()
+
+    def run(self):
+        """Create the pdf file and emit exported"""
+        log_func = self.logged.emit
+        if self.timings:
+            log_func = instrument.Tracer(self.logged.emit, [instrument.SummarySink(self.summary.emit)])
+
+        error = None
+        try:
+            self.temp_files = jpegtopdf.create_pdf(self.pdf_file_name, self.images, quality=self.quality,
+                                                   im_dir=self.im_dir, log_func=log_func, cache=self.cache,
+                                                   executor=self.executor, progress_func=self.progressed.emit,
+                                                   cancel_event=self.cancel_event, temp_dir=self.temp_dir)
+        except jpegtopdf.ConversionCancelled as e:
+            self.temp_files, error = e.temp_files, e
+        except Exception as e:
+            error = e
+        finally:
+            if isinstance(log_func, instrument.Tracer):
+                log_func.close()
+
+        self.exported.emit(self.pdf_file_name, self.temp_files, error)
+
+
+class Window(QtWidgets.QMainWindow):
+    """Main window class
+
+    This class is the main window of the application.
+
+    Methods:
+    initiate_ui() -- initiate every permament UI component
+    open_file_names_dialog() -- open a dialog to choose one or more files 
+                                of type .jpg or .jpeg  and return the paths
+    on_image_compressed(future) -- update the progress of an image compressed in the background
+    thumbnail_key(image_index) -- return the key of the thumbnail of an image
+    page_thumbnail(image_index) -- return the thumbnail of an image shown by the page list
+    request_thumbnail(image_index) -- decode the thumbnail of an image in the background
+    on_thumbnail_ready(result) -- cache a decoded thumbnail and repaint its pages
+    cancel_compression() -- cancel compressing the images that haven't started yet
+    finish_compression() -- reset the UI after every image is compressed or cancelled
+    log(msg) -- log a message to the log console
+    log_func() -- return the log function passed to jpegtopdf
+    get_quality_input() -- get current quality in the QTextEdit
+    create_pdf() -- open a dialog to save file and export it, or queue it if another export is running
+    start_export(job) -- export a pdf file in the background
+    on_export_progress(done, total) -- show the progress and the remaining time of the export
+    on_exported(pdf_file_name, temp_files, error) -- finish an export and start the next queued one
+    cancel_export() -- cancel the running export
+    closeEvent(*args, **kwargs) -- overridden function from 
+                                   QtWidgets.QMainWindow, do temp cleanup
+
+    """
+
+    def __init__(self, title, theme):
+        """Initiate method for Window.
+
+        Positional arguments:
+        title -- window title
+        theme -- theme of the window
+
+        """
+        super().__init__()
+        self.theme = theme
+        self.action_index = 0
+        self.setGeometry(0, 0, 850, 500)
+
+        self.setMinimumWidth(650)
+        self.setMinimumHeight(400)
+
+        self.temp_files = set()
+        # Compressed images are kept in a directory of this window, see journal.RunDirectory
+        self.run_dir = journal.RunDirectory()
+        self.cache = imagecache.CompressionCache()
+        self.list_images = []
+        self.image_order = []
+
+        # Background compression, futures map to (generation, index of image)
+        self.executor = None
+        self.futures = {}
+        self.generation = 0
+        self.compress_remaining = 0
+        self.compress_log_func = self.log
+        self.compression_signals = CompressionSignals()
+        self.compression_signals.compressed.connect(self.on_image_compressed)
+
+        # Thumbnails decoded by threads in the background, keys map to their futures
+        self.thumbnails = ThumbnailCache()
+        self.thumbnail_executor = ThreadPoolExecutor(max_workers=2)
+        self.thumbnail_futures = {}
+        self.thumbnail_errors = set()
+        self.compression_signals.thumbnail_ready.connect(self.on_thumbnail_ready)
+
+        # Export running in the background and exports queued after it
+        self.export_thread = None
+        self.export_queue = []
+        self.export_start = 0
+
+        self.current_pixmap_width = 100
+
+        self.setWindowTitle(title)
+        self.setStyleSheet(
+            f'background:{theme.bg_color}; color:{theme.fg_color}')
+        self.initiate_ui()
+        self.show()
+        self.log('PROGRAM STARTED SUCCESSFULLY')
+        journal.cleanup_orphans(self.log)
+
+    def initiate_ui(self):
+        """Initiate every permament UI component.
+
+        Every widget is initiated here, open_file_names_dialog()
+        only gives the page list a new list of images.
+
+        """
+        # Main Layout
+        self.layout = QtWidgets.QGridLayout()
+
+        # Top bar
+        self.top_bar = QtWidgets.QFrame()
+        self.top_bar.setStyleSheet(f'background:{self.theme.mid_color}')
+        self.top_bar.setFixedHeight(75)
+        self.layout.addWidget(self.top_bar, 0, 0)
+
+        self.top_bar_layout = QtWidgets.QGridLayout(self.top_bar)
+        self.top_bar_layout.setColumnStretch(2, 4)
+
+        # Title
+        title_font = QtGui.QFont()
+        title_font.setBold(True)
+        title_font.setPointSize(25)
+        self.title_label = QtWidgets.QLabel('JPEG-to-PDF')
+        self.title_label.setFont(title_font)
+
+        # By-line
+        by_font = QtGui.QFont()
+        by_font.setBold(True)
+        by_font.setPointSize(12)
+        self.by_label = QtWidgets.QLabel('by Arda Özcan')
+        self.by_label.setFont(by_font)
+
+        self.top_bar_layout.addWidget(self.title_label, 0, 3)
+        self.top_bar_layout.addWidget(self.by_label, 1, 3)
+
+        # Open files button
+        self.open_files_button = QtWidgets.QPushButton('Open Files...')
+        self.open_files_button.pressed.connect(self.open_file_names_dialog)
+        self.top_bar_layout.addWidget(self.open_files_button, 0, 0)
+
+        # Save button
+        self.save_button = QtWidgets.QPushButton('Save')
+        self.save_button.pressed.connect(self.create_pdf)
+        self.top_bar_layout.addWidget(self.save_button, 1, 0)
+
+        # Quality input
+        self.quality_input = LabelWidgetCouple(
+            'JPEG Quality: ', QtWidgets.QLineEdit('85'))
+        self.quality_input.widget.setValidator(QtGui.QIntValidator())
+        self.top_bar_layout.addLayout(self.quality_input, 0, 1)
+
+        # Timings checkbox
+        self.timings_checkbox = QtWidgets.QCheckBox('Show timings')
+        self.top_bar_layout.addWidget(self.timings_checkbox, 1, 1)
+
+        # Compression progress
+        self.progress_bar = QtWidgets.QProgressBar()
+        self.progress_bar.setFormat('Compressing %v/%m')
+        self.progress_bar.hide()
+
+        self.cancel_button = QtWidgets.QPushButton('Cancel')
+        self.cancel_button.pressed.connect(self.cancel_compression)
+        self.cancel_button.hide()
+
+        self.progress_layout = QtWidgets.QHBoxLayout()
+        self.progress_layout.addWidget(self.progress_bar)
+        self.progress_layout.addWidget(self.cancel_button)
+        self.top_bar_layout.addLayout(self.progress_layout, 0, 2)
+
+        # Export progress
+        self.export_progress_bar = QtWidgets.QProgressBar()
+        self.export_progress_bar.hide()
+
+        self.export_cancel_button = QtWidgets.QPushButton('Cancel')
+        self.export_cancel_button.pressed.connect(self.cancel_export)
+        self.export_cancel_button.hide()
+
+        self.export_layout = QtWidgets.QHBoxLayout()
+        self.export_layout.addWidget(self.export_progress_bar)
+        self.export_layout.addWidget(self.export_cancel_button)
+        self.top_bar_layout.addLayout(self.export_layout, 1, 2)
+
+        # Pixmap width
+        self.pixmap_width_slider = QtWidgets.QSlider()
+        self.pixmap_width_slider.setOrientation(QtCore.Qt.Horizontal)
+        self.pixmap_width_slider.setFixedWidth(self.get_scroll_width())
+        self.pixmap_width_slider.setMaximum(250)
+        self.pixmap_width_slider.setMinimum(150)
+        # Start in the middle
+        self.pixmap_width_slider.setValue(self.pixmap_width_slider.minimum()
+                                          + ((self.pixmap_width_slider.maximum() - self.pixmap_width_slider.minimum()) * 0.5))
+        self.pixmap_width_slider.valueChanged.connect(
+            self.on_pixmap_width_changed)
+
+        # Bottom bar
+        self.bottom_bar = QtWidgets.QFrame()
+        self.bottom_bar.setStyleSheet(f'background:{self.theme.bg_color}')
+        self.layout.addWidget(self.bottom_bar, 1, 0)
+
+        self.bottom_bar_layout = QtWidgets.QGridLayout(self.bottom_bar)
+        self.bottom_bar_right_layout = QtWidgets.QGridLayout()
+
+        # Log console
+        self.log_console = QtWidgets.QTextEdit()
+        self.log_console.setStyleSheet(f'background:{self.theme.mid_color}')
+        self.log_console.setFocusPolicy(QtCore.Qt.NoFocus)
+
+        self.bottom_bar_right_layout.addWidget(self.log_console, 0, 0)
+
+        self.bottom_bar_layout.addLayout(self.bottom_bar_right_layout, 0, 1)
+
+        # Page list, pages are reordered by dragging them
+        self.page_model = PageListModel(self.page_thumbnail)
+        self.page_list = QtWidgets.QListView()
+        self.page_list.setModel(self.page_model)
+        self.page_list.setUniformItemSizes(True)
+        self.page_list.setWordWrap(True)
+        self.page_list.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+        self.page_list.setDragDropMode(QtWidgets.QAbstractItemView.InternalMove)
+        self.page_list.setDefaultDropAction(QtCore.Qt.MoveAction)
+        self.bottom_bar_layout.addWidget(self.page_list, 0, 0)
+        self.bottom_bar_layout.addWidget(self.pixmap_width_slider, 1, 0)
+
+        self.w = QtWidgets.QWidget()
+        self.setCentralWidget(self.w)
+        self.w.setLayout(self.layout)
+
+        # Size the page list after the initial value of the slider
+        self.on_pixmap_width_changed(self.pixmap_width_slider.value())
+
+    def on_pixmap_width_changed(self, v):
+        """Change related widgets according to pixmap width slider
+        
+        This is called when self.pixmap_width_slider 's value changes.
+        
+        Positional arguments:
+        v -- new value
+        """
+        self.current_pixmap_width = v
+        self.page_list.setFixedWidth(self.get_scroll_width())
+        self.pixmap_width_slider.setFixedWidth(self.get_scroll_width())
+        self.set_page_size()
+
+    def set_page_size(self):
+        """Size every row of the page list after the current pixmap width.
+
+        Rows are laid out in a grid of equal cells, tall enough for portrait pages,
+        so the view never measures a row and only paints the visible ones.
+        """
+        width = self.current_pixmap_width
+        self.page_list.setIconSize(QtCore.QSize(width, round(width * 1.5)))
+        self.page_list.setGridSize(QtCore.QSize(self.get_scroll_width() - 24, round(width * 1.5) + 8))
+
+    def thumbnail_key(self, image_index):
+        """Return the key of the thumbnail of the image at image_index, the path of the image"""
+        return os.path.join(self.image_dir, self.list_images[image_index])
+
+    def page_thumbnail(self, image_index):
+        """Return the thumbnail of the image at image_index as a QtGui.QIcon object for the page list.
+
+        If the thumbnail isn't cached, None is returned and it is requested,
+        its pages are repainted when it is ready.
+
+        Positional arguments:
+        image_index -- index of the image in self.list_images
+        """
+        key = self.thumbnail_key(image_index)
+        pixmap = self.thumbnails.get(key, self.current_pixmap_width)
+        if pixmap is None:
+            if key not in self.thumbnail_errors:
+                self.request_thumbnail(image_index)
+            return None
+        return QtGui.QIcon(pixmap)
+
+    def request_thumbnail(self, image_index):
+        """Decode the thumbnail of the image at image_index in the background.
+
+        Positional arguments:
+        image_index -- index of the image in self.list_images
+        """
+        key = self.thumbnail_key(image_index)
+        if key in self.thumbnail_futures:
+            return
+
+        future = self.thumbnail_executor.submit(jpegtopdf.make_thumbnail, self.image_dir,
+                                                self.list_images[image_index], self.thumbnails.tiers[-1])
+        self.thumbnail_futures[key] = future
+        future.add_done_callback(
+            lambda f: self.compression_signals.thumbnail_ready.emit((key, image_index, f)))
+
+    def on_thumbnail_ready(self, result):
+        """Cache a thumbnail decoded in the background and repaint every page of its image.
+
+        Positional arguments:
+        result -- (key, image index, concurrent.futures.Future object of jpegtopdf.make_thumbnail())
+        """
+        key, image_index, future = result
+        if self.thumbnail_futures.get(key) is future:
+            del self.thumbnail_futures[key]
+        if future.cancelled():
+            return
+
+        if future.exception() is not None:
+            self.log(f'FAILED TO READ {key}: {future.exception()}')
+            self.thumbnail_errors.add(key)
+        else:
+            width, height, pixels = future.result()
+            # copy() makes the image own its pixels, which are only borrowed from pixels otherwise
+            image = QtGui.QImage(pixels, width, height, width * 3, QtGui.QImage.Format_RGB888).copy()
+            self.thumbnails.put(key, image)
+
+        # Images of an earlier open_file_names_dialog() call aren't shown anymore
+        if image_index < len(self.list_images) and self.thumbnail_key(image_index) == key:
+            self.page_model.image_changed(image_index)
+
+    def open_file_names_dialog(self):
+        """Open a 'Open files' dialog and update everything accordingly
+
+        This method opens a dialog to get input files. 
+        If the return value is None, this method returns as well.
+        If the operation was successful, this method continues to 
+        update every widget and variable accordingly. 
+        Images are compressed by a pool of worker processes in the background.
+        Thumbnails are decoded by threads when their pages are first shown.
+        """
+        files, _ = QtWidgets.QFileDialog.getOpenFileNames(
+            self, "Choose files", "", "JPEG Files (*.jpg; *.jpeg)")
+
+        if not files:
+            return
+
+        # Results of images that are still being compressed are ignored from now on
+        self.cancel_compression()
+        self.generation += 1
+        self.compress_log_func = self.log_func()
+
+        # Thumbnails that are still waiting to be decoded for earlier images aren't needed anymore
+        for future in list(self.thumbnail_futures.values()):
+            future.cancel()
+
+        # Update self.image_dir and self.list_images
+        self.image_dir = os.path.split(files[0])[0]
+        self.list_images = [os.path.split(f)[1] for f in files]
+
+        # List to hold image indexes of pages, reordered by the page list
+        self.image_order = [i for i in range(len(self.list_images))]
+        self.page_model.set_pages(self.list_images, self.image_order)
+
+        self.compress_remaining = len(self.list_images)
+        self.progress_bar.setRange(0, len(self.list_images))
+        self.progress_bar.setValue(0)
+        self.progress_bar.show()
+        self.cancel_button.show()
+        self.save_button.setEnabled(False)
+
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor()
+
+        quality = self.get_quality_input()
+        trace = instrument.is_recording(self.compress_log_func)
+        for i, name in enumerate(self.list_images):
+            future = self.executor.submit(jpegtopdf._compress_task, self.image_dir, name,
+                                          quality, self.cache, None, self.run_dir.path, trace)
+            self.futures[future] = (self.generation, i)
+            future.add_done_callback(self.compression_signals.compressed.emit)
+
+    def on_image_compressed(self, future):
+        """Log an image compressed in the background and update the progress.
+
+        This is called in the GUI thread for every future submitted by open_file_names_dialog(),
+        including cancelled ones. Compressed files are always added to self.temp_files,
+        but images of an earlier generation are not logged.
+
+        Positional arguments:
+        future -- concurrent.futures.Future object of jpegtopdf._compress_task()
+        """
+        generation, index = self.futures.pop(future, (None, None))
+        if generation is None or future.cancelled():
+            return
+
+        error = future.exception()
+        if error is None:
+            path, recorder = future.result()
+            self.temp_files.add(path)
+
+        if generation != self.generation:
+            return
+
+        name = os.path.join(self.image_dir, self.list_images[index])
+        if error is None:
+            instrument.merge(self.compress_log_func, recorder)
+            self.compress_log_func(f'COMPRESSED {name}')
+        else:
+            self.compress_log_func(f'FAILED TO COMPRESS {name}: {error}')
+
+        self.compress_remaining -= 1
+        self.progress_bar.setValue(self.progress_bar.value() + 1)
+        if self.compress_remaining == 0:
+            self.finish_compression()
+
+    def cancel_compression(self):
+        """Cancel compressing the images that haven't started yet.
+
+        Images that are being compressed are finished by the workers but not shown.
+        Pages without a compressed image are compressed when the pdf is created.
+        """
+        if self.compress_remaining == 0:
+            return
+
+        for future, (generation, _) in list(self.futures.items()):
+            if generation == self.generation:
+                future.cancel()
+
+        self.compress_log_func(f'CANCELLED COMPRESSING {self.compress_remaining} IMAGES')
+
+        self.generation += 1
+        self.finish_compression()
+
+    def finish_compression(self):
+        """Hide the progress of compression and enable saving again"""
+        self.compress_remaining = 0
+        self.progress_bar.hide()
+        self.cancel_button.hide()
+        self.save_button.setEnabled(True)
+
+        if isinstance(self.compress_log_func, instrument.Tracer):
+            self.compress_log_func.close()
+        self.compress_log_func = self.log
+
+    def log(self, msg):
+        """Log a message to the log console using format [{self.action_index}][{date}]: {msg}.
+
+        Positional arguments:
+        msg -- message to be logged
+        """
+        date = str(datetime.datetime.now()).split('.')[0]
+        prompt = f'[{"{:05d}".format(self.action_index)}][{date}]: '
+        # Used HTML tags to create both bold and regular text in one line
+        self.log_console.append(f'<b>{prompt}</b> <h>{msg}</h>')
+        self.action_index += 1
+
+    def log_summary(self, line):
+        """Append a line of a timing summary to the log console without a prompt, keeping its columns aligned"""
+        self.log_console.append(f'<pre>{line}</pre>')
+
+    def log_func(self):
+        """Return the log function passed to jpegtopdf.
+
+        If 'Show timings' is checked, an instrument.Tracer object is returned
+        that logs to the log console as well and appends a summary of every
+        stage when its close() method is called. self.log is returned otherwise.
+        """
+        if not self.timings_checkbox.isChecked():
+            return self.log
+        return instrument.Tracer(self.log, [instrument.SummarySink(self.log_summary)])
+
+    def get_quality_input(self):
+        """Get the current input from the QTextEdit"""
+        try:
+            quality = int(self.quality_input.widget.text())
+        except ValueError:
+            quality = 85
+
+        return quality
+
+    def get_scroll_width(self):
+        """Return the width of the page list, room for the thumbnails, the page names and the scroll bar"""
+        return self.current_pixmap_width + 196
+
+    def create_pdf(self):
+        """Export the pages to a pdf file in the background.
+
+        The pages, quality and directory are taken when the file is chosen,
+        so they can be changed while the file is exported. If another export
+        is running, the file is queued and exported after it.
+        """
+        if not self.list_images:
+            return
+
+        pdf_file_name, _ = QtWidgets.QFileDialog.getSaveFileName(
+            self, "Save file", "", "PDF File (*.pdf)")
+
+        if not pdf_file_name:
+            return
+
+        if not pdf_file_name.endswith('.pdf'):
+            pdf_file_name += '.pdf'
+
+        job = (pdf_file_name, [self.list_images[i] for i in self.image_order],
+               self.get_quality_input(), self.image_dir)
+        if self.export_thread is not None:
+            self.export_queue.append(job)
+            self.log(f'QUEUED {pdf_file_name}')
+            return
+
+        self.start_export(job)
+
+    def start_export(self, job):
+        """Export a pdf file in the background.
+
+        Images that aren't compressed yet are compressed by self.executor.
+
+        Positional arguments:
+        job -- (pdf file path, list of names of the images in page order, quality, directory of the images)
+        """
+        pdf_file_name, images, quality, im_dir = job
+        self.export_thread = ExportThread(pdf_file_name, images, quality, im_dir, self.cache,
+                                          executor=self.executor,
+                                          timings=self.timings_checkbox.isChecked(),
+                                          temp_dir=self.run_dir.path)
+        self.export_thread.logged.connect(self.log)
+        self.export_thread.summary.connect(self.log_summary)
+        self.export_thread.progressed.connect(self.on_export_progress)
+        self.export_thread.exported.connect(self.on_exported)
+
+        self.export_start = time.perf_counter()
+        self.export_progress_bar.setRange(0, len(images))
+        self.export_progress_bar.setValue(0)
+        self.export_progress_bar.setFormat(f'Exporting 0/{len(images)}')
+        self.export_progress_bar.show()
+        self.export_cancel_button.show()
+        self.export_thread.start()
+
+    def on_export_progress(self, done, total):
+        """Show the progress and the estimated remaining time of the running export.
+
+        Positional arguments:
+        done -- number of pages added
+        total -- number of pages
+        """
+        elapsed = time.perf_counter() - self.export_start
+        remaining = elapsed / done * (total - done)
+        self.export_progress_bar.setValue(done)
+        self.export_progress_bar.setFormat(f'Exporting {done}/{total}, {remaining:.0f}s left')
+
+    def on_exported(self, pdf_file_name, temp_files, error):
+        """Finish an export and start the next queued one.
+
+        Temp files created by the export are unioned with self.temp_files to be used in temp_cleanup.
+        If the user is using Windows, a dialog appears and 
+        asks if the user wants to see the exported file in the explorer. 
+        If the user says yes, it is shown.
+
+        Positional arguments:
+        pdf_file_name -- path of the pdf file
+        temp_files -- set of temp files created by the export
+        error -- exception raised by the export, None if it succeeded
+        """
+        if self.export_thread is None:
+            # Already collected by closeEvent()
+            return
+
+        self.temp_files = self.temp_files.union(temp_files)
+        self.export_thread.wait()
+        self.export_thread = None
+
+        if isinstance(error, jpegtopdf.ConversionCancelled):
+            self.log(f'CANCELLED EXPORTING {pdf_file_name}')
+        elif error is not None:
+            self.log(f'FAILED TO EXPORT {pdf_file_name}: {error}')
+
+        if self.export_queue:
+            self.start_export(self.export_queue.pop(0))
+        else:
+            self.export_progress_bar.hide()
+            self.export_cancel_button.hide()
+
+        if error is None and platform.system() == "Windows":
+            buttons = QtWidgets.QMessageBox.No | QtWidgets.QMessageBox.Yes
+            msg = QtWidgets.QMessageBox.question(
+                self, 'JPEG-to-PDF', 'Do you want to see the exported file in the explorer?', buttons,
+                QtWidgets.QMessageBox.No)
+
+            if msg == QtWidgets.QMessageBox.Yes:
+                jpegtopdf.show_file_in_explorer(pdf_file_name)
+
+    def cancel_export(self):
+        """Cancel the running export, queued exports are started after it"""
+        if self.export_thread is not None:
+            self.export_thread.cancel_event.set()
+
+    def closeEvent(self, *args, **kwargs):
+        """Stop background compression, clean temp files up and trim the compression cache in close event.
+        Note: If the application is forcibly closed, this cleanup can't be done here,
+        the temp files are removed by journal.cleanup_orphans() the next time a conversion starts.
+        """
+        self.export_queue.clear()
+        if self.export_thread is not None:
+            self.export_thread.cancel_event.set()
+            self.export_thread.wait()
+            # on_exported() may not be called anymore, so temp files of the export are collected here
+            self.temp_files = self.temp_files.union(self.export_thread.temp_files)
+            self.export_thread = None
+
+        self.cancel_compression()
+        for future in list(self.thumbnail_futures.values()):
+            future.cancel()
+        self.thumbnail_executor.shutdown(wait=True)
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            # Futures whose results haven't reached on_image_compressed() yet
+            for future in list(self.futures):
+                if not future.cancelled() and future.exception() is None:
+                    self.temp_files.add(future.result()[0])
+            self.futures.clear()
+
+        jpegtopdf.temp_cleanup(self.temp_files, self.log)
+        self.run_dir.release()
+        self.cache.evict()
+        super(QtWidgets.QMainWindow, self).closeEvent(*args, **kwargs)
+
+
+if __name__ == '__main__':
+
+    # Needed by the worker processes of the frozen Windows binary
+    multiprocessing.freeze_support()
+    app = QtWidgets.QApplication(sys.argv)
+    app.setStyle('Fusion')
+    w = Window('JPEG-to-PDF', Theme.load_from_json('theme.json'))
+    sys.exit(app.exec_())
@@ -0,0 +1,489 @@
+import os
+import time
+import shutil
+import struct
+import ctypes
+import select
+import datetime
+import ctypes.util
+from concurrent.futures import ProcessPoolExecutor
+import cli
+import journal
+import jpegtopdf
+import imagecache
+
+# Extensions of the files that are converted, other files in the directory are left alone
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg')
+
+# Seconds between two listings of the directory when it is polled
+DEFAULT_POLL_INTERVAL = 1.0
+
+# inotify events, a file that was written and closed or moved into the directory, and a lost event queue
+IN_CLOSE_WRITE = 0x08
+IN_MOVED_TO = 0x80
+IN_Q_OVERFLOW = 0x4000
+
+# struct inotify_event without its name: watch descriptor, mask, cookie and length of the name
+EVENT_FORMAT = 'iIII'
+EVENT_SIZE = struct.calcsize(EVENT_FORMAT)
+
+
+def is_image(name):
+    """Return True if a file name is an image to convert, hidden and partially copied files are skipped
+
+    Positional arguments:
+    name -- name of the file
+    """
+    return not name.startswith('.') and name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def file_state(path):
+    """Return (size, modification time) of a file, None if it doesn't exist anymore
+
+    Positional arguments:
+    path -- path of the file
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def list_images(directory):
+    """Return the names of the images in a directory, sorted
+
+    Positional arguments:
+    directory -- path of the directory
+    """
+    return sorted(entry.name for entry in os.scandir(directory) if entry.is_file() and is_image(entry.name))
+
+
+class PollingWatcher:
+    """A class to notice new images in a directory by listing it again and again
+
+    An image is reported once its size and modification time are the same in two listings
+    at least interval seconds apart, so files that are still being written are not reported.
+    An image is reported again if it changes.
+
+    Methods:
+    wait(timeout) -- return the names of the images that arrived, an empty list after timeout seconds
+    close() -- stop watching
+    """
+
+    def __init__(self, directory, interval=DEFAULT_POLL_INTERVAL):
+        """Initiate method for PollingWatcher
+
+        Positional arguments:
+        directory -- path of the directory to watch
+
+        Keyword arguments:
+        interval -- seconds between two listings
+        """
+        self.directory = directory
+        self.interval = interval
+        # States in the last listing and states that were reported, name -> (size, modification time)
+        self.listed = {}
+        self.reported = {}
+        self.listed_at = None
+
+    def _scan(self):
+        """List the directory and return the images that didn't change since the last listing"""
+        states = {}
+        for name in list_images(self.directory):
+            state = file_state(os.path.join(self.directory, name))
+            if state is not None:
+                states[name] = state
+
+        ready = [name for name, state in states.items()
+                 if self.listed.get(name) == state and self.reported.get(name) != state]
+        for name in ready:
+            self.reported[name] = states[name]
+        self.reported = {name: state for name, state in self.reported.items() if name in states}
+        self.listed = states
+        self.listed_at = time.monotonic()
+        return ready
+
+    def wait(self, timeout=None):
+        """Return the names of the images that arrived, an empty list if none did in timeout seconds
+
+        Keyword arguments:
+        timeout -- seconds to wait, None to wait until an image arrives
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            now = time.monotonic()
+            delay = 0 if self.listed_at is None else self.listed_at + self.interval - now
+            if deadline is not None and now + delay > deadline:
+                time.sleep(max(0, deadline - now))
+                return []
+            if delay > 0:
+                time.sleep(delay)
+
+            ready = self._scan()
+            if ready:
+                return ready
+
+    def close(self):
+        """Stop watching, a polling watcher holds nothing"""
+
+
+class InotifyWatcher:
+    """A class to notice new images in a directory through inotify, without listing it
+
+    Images are reported when they are closed after writing or moved into the directory,
+    so scanners that write a temp file and rename it are reported once. The images already
+    in the directory are reported by the first call of wait(), and the directory is listed
+    again if the kernel dropped events.
+    Raises OSError if inotify isn't available, see open_watcher().
+
+    Methods:
+    wait(timeout) -- return the names of the images that arrived, an empty list after timeout seconds
+    close() -- stop watching
+    """
+
+    def __init__(self, directory):
+        """Initiate method for InotifyWatcher
+
+        Positional arguments:
+        directory -- path of the directory to watch
+        """
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, os.strerror(error), directory)
+
+        self.directory = directory
+        self.rescan = True
+
+    def _events(self, data):
+        """Return the names of the images in a buffer of inotify events, set rescan if events were dropped"""
+        names = []
+        offset = 0
+        while offset + EVENT_SIZE <= len(data):
+            _, mask, _, length = struct.unpack_from(EVENT_FORMAT, data, offset)
+            name = os.fsdecode(data[offset + EVENT_SIZE:offset + EVENT_SIZE + length].rstrip(b'\0'))
+            offset += EVENT_SIZE + length
+            if mask & IN_Q_OVERFLOW:
+                self.rescan = True
+            elif is_image(name) and name not in names and os.path.isfile(os.path.join(self.directory, name)):
+                names.append(name)
+        return names
+
+    def wait(self, timeout=None):
+        """Return the names of the images that arrived, an empty list if none did in timeout seconds
+
+        Keyword arguments:
+        timeout -- seconds to wait, None to wait until an image arrives
+        """
+        names = []
+        if not self.rescan:
+            readable, _, _ = select.select([self.fd], [], [], timeout)
+            if readable:
+                try:
+                    names = self._events(os.read(self.fd, 64 * 1024))
+                except BlockingIOError:
+                    pass
+
+        if self.rescan:
+            self.rescan = False
+            names += [name for name in list_images(self.directory) if name not in names]
+        return names
+
+    def close(self):
+        """Stop watching and close the inotify descriptor"""
+        os.close(self.fd)
+
+
+def open_watcher(directory, interval=None):
+    """Return an InotifyWatcher object for a directory, a PollingWatcher object if inotify isn't available
+
+    Positional arguments:
+    directory -- path of the directory to watch
+
+    Keyword arguments:
+    interval -- seconds between two listings, polls even if inotify is available if it is given
+    """
+    if interval is None:
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError, TypeError):
+            # No inotify, e.g. on Windows and macOS
+            pass
+    return PollingWatcher(directory, DEFAULT_POLL_INTERVAL if interval is None else interval)
+
+
+class FolderWatch:
+    """A class to convert the images dropped into a directory into one pdf file per batch
+
+    Every image is compressed by the workers of an executor as soon as it arrives, so when a
+    batch is due only its last images and the assembly of the pdf file are left. A batch is due
+    when it has batch_size images or no image arrived for quiet seconds. Its pages are in the
+    order the images arrived in. Images of a converted batch are moved into done_dir, images
+    that fail are left in the directory and retried when they change.
+
+    Methods:
+    arrived(names) -- start compressing images that arrived
+    due() -- return True if the pending images should be converted now
+    convert() -- convert the pending images into a pdf file and return its path
+    run(stop_event) -- watch the directory and convert batches until stop_event is set
+    close() -- stop watching and remove the temp files
+    """
+
+    def __init__(self, directory, output, options, log_func, executor, cache=None, quiet=10.0,
+                 batch_size=None, done_dir=None, interval=None, print_func=print):
+        """Initiate method for FolderWatch
+
+        Positional arguments:
+        directory -- path of the directory to watch
+        output -- path of the pdf files without .pdf, {output}-{date}-{time}.pdf is written for every batch,
+                  or the pdf file every batch is added to if append is in options
+        options -- dictionary of jpegtopdf.create_pdf() keyword arguments, see cli.conversion_options()
+        log_func -- log function
+        executor -- concurrent.futures.Executor that compresses the images
+
+        Keyword arguments:
+        cache -- imagecache.CompressionCache object, None to always compress
+        quiet -- seconds without a new image after which a batch is converted
+        batch_size -- number of images after which a batch is converted, None for no limit
+        done_dir -- directory converted images are moved into, {directory}/done if None
+        interval -- seconds between two listings of the directory, inotify is used if it is None and available
+        print_func -- function called with a line for every pdf file written
+        """
+        self.directory = directory
+        self.output = output[:-len('.pdf')] if output.endswith('.pdf') else output
+        self.options = options
+        self.log_func = log_func
+        self.executor = executor
+        self.cache = cache
+        self.quiet = quiet
+        self.batch_size = batch_size
+        self.done_dir = done_dir or os.path.join(directory, 'done')
+        self.print_func = print_func
+        self.watcher = open_watcher(directory, interval)
+        self.run_dir = journal.RunDirectory()
+
+        self.max_size = jpegtopdf.target_size(options.get('max_dim'), options.get('dpi'),
+                                              options.get('page_size', 'A4'))
+        self.color_reduction = jpegtopdf.color_settings(options.get('gray_tolerance'), options.get('bitonal'))
+        self.quality = options.get('quality', 85)
+        self.memory_budget = options.get('memory_budget')
+
+        # Images of the next batch in the order they arrived, name -> dictionary of
+        # state, the compressed file, the future compressing it and its estimated memory
+        self.pending = {}
+        # Images waiting for memory_budget
+        self.queued = []
+        self.last_arrival = None
+
+    def _precompress(self, name):
+        """Return (compressed file, size, memory) of an image, None if create_pdf() has to choose how to compress it"""
+        if self.options.get('target_bytes') is not None:
+            # Qualities are chosen from the sizes of the whole batch
+            return None
+        if self.options.get('passthrough') and jpegtopdf.passthrough_source(self.directory, name, self.quality,
+                                                                            self.max_size):
+            return None
+
+        max_size = self.max_size
+        cost = 0
+        if self.memory_budget is not None:
+            max_size = jpegtopdf.fit_memory_budget(self.directory, [name], self.max_size, self.memory_budget,
+                                                   self.log_func).get(name, self.max_size)
+            cost = jpegtopdf.estimate_memory(os.path.join(self.directory, name), max_size)
+        return jpegtopdf.compressed_image_name(name, self.quality, max_size, self.run_dir.path,
+                                               self.color_reduction), max_size, cost
+
+    def _submit(self):
+        """Hand queued images to the executor while their memory fits in memory_budget"""
+        while self.queued:
+            entry = self.pending.get(self.queued[0])
+            if entry is None:
+                self.queued.pop(0)
+                continue
+            if self.memory_budget is not None:
+                running = sum(other['cost'] for other in self.pending.values()
+                              if other['future'] is not None and not other['future'].done())
+                if running and running + entry['cost'] > self.memory_budget:
+                    return
+
+            name = self.queued.pop(0)
+            entry['future'] = self.executor.submit(jpegtopdf._compress_task, self.directory, name, self.quality,
+                                                   self.cache, entry['max_size'], self.run_dir.path, False,
+                                                   self.color_reduction)
+
+    def _forget(self, name):
+        """Wait for the compression of a pending image to end and remove its compressed file"""
+        entry = self.pending.pop(name)
+        if entry['future'] is not None:
+            entry['future'].cancel()
+            try:
+                entry['future'].result()
+            except Exception:
+                pass
+        if entry['path'] is not None and os.path.isfile(entry['path']):
+            os.remove(entry['path'])
+
+    def arrived(self, names):
+        """Start compressing images that arrived, images that changed are compressed again
+
+        Positional arguments:
+        names -- names of the image files in the directory
+        """
+        for name in names:
+            state = file_state(os.path.join(self.directory, name))
+            if state is None or (name in self.pending and self.pending[name]['state'] == state):
+                continue
+            if name in self.pending:
+                self._forget(name)
+
+            self.log_func(f'ARRIVED {os.path.join(self.directory, name)}')
+            self.last_arrival = time.monotonic()
+            try:
+                precompressed = self._precompress(name)
+            except OSError as e:
+                self.log_func(f'SKIPPING {os.path.join(self.directory, name)}: {e}')
+                continue
+
+            path, max_size, cost = precompressed or (None, None, 0)
+            self.pending[name] = {'state': state, 'path': path, 'max_size': max_size, 'cost': cost, 'future': None}
+            if path is not None:
+                self.queued.append(name)
+        self._submit()
+
+    def due(self):
+        """Return True if the pending images should be converted now"""
+        if not self.pending:
+            return False
+        if self.batch_size is not None and len(self.pending) >= self.batch_size:
+            return True
+        return time.monotonic() - self.last_arrival >= self.quiet
+
+    def timeout(self):
+        """Return the seconds until the pending images are due, None if there are none"""
+        if not self.pending:
+            return None
+        return max(0, self.last_arrival + self.quiet - time.monotonic())
+
+    def _batch_name(self):
+        """Return a name for the next batch that no pdf file or done directory has yet"""
+        stem = f'{os.path.basename(self.output)}-{datetime.datetime.now().strftime("%Y%m%d-%H%M%S")}'
+        name, counter = stem, 1
+        while os.path.exists(os.path.join(os.path.dirname(self.output), name + '.pdf')) or \
+                os.path.exists(os.path.join(self.done_dir, name)):
+            counter += 1
+            name = f'{stem}-{counter}'
+        return name
+
+    def convert(self):
+        """Convert the pending images into a pdf file, move them into done_dir and return the path of the file
+
+        Images that failed to compress are left out and stay in the directory.
+        Returns None if no image is left or the conversion failed.
+        """
+        names = list(self.pending)
+        if self.batch_size is not None:
+            names = names[:self.batch_size]
+
+        batch = []
+        for name in names:
+            entry = self.pending[name]
+            if entry['future'] is None and entry['path'] is not None:
+                # Still waiting for memory, create_pdf() compresses it
+                self.queued.remove(name)
+            elif entry['future'] is not None:
+                try:
+                    entry['future'].result()
+                except Exception as e:
+                    self.log_func(f'FAILED TO COMPRESS {os.path.join(self.directory, name)}: {e}')
+                    self._forget(name)
+                    continue
+            if file_state(os.path.join(self.directory, name)) != entry['state']:
+                # Changed while it was compressed, it is reported again when it is written
+                self._forget(name)
+                continue
+            batch.append(name)
+        if not batch:
+            return None
+
+        batch_name = self._batch_name()
+        if self.options.get('append'):
+            pdf_path = self.output + '.pdf'
+        else:
+            pdf_path = os.path.join(os.path.dirname(self.output), batch_name + '.pdf')
+
+        temps = set()
+        try:
+            temps = jpegtopdf.create_pdf(pdf_path, batch, im_dir=self.directory, log_func=self.log_func,
+                                         executor=self.executor, cache=self.cache, temp_dir=self.run_dir.path,
+                                         **self.options)
+        except Exception as e:
+            self.log_func(f'FAILED TO CONVERT {len(batch)} IMAGES INTO {pdf_path}: {type(e).__name__}: {e}')
+            for name in batch:
+                self._forget(name)
+            return None
+        finally:
+            jpegtopdf.temp_cleanup([path for path in temps if os.path.isfile(path)], self.log_func)
+
+        done_path = os.path.join(self.done_dir, batch_name)
+        os.makedirs(done_path, exist_ok=True)
+        for name in batch:
+            self._forget(name)
+            shutil.move(os.path.join(self.directory, name), os.path.join(done_path, name))
+        self.log_func(f'MOVED {len(batch)} IMAGES TO {done_path}')
+        self.print_func(f'{pdf_path} ({len(batch)} pages)')
+        return pdf_path
+
+    def run(self, stop_event=None):
+        """Watch the directory and convert every batch that is due until stop_event is set
+
+        Keyword arguments:
+        stop_event -- threading.Event object that stops watching when it is set, None to watch until interrupted
+        """
+        self.log_func(f'WATCHING {self.directory} WITH {type(self.watcher).__name__}')
+        while stop_event is None or not stop_event.is_set():
+            # Wake up at least every second so stop_event is noticed
+            timeout = self.timeout()
+            self.arrived(self.watcher.wait(1.0 if timeout is None else min(timeout, 1.0)))
+            while self.due():
+                self.convert()
+
+    def close(self):
+        """Stop watching, wait for the images being compressed and remove the temp files"""
+        self.watcher.close()
+        for name in list(self.pending):
+            self._forget(name)
+        self.run_dir.release()
+
+
+def run(args, log_func):
+    """Watch the directory of parsed arguments and convert the images dropped into it until interrupted.
+
+    Temp files left by conversions that died are removed first, see journal.cleanup_orphans().
+
+    Positional arguments:
+    args -- argparse.Namespace returned by the parser of cli.build_parser(), with watch set
+    log_func -- log function
+    """
+    cli.resolve_paths(args, os.getcwd())
+    journal.cleanup_orphans(log_func)
+
+    compression_cache = None
+    if args.cache or args.cache_dir is not None:
+        compression_cache = imagecache.CompressionCache(args.cache_dir, args.cache_mb * 1024 * 1024)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        folder = FolderWatch(args.watch, args.pdf_file_name, cli.conversion_options(args), log_func, executor,
+                             cache=compression_cache, quiet=args.quiet, batch_size=args.batch_size,
+                             done_dir=args.done_dir, interval=args.poll)
+        try:
+            folder.run()
+        except KeyboardInterrupt:
+            log_func(f'STOPPED WATCHING {args.watch}, {len(folder.pending)} IMAGES WERE NOT CONVERTED')
+        finally:
+            folder.close()